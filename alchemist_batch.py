@@ -0,0 +1,214 @@
+# Headless batch import and rendering of Alchemist traces, without the GUI
+#
+#   blender [scene.blend] --background --python alchemist_batch.py -- [options]
+#
+# Options:
+#   --walls FILE.wal     walls to draw (as a single mesh, merged)
+#   --nodes FILE.nod     nodes to import (as a point cloud by default, see --node-mode)
+#   --grads FILE.gra     gradients to import (as spheres, as a surface with --surface, as a field with --field)
+#   --frames START-END   frames to render (default: every frame of the traces)
+#   --output PATH        render output path, as in the Output panel (default: the one of the scene)
+#   --processes N        split the frames across N background Blender processes
+#   --no-render          only import (and save, with --save)
+#   --save FILE.blend    save the scene after the import
+#   --report FILE.json   write the import profiles and the frame handler latency (see alchemist_profile)
+#
+# Every process prints a line starting with BATCH_REPORT followed by a JSON report: frames rendered, import and
+# render seconds, frames per second, update cost of every layer (see alchemist_layers). With more processes, the
+# first one only prepares the trace caches, starts the others on consecutive slices of the frames and sums up their
+# reports; the one rendering the first slice saves the scene and writes the profiles, with --save and --report.
+
+import os, sys, json, time, argparse, subprocess, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bpy
+import alchemist_trace, alchemist_profile, alchemist_layers
+
+REPORT_TAG = "BATCH_REPORT"
+
+# Command line options (after '--')
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(prog="alchemist_batch.py", description="Import and render Alchemist traces")
+    parser.add_argument("--walls", help="Walls file (.wal)")
+    parser.add_argument("--nodes", help="Nodes file (.nod)")
+    parser.add_argument("--grads", help="Gradients file (.gra)")
+    parser.add_argument("--surface", action="store_true", help="Import the gradients as a surface")
+    parser.add_argument("--field", action="store_true",
+                        help="Import the gradients as a plane displaced by a rasterized field (see alchemist_field)")
+    parser.add_argument("--node-mode", default="CLOUD", choices=("HANDLER", "BAKE", "CLOUD"),
+                        help="How the nodes are animated (see alchemist_nodes.importNodes)")
+    parser.add_argument("--stride", type=int, default=1, help="Import one step every STRIDE")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="Play SPEED units of simulation time every second, interpolating between steps (0: a step every frame)")
+    parser.add_argument("--frames", help="Frames to render, as START-END")
+    parser.add_argument("--output", help="Render output path")
+    parser.add_argument("--processes", type=int, default=1, help="Background Blender processes rendering the frames")
+    parser.add_argument("--no-render", action="store_true", help="Do not render")
+    parser.add_argument("--save", help="Save the scene to this .blend file")
+    parser.add_argument("--report", help="Write the import profiles to this JSON file")
+    return parser.parse_args(argv)
+
+# Couple (start, end) of a START-END range
+def parseFrames(text):
+    start, end = text.split("-")
+    return int(start), int(end)
+
+# Slices of consecutive frames of [start, end] for 'count' processes
+def splitFrames(start, end, count):
+    total = end - start + 1
+    count = max(min(count, total), 1)
+    slices = []
+    for i in range(count):
+        first = start + total * i // count
+        last = start + total * (i+1) // count - 1
+        slices.append((first, last))
+    return slices
+
+# Import the files of the command line into the current scene; returns the seconds spent
+# Every importer sets the frame range of its own trace: the scene gets the longest one
+def importAll(args):
+    start = time.time()
+    scene = bpy.context.scene
+    timing = 'TIME' if args.speed > 0 else 'STEPS'
+    speed = args.speed if args.speed > 0 else 1.0
+    last = 1
+    if args.walls:
+        import alchemist_walls
+        alchemist_walls.drawWalls(args.walls)
+    if args.nodes:
+        import alchemist_nodes
+        alchemist_nodes.importNodes(args.nodes, args.node_mode, True, stride=args.stride, timing=timing, speed=speed)
+        last = max(last, scene.frame_end)
+    if args.grads:
+        if args.surface or args.field:
+            import alchemist_gradsurfaces
+            mode = 'FIELD' if args.field else 'SKIN'
+            alchemist_gradsurfaces.importGrads(args.grads, cache=True, stride=args.stride, mode=mode)
+        else:
+            import alchemist_grads
+            alchemist_grads.importGrads(args.grads, True, stride=args.stride, timing=timing, speed=speed)
+        last = max(last, scene.frame_end)
+    scene.frame_start = 1
+    scene.frame_end = last
+    return time.time() - start
+
+# Last frame of the traces of the command line, as the importers set it (the trace caches are written on the way)
+def traceFrames(args):
+    last = 1
+    render = bpy.context.scene.render
+    readers = []
+    if args.nodes:
+        import alchemist_nodes
+        readers.append((args.nodes, alchemist_nodes.readNodesFromFile))
+    if args.grads:
+        import alchemist_grads
+        readers.append((args.grads, alchemist_grads.readGradsFromFile))
+    for filename, read in readers:
+        trace = read(filename, True, args.stride)
+        if args.speed > 0 and not (args.grads == filename and (args.surface or args.field)):
+            last = max(last, alchemist_trace.Clock(trace, render.fps / render.fps_base / args.speed).lastFrame())
+        else:
+            last = max(last, len(trace))
+    return last
+
+# Render the frames [start, end] of the scene; returns the seconds spent
+def renderFrames(start, end, output):
+    scene = bpy.context.scene
+    scene.frame_start = start
+    scene.frame_end = end
+    if output:
+        scene.render.filepath = output
+    begin = time.time()
+    bpy.ops.render.render(animation=True)
+    return time.time() - begin
+
+# Print a report, for the user and for the process which started this one
+def printReport(report):
+    print(REPORT_TAG + " " + json.dumps(report, sort_keys=True))
+    sys.stdout.flush()
+
+# Import and render in this process
+def runSingle(args):
+    seconds = importAll(args)
+    scene = bpy.context.scene
+    if args.frames:
+        start, end = parseFrames(args.frames)
+    else:
+        start, end = scene.frame_start, scene.frame_end
+    if args.save:
+        bpy.ops.wm.save_as_mainfile(filepath=os.path.abspath(args.save))
+    report = {'pid': os.getpid(), 'start': start, 'end': end, 'import_seconds': seconds,
+              'frames': 0, 'render_seconds': 0.0, 'frames_per_second': 0.0}
+    if not args.no_render:
+        rendered = renderFrames(start, end, args.output)
+        report['frames'] = end - start + 1
+        report['render_seconds'] = rendered
+        report['frames_per_second'] = report['frames'] / rendered if rendered > 0 else 0.0
+        # Update cost of every layer of the frame change dispatcher
+        report['layers'] = dict((name, {'updates': updates, 'mean_ms': mean, 'slowest_ms': slowest})
+                                for name, updates, mean, slowest in alchemist_layers.costs())
+    if args.report:
+        alchemist_profile.writeAll(args.report)
+    printReport(report)
+    return report
+
+# Command line of a background Blender process rendering the frames [start, end]
+# Without 'first', the --save and --report options are dropped (only the first process saves and reports)
+def childCommand(argv, start, end, first):
+    command = [bpy.app.binary_path]
+    if bpy.data.filepath:
+        command.append(bpy.data.filepath)
+    command += ["--background", "--python", os.path.abspath(__file__), "--"]
+    dropped = ["--frames", "--processes"]
+    if not first:
+        dropped += ["--save", "--report"]
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in dropped:
+            skip = True
+        elif arg.split("=")[0] not in dropped:
+            command.append(arg)
+    return command + ["--frames", str(start) + "-" + str(end), "--processes", "1"]
+
+# Render the frames in 'args.processes' background Blender processes and sum up their reports
+# Every process writes to its own temporary file (a pipe would fill up with the render log and block it until the
+# ones before it are read), which is parsed once it exits
+def runParallel(args, argv):
+    begin = time.time()
+    if args.frames:
+        start, end = parseFrames(args.frames)
+    else:
+        start, end = 1, traceFrames(args)
+    children = []
+    for i, (first, last) in enumerate(splitFrames(start, end, args.processes)):
+        command = childCommand(argv, first, last, i == 0)
+        output = tempfile.TemporaryFile(mode="w+")
+        children.append((command, output, subprocess.Popen(command, stdout=output, universal_newlines=True)))
+    reports = []
+    for command, output, child in children:
+        child.wait()
+        output.seek(0)
+        for line in output:
+            if line.startswith(REPORT_TAG + " "):
+                reports.append(json.loads(line[len(REPORT_TAG)+1:]))
+        output.close()
+        if child.returncode != 0:
+            print("Batch process failed with exit code " + str(child.returncode) + ": " + " ".join(command))
+    elapsed = time.time() - begin
+    frames = sum(r['frames'] for r in reports)
+    print('%8s %13s %10s %10s %10s' % ('pid', 'frames', 'import s', 'render s', 'frames/s'))
+    for r in reports:
+        print('%8d %6d-%-6d %10.2f %10.2f %10.2f' % (r['pid'], r['start'], r['end'], r['import_seconds'], r['render_seconds'], r['frames_per_second']))
+    print(str(frames) + ' frames in ' + ('%.2f' % elapsed) + ' s with ' + str(len(children)) + ' processes: ' + ('%.2f' % (frames / elapsed if elapsed > 0 else 0.0)) + ' frames/s')
+    return reports
+
+def main(argv):
+    args = parseArgs(argv)
+    if args.processes > 1 and not args.no_render:
+        return runParallel(args, argv)
+    return runSingle(args)
+
+if __name__ == "__main__":
+    main(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
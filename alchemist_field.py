@@ -0,0 +1,146 @@
+# Rasterized gradient fields for the Alchemist gradient add-ons.
+# Every step of a gradient trace, a set of (x, y, value) samples, is scattered on a fixed 2D grid covering the whole
+# trace: samples are splatted bilinearly on the 4 nearest cells, and the cells without samples are filled by a
+# push-pull interpolation (the grid is halved until every cell has a value, then refined back).
+# The grids are normalized to the value range of the trace and written as a sequence of 16 bit grayscale PNG
+# images, which a displacement modifier plays on a single plane: the cost of a frame depends on the grid resolution
+# only, not on the number of gradients.
+# It does not import bpy.
+
+import os, struct, zlib
+import numpy as np
+
+RESOLUTION = 128 # Default cells along the longer side of the grid
+
+# Region covered by a trace: (xmin, ymin, xmax, ymax), never empty
+def fieldBounds(trace):
+    low, high = None, None
+    for coords in trace.coords:
+        if (len(coords) > 0):
+            lo, hi = coords[:, 0:2].min(axis=0), coords[:, 0:2].max(axis=0)
+            low = lo if low is None else np.minimum(low, lo)
+            high = hi if high is None else np.maximum(high, hi)
+    if low is None:
+        return (0.0, 0.0, 1.0, 1.0)
+    xmin, ymin, xmax, ymax = float(low[0]), float(low[1]), float(high[0]), float(high[1])
+    return (xmin, ymin, max(xmax, xmin + 1e-6), max(ymax, ymin + 1e-6))
+
+# Lowest and highest value of a trace
+def fieldRange(trace):
+    low, high = None, None
+    for coords in trace.coords:
+        if (len(coords) > 0):
+            low = float(coords[:, 2].min()) if low is None else min(low, float(coords[:, 2].min()))
+            high = float(coords[:, 2].max()) if high is None else max(high, float(coords[:, 2].max()))
+    if low is None:
+        return (0.0, 0.0)
+    return (low, high)
+
+# Grid size (columns, rows) for 'resolution' cells along the longer side of 'bounds'
+def fieldShape(bounds, resolution=RESOLUTION):
+    width, height = bounds[2] - bounds[0], bounds[3] - bounds[1]
+    if width >= height:
+        return resolution, max(int(round(resolution * height / width)), 2)
+    return max(int(round(resolution * width / height)), 2), resolution
+
+# Cell centers are at the grid nodes: cell (0, 0) is on (xmin, ymin), cell (columns-1, rows-1) on (xmax, ymax)
+# Returns the sums of the splatted values and of their weights, arrays (rows, columns)
+def splat(coords, bounds, shape):
+    columns, rows = shape
+    sums = np.zeros(rows * columns)
+    weights = np.zeros(rows * columns)
+    if len(coords) == 0:
+        return sums.reshape(rows, columns), weights.reshape(rows, columns)
+    u = (coords[:, 0] - bounds[0]) / (bounds[2] - bounds[0]) * (columns - 1)
+    v = (coords[:, 1] - bounds[1]) / (bounds[3] - bounds[1]) * (rows - 1)
+    i = np.clip(np.floor(u).astype(np.int64), 0, columns - 2)
+    j = np.clip(np.floor(v).astype(np.int64), 0, rows - 2)
+    fu, fv = u - i, v - j
+    values = coords[:, 2].astype(np.float64)
+    for di, dj, w in ((0, 0, (1 - fu) * (1 - fv)), (1, 0, fu * (1 - fv)), (0, 1, (1 - fu) * fv), (1, 1, fu * fv)):
+        cells = (j + dj) * columns + (i + di)
+        sums += np.bincount(cells, values * w, rows * columns)
+        weights += np.bincount(cells, w, rows * columns)
+    return sums.reshape(rows, columns), weights.reshape(rows, columns)
+
+# Values of the grid cells: the weighted mean of the splatted samples where their weight is at least 1, blended
+# with the interpolation of a coarser grid (push-pull) where it is lower; 0 when there is no sample at all
+# A single cell is its mean, whatever its weight (the bilinear weights of a lone sample may sum to just under 1)
+def fill(sums, weights):
+    rows, columns = sums.shape
+    means = sums / np.maximum(weights, 1e-12)
+    if (weights >= 1.0).all() or not (weights > 0).any() or (rows * columns == 1):
+        return means
+    # Push: halve the grid, summing the 2x2 blocks, and fill it
+    padded = ((0, rows % 2), (0, columns % 2))
+    coarse = fill(blocks(np.pad(sums, padded)), blocks(np.pad(weights, padded)))
+    # Pull: the cells with few samples take the value of the coarser grid, bilinearly interpolated
+    known = np.minimum(weights, 1.0)
+    return means * known + upsample(coarse, rows, columns) * (1.0 - known)
+
+# Bilinear interpolation of a grid on a grid twice as fine, cropped to (rows, columns)
+def upsample(coarse, rows, columns):
+    for axis, size in ((0, rows), (1, columns)):
+        last = coarse.shape[axis] - 1
+        position = np.clip((np.arange(size) - 0.5) / 2.0, 0, last) # Fine cell centers on the coarse grid
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, last)
+        t = position - low
+        shape = (-1, 1) if axis == 0 else (1, -1)
+        coarse = np.take(coarse, low, axis) * (1 - t).reshape(shape) + np.take(coarse, high, axis) * t.reshape(shape)
+    return coarse
+
+# Sums of the 2x2 blocks of an array with even sides
+def blocks(grid):
+    rows, columns = grid.shape
+    return grid.reshape(rows // 2, 2, columns // 2, 2).sum(axis=(1, 3))
+
+# Field of a step: array (rows, columns) of values, row 0 at ymin
+def rasterize(coords, bounds, shape):
+    sums, weights = splat(np.asarray(coords), bounds, shape)
+    return fill(sums, weights)
+
+# Write a field as a 16 bit grayscale PNG, 'low' and 'high' being black and white (row 0 at the bottom)
+def writePNG(filename, field, low, high):
+    rows, columns = field.shape
+    scale = 65535.0 / (high - low) if high > low else 0.0
+    pixels = np.clip((field[::-1] - low) * scale + 0.5, 0, 65535).astype('>u2')
+    raw = np.zeros((rows, 1 + 2 * columns), dtype=np.uint8) # A filter byte (0, none) before every row
+    raw[:, 1:] = pixels.view(np.uint8).reshape(rows, 2 * columns)
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', columns, rows, 16, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+# A PNG chunk: length, type, data, CRC of type and data
+def chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+# Directory and file names of the image sequence of a gradient file: <file>_field/field_0001.png...
+def fieldPath(filename, frame=None):
+    directory = os.path.splitext(filename)[0] + '_field'
+    if frame is None:
+        return directory
+    return os.path.join(directory, 'field_%04d.png' % frame)
+
+# Rasterize every step of a trace into the image sequence of 'filename', yielding the frames written
+# 'bounds', 'shape', 'low' and 'high' are the ones of the whole trace (see fieldBounds, fieldShape and fieldRange)
+def writeFields(trace, filename, bounds, shape, low, high):
+    directory = fieldPath(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for frame in range(1, len(trace) + 1):
+        writePNG(fieldPath(filename, frame), rasterize(trace.step(frame)[1], bounds, shape), low, high)
+        yield frame
+
+# Remove the image sequence of a gradient file (of a cancelled or failed import), and its directory once empty
+def removeFields(filename):
+    directory = fieldPath(filename)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.startswith('field_') and name.endswith('.png'):
+            os.remove(os.path.join(directory, name))
+    if not os.listdir(directory):
+        os.rmdir(directory)
@@ -11,50 +11,135 @@ bl_info = {
 
 
 import bpy, random
+import alchemist_trace, alchemist_spatial, alchemist_profile, alchemist_materials, alchemist_jobs, alchemist_layers
+import numpy as np
 from os.path import expanduser
-from bpy.props import StringProperty
+from bpy.props import StringProperty, BoolProperty, EnumProperty, FloatVectorProperty, IntProperty, FloatProperty
 
 user_home = expanduser("~")
 theMessage = ""
 RED_FACTOR = 4 # Reduction factor (too high gradients tend to go out of the rendering window)
+GRAD_MESH = "GradSphere" # Sphere mesh shared by all the gradient objects
+SPHERE_SEGMENTS = 32
+SPHERE_RINGS = 16
+SPHERE_SIZE = 0.1
+CULL_MARGIN = 1.0 # Margin around the camera view, when culling by camera
+BATCH = 50 # Gradients built between two progress reports of a background import
 
-# Dictionary of gradients: every step is a couple (frame_number, step_dictionary) in the dict
-gradlist = {}
+# Parsed gradient trace, behind a bounded cache of decoded steps (an alchemist_trace.StepStore):
+# step number 'frame' holds the gradients of that frame
+gradlist = None
+# Index used by the frame handler, so that a frame change only touches the gradients which change
+gradobjects = {} # Couples (node_id, object) of the gradient objects in the scene
+gradtransitions = [] # Nodes entering and exiting every step (see alchemist_trace.transitions)
+shownids = np.empty(0, dtype=np.int32) # Ids of the gradients currently visible
+shownframe = None # Step currently shown
+# Interpolated playback (see frame_step): None (a step every frame) or an alchemist_trace.Clock
+gradclock = None
+# Profile of the last import, which also gets the latency of the frame handler (see alchemist_profile)
+gradprofile = None
+# Culling (see cull_box): None, a region (xmin, ymin, xmax, ymax) or 'CAMERA'
+gradcull = None
+# Materials of the gradients: an alchemist_materials.MaterialPool, or None for a material for every gradient
+gradpool = None
+gradkey = 'VALUE' # What chooses the palette color of a gradient: 'VALUE' (its current value) or 'NODE' (its name)
+gradrange = (0.0, 0.0) # Lowest and highest value of the trace, the ends of the palette ramp
+gradslots = {} # Couples (node_id, palette slot) of the gradient objects, so that only color changes touch them
+# Follow mode (see refreshGrads): None, or the alchemist_trace.Follower reading the gradient file as it grows
+gradfollower = None
+
+# Sphere mesh of the gradients, built once (the same as primitive_uv_sphere_add with SPHERE_SEGMENTS, SPHERE_RINGS
+# and SPHERE_SIZE). Its material slot is linked to the objects, so that every gradient can have its own material
+def gradMesh():
+    mesh = bpy.data.meshes.get(GRAD_MESH)
+    if (mesh == None):
+        # Poles, and SPHERE_RINGS-1 rings of SPHERE_SEGMENTS vertices from the top
+        theta = np.arange(1, SPHERE_RINGS) * np.pi / SPHERE_RINGS
+        phi = np.arange(SPHERE_SEGMENTS) * 2 * np.pi / SPHERE_SEGMENTS
+        rings = np.empty((SPHERE_RINGS-1, SPHERE_SEGMENTS, 3))
+        rings[:, :, 0] = SPHERE_SIZE * np.outer(np.sin(theta), np.cos(phi))
+        rings[:, :, 1] = SPHERE_SIZE * np.outer(np.sin(theta), np.sin(phi))
+        rings[:, :, 2] = SPHERE_SIZE * np.cos(theta)[:, None]
+        verts = np.vstack(([(0, 0, SPHERE_SIZE)], rings.reshape(-1, 3), [(0, 0, -SPHERE_SIZE)]))
+        top, bottom = 0, len(verts) - 1
+        ring = lambda r, s: 1 + r * SPHERE_SEGMENTS + s % SPHERE_SEGMENTS # Vertex index
+        faces = []
+        for s in range(SPHERE_SEGMENTS):
+            faces.append((top, ring(0, s), ring(0, s+1)))
+            for r in range(SPHERE_RINGS-2):
+                faces.append((ring(r, s), ring(r+1, s), ring(r+1, s+1), ring(r, s+1)))
+            faces.append((ring(SPHERE_RINGS-2, s+1), ring(SPHERE_RINGS-2, s), bottom))
+        mesh = bpy.data.meshes.new(GRAD_MESH)
+        mesh.from_pydata(verts.tolist(), [], faces)
+        mesh.update(calc_edges=True)
+        mesh.materials.append(bpy.data.materials.new(GRAD_MESH+'Mat'))
+    return mesh
 
 # Draw a single sphere
-def createSphereMeshFromPrimitive(name, origin):
-    bpy.ops.mesh.primitive_uv_sphere_add(
-        location = origin,
-        size = 0.1
-        )
-    ob = bpy.context.object
-    ob.name = name
+# All the gradients are linked duplicates of the same sphere mesh, created through bpy.data (no operator call)
+# With a material pool, the sphere gets the palette color 'index' (by default the one of its name)
+# During an import, the time spent on its material goes to the 'materials' phase of 'profile'
+def createSphereMeshFromPrimitive(name, origin, index=None, profile=None):
+    ob = bpy.data.objects.new(name, gradMesh())
+    ob.location = origin
+    bpy.context.scene.objects.link(ob)
     ob.show_name = True
-    me = ob.data
-    me.name = name+'SphereMesh'
-    mat = bpy.data.materials.new(name+'Mat')
-    mat.diffuse_color = (random.random(),random.random(),random.random())
-    ob.active_material = mat
+    ob.material_slots[0].link = 'OBJECT'
+    if (profile == None):
+        setGradMaterial(ob, name, index)
+    else:
+        with profile.phase('materials'):
+            setGradMaterial(ob, name, index)
     return ob
 
-# Read gradients from file and put in a dict structure
-# The single step is represented by a dictionary itself, which couples are (node_name, (x, y, z)), where 'z' is the gradient value
-def readGradsFromFile(filename):
-    grads = {}
-    step = 1
-    with open(filename, 'r') as csvfile:
-        for row in csvfile.readlines():
-            gradnodes = {}
-            time, sep, rest = row.partition(';') # Reads the time
-            realstep, sep, nodelist = rest.partition(';') # Reads the step number
-            bpy.ops.anim.change_frame(frame=int(step))
-            for node in nodelist.split(';'):
-                if(node != '\n'):
-                    name,x,y,z = node.split(',')
-                    gradnodes[name] = (float(x),float(y),float(z)/RED_FACTOR) # Inserts the node in the dictionary
-            grads[step] = gradnodes
-            step = step+1
-    return grads
+# Give a gradient its material: a new one, or the one of palette slot 'index' (by default the one of its name)
+def setGradMaterial(ob, name, index=None):
+    if (gradpool == None):
+        mat = bpy.data.materials.new(name+'Mat')
+        mat.diffuse_color = (random.random(),random.random(),random.random())
+        ob.active_material = mat
+    else:
+        if (index == None):
+            index = alchemist_materials.slot(name, len(gradpool))
+        gradpool.apply(ob, index)
+
+# Lowest and highest gradient value of a trace (with 'first', of the steps from index 'first' on)
+def valueRange(trace, first=0):
+    low, high = None, None
+    for i in range(first, len(trace)):
+        coords = trace.coords[i]
+        if (len(coords) > 0):
+            values = coords[:, 2]
+            low = float(values.min()) if low == None else min(low, float(values.min()))
+            high = float(values.max()) if high == None else max(high, float(values.max()))
+    if (low == None):
+        return (0.0, 0.0)
+    return (low, high)
+
+# Read gradients from file into a Trace (see alchemist_trace)
+# Every step has the node ids and their (x, y, z) coordinates, where 'z' is the gradient value
+# With 'cache', the binary cache of the file is used when valid, and written otherwise
+# 'stride', 'interval' and 'spacing' decimate the steps and the gradients for a preview (see alchemist_trace.decimate)
+def readGradsFromFile(filename, cache=False, stride=1, interval=0.0, spacing=0.0):
+    global theMessage
+    try:
+        trace = alchemist_trace.readGrads(filename, 1.0/RED_FACTOR, cache=cache)
+        return alchemist_trace.decimate(trace, stride, interval, spacing)
+    except alchemist_trace.TraceError as e:
+        theMessage = e.value
+        raise GraError(e.value)
+
+# Start following a gradient file still being written by a running simulation (see alchemist_trace.Follower)
+# The gradients read so far are in the trace of the follower, which grows at every poll
+def followGradsFile(filename):
+    global theMessage
+    try:
+        follower = alchemist_trace.Follower(filename, 3, None, 1.0/RED_FACTOR)
+        follower.poll()
+        return follower
+    except (alchemist_trace.TraceError, IOError, OSError) as e:
+        theMessage = getattr(e, 'value', str(e))
+        raise GraError(theMessage)
 
 # Hide an object which has not to be seen in the frame
 def make_hidden(object):
@@ -66,45 +151,255 @@ def make_visible(object):
     object.hide = False
     object.hide_render = False
 
+# Build the index of the gradient objects for a new trace
+# The gradient objects already in the scene are hidden once here, instead of at every frame
+def indexGradObjects(trace):
+    global gradobjects, gradtransitions, shownids, shownframe, gradslots
+    scene = bpy.context.scene
+    for key in scene.objects.keys():
+        if (key.startswith("grad_")):
+            make_hidden(scene.objects.get(key))
+    gradobjects = {}
+    for nid, name in enumerate(trace.names):
+        ob = scene.objects.get("grad_"+name)
+        if (ob != None):
+            gradobjects[nid] = ob
+    gradtransitions = alchemist_trace.transitions(trace)
+    shownids = np.empty(0, dtype=np.int32)
+    shownframe = None
+    gradslots = {}
+
+# Region of interest of a frame: None (everything), the region given at import or what the active camera sees
+def cull_box(scene):
+    if (gradcull == 'CAMERA'):
+        if (scene.camera == None):
+            return None
+        return alchemist_spatial.cameraBox(scene.camera, scene, 0.0, CULL_MARGIN)
+    return gradcull
+
+# Step shown on a frame and how far the frame is towards the next step (a couple (step, alpha))
+# Without a clock every frame shows a whole step; the step is None outside the trace
+def frame_step(trace, frame):
+    if (gradclock == None):
+        if (frame >= 1 and frame <= len(trace)):
+            return frame, 0.0
+        return None, 0.0
+    return gradclock.locate(frame)
+
+# Gradients shown on a frame: a tuple (step, box, ids, coords), where box is the culling region, if any
+def frame_grads(trace, frame):
+    box = None
+    step, alpha = frame_step(trace, frame)
+    if (step != None):
+        ids, coords = alchemist_trace.interpolate(trace, step, alpha)
+        box = cull_box(bpy.context.scene)
+        if (box != None):
+            inside = trace.grid(step).query(box)
+            ids, coords = ids[inside], coords[inside]
+    else:
+        ids, coords = np.empty(0, dtype=np.int32), np.empty((0, 3), dtype=np.float32)
+    return step, box, ids, coords
+
+# Palette slots of the gradients of a frame, when their values choose the color (None otherwise)
+def value_slots(coords):
+    if (gradpool != None and gradkey == 'VALUE'):
+        return alchemist_materials.quantize(coords[:, 2], gradrange[0], gradrange[1], len(gradpool)).tolist()
+    return [None] * len(coords)
+
 # Move the objects (called by the frame handler)
-def set_objects_location(grad_dict,frame):
-    # Hide alle the existing objects
-    for key2 in bpy.context.scene.objects.keys():
-        if (key2.startswith("grad_")):
-            ob = bpy.context.scene.objects.get(key2)
-            make_hidden(ob)
-    for key,(x,y,z) in grad_dict[frame].items():
-        ob = bpy.context.scene.objects.get("grad_"+key)
+# Only the gradients entering or exiting the frame change visibility; with culling, only the gradients in the
+# region of interest are created, moved and shown
+def set_objects_location(trace,frame):
+    global shownids, shownframe
+    step, box, ids, coords = frame_grads(trace, frame)
+    if (box == None and shownframe != None and step == shownframe+1):
+        enter, exit = gradtransitions[step-1]
+    else: # Not the next step: compare with what is shown now
+        enter, exit = np.setdiff1d(ids, shownids), np.setdiff1d(shownids, ids)
+    # Hide the objects which are not in this frame anymore
+    for nid in exit.tolist():
+        make_hidden(gradobjects[nid])
+    names = trace.names
+    for nid, (x,y,z), index in zip(ids.tolist(), coords.tolist(), value_slots(coords)):
+        ob = gradobjects.get(nid)
         # Create the new objects for this frame, if any
         if (ob == None):
-            ob = createSphereMeshFromPrimitive("grad_"+key, (float(x),float(y),float(z)/RED_FACTOR))
-        # Make visible and move only the objects which are to be seen in this frame
+            ob = gradobjects[nid] = createSphereMeshFromPrimitive("grad_"+names[nid], (x,y,z/RED_FACTOR), index)
+            gradslots[nid] = index
+        # Move only the objects which are to be seen in this frame
         else:
             ob.location = (x, y, z/RED_FACTOR)
-        make_visible(ob)
+            if (index != None and gradslots.get(nid) != index):
+                gradpool.apply(ob, index)
+                gradslots[nid] = index
+    # Make visible the objects which enter this frame
+    for nid in enter.tolist():
+        make_visible(gradobjects[nid])
+    shownids = ids
+    shownframe = step
+
+# Create in batches the objects of the gradients shown on a frame, yielding the fraction created
+# (a background import builds the first frame this way, then set_objects_location only moves them)
+def createFrameObjects(trace, frame):
+    ids, coords = frame_grads(trace, frame)[2:]
+    missing = [(nid, (x, y, z/RED_FACTOR), index) for nid, (x, y, z), index in zip(ids.tolist(), coords.tolist(), value_slots(coords))
+               if nid not in gradobjects]
+    for i in range(0, len(missing), BATCH):
+        for nid, origin, index in missing[i:i+BATCH]:
+            gradobjects[nid] = createSphereMeshFromPrimitive("grad_"+trace.names[nid], origin, index, gradprofile)
+            gradslots[nid] = index
+        yield min(float(i+BATCH) / len(missing), 1.0)
 
-# Every frame change, this function is called.
-def my_handler(scene):
-    global gradlist
-    frame = scene.frame_current
+# Every frame change, the frame change dispatcher calls this function (the update of the 'grads' layer,
+# see alchemist_layers)
+def my_handler(scene, frame):
     set_objects_location(gradlist,frame)
 
+# Read the rows appended to the followed gradient file and extend the import with the new steps only: the frame
+# handler index, the playback clock, the value range of the palette ramp and the frame range grow, nothing is rebuilt
+# When the last frame is shown, playback jumps to the new last frame
+# With 'final' (the file is complete), a last row without its newline is read too
+# Returns the number of new steps, or None when no file is followed
+def refreshGrads(final=False):
+    global gradtransitions, gradrange, theMessage
+    if (gradfollower == None or gradlist == None):
+        return None
+    known = len(gradlist.names) # No gradient yet: the value range is empty
+    try:
+        with gradprofile.phase('follow'):
+            added = gradfollower.poll(final=final)
+    except (alchemist_trace.TraceError, IOError, OSError) as e:
+        theMessage = getattr(e, 'value', str(e))
+        raise GraError(theMessage)
+    if (added == 0):
+        return 0
+    with gradprofile.phase('follow'):
+        gradprofile.count('steps', added)
+        first = len(gradlist) - added
+        gradtransitions += alchemist_trace.transitions(gradlist, first)
+        if (gradclock != None):
+            gradclock.extend(gradlist)
+        if (gradpool != None and gradkey == 'VALUE'):
+            low, high = valueRange(gradlist, first)
+            if (known > 0):
+                low, high = min(low, gradrange[0]), max(high, gradrange[1])
+            gradrange = (low, high)
+        scene = bpy.context.scene
+        shown = scene.frame_current
+        end = scene.frame_end
+        scene.frame_end = last_frame(gradlist)
+        alchemist_layers.invalidate()
+        if (shown >= end):
+            scene.frame_set(scene.frame_end)
+    return added
+
+# Last frame of the animation of a trace
+def last_frame(trace):
+    if (gradclock != None):
+        return gradclock.lastFrame()
+    return max(len(trace), 1)
+
+# Module state of an import, replaced by the next one (see saveGrads)
+GRAD_STATE = ('gradlist', 'gradobjects', 'gradtransitions', 'shownids', 'shownframe', 'gradclock', 'gradprofile',
+              'gradcull', 'gradpool', 'gradkey', 'gradrange', 'gradslots', 'gradfollower')
+
+# State of the previous import, saved before a new one builds: module state, 'grads' layer, gradient objects and
+# frame range
+def saveGrads():
+    state = dict((name, globals()[name]) for name in GRAD_STATE)
+    scene = alchemist_jobs.SceneState(bpy.context.scene, ("grad_",))
+    return state, alchemist_layers.layers.get('grads'), scene
+
+# Put back the previous import after a cancelled one (the data-blocks of the cancelled one are removed afterwards)
+def restoreGrads(saved):
+    state, layer, scene = saved
+    if (gradlist != None and gradlist is not state['gradlist']):
+        gradlist.close()
+    globals().update(state)
+    scene.restore()
+    alchemist_layers.restoreLayer(bpy.app.handlers.frame_change_pre, 'grads', layer)
+
+# Clock of an interpolated playback at the scene frame rate, 'speed' units of simulation time every second
+def playbackClock(trace, speed):
+    render = bpy.context.scene.render
+    return alchemist_trace.Clock(trace, render.fps / render.fps_base / speed)
+
 # Draw all the gradients in a file
-def importGrads(grad_file):
-    bpy.context.scene.frame_current=1
-    global gradlist
-    gradlist = readGradsFromFile(grad_file)
-    for key,(x,y,z) in gradlist[1].items() :
-        createSphereMeshFromPrimitive("grad_"+key, (float(x),float(y),float(z)/RED_FACTOR))
-    bpy.app.handlers.frame_change_pre.append(my_handler)
-    bpy.context.scene.frame_current=1
+# With 'cull' set to 'REGION' or 'CAMERA', the frame handler only shows the gradients inside 'region'
+# (xmin, ymin, xmax, ymax) or seen by the active camera
+# 'stride', 'interval' and 'spacing' import fewer steps and gradients, for a quick preview
+# With 'timing' set to 'TIME', frames follow the simulation time ('speed' units every second of animation) and the
+# gradients move smoothly between the logged steps
+# The import profile is printed, and written to the JSON file 'report' if given
+# 'colors' is 'PALETTE' (the gradients share the materials of a palette of 'palette_size' colors, chosen by
+# 'color_key': 'VALUE' or 'NODE'), 'SHARED' (a single material, colored by the object color) or 'OBJECT'
+# (a material for every gradient)
+# With 'follow', the file is still being written by a running simulation: it is read without cache and decimation,
+# and refreshGrads reads what was appended since
+def importGrads(grad_file, cache=True, cull='NONE', region=(0, 0, 100, 100), stride=1, interval=0.0, spacing=0.0,
+                timing='STEPS', speed=1.0, report=None, colors='PALETTE', color_key='VALUE',
+                palette_size=alchemist_materials.PALETTE_SIZE, follow=False):
+    importGradsJob(grad_file, cache, cull, region, stride, interval, spacing, timing, speed, report, colors, color_key,
+                   palette_size, follow).run()
 
+# The import of importGrads as an alchemist_jobs.Job: the file is parsed on a worker thread, then the scene is built
+# on the main thread, BATCH gradients at a time
+def importGradsJob(grad_file, cache=True, cull='NONE', region=(0, 0, 100, 100), stride=1, interval=0.0, spacing=0.0,
+                   timing='STEPS', speed=1.0, report=None, colors='PALETTE', color_key='VALUE',
+                   palette_size=alchemist_materials.PALETTE_SIZE, follow=False):
+    profile = alchemist_profile.begin('grads', grad_file, bpy.data)
+    ramp = (colors != 'OBJECT' and color_key == 'VALUE')
+    def prepare():
+        with profile.phase('parse'):
+            follower = None
+            if (follow):
+                follower = followGradsFile(grad_file)
+                trace = follower.trace
+            else:
+                trace = readGradsFromFile(grad_file, cache, stride, interval, spacing)
+            store = alchemist_trace.StepStore(trace, indexed=(cull != 'NONE'))
+            return follower, store, valueRange(trace) if ramp else None
+    def build(job, prepared):
+        global gradlist, gradcull, gradclock, gradprofile, gradpool, gradkey, gradrange, gradfollower
+        bpy.context.scene.frame_current=1
+        gradprofile = profile
+        gradcull = {'NONE': None, 'REGION': tuple(region), 'CAMERA': 'CAMERA'}[cull]
+        if (gradlist != None):
+            gradlist.close()
+        gradfollower, gradlist, values = prepared
+        profile.count('steps', len(gradlist))
+        profile.count('gradients', len(gradlist.names))
+        gradkey = color_key
+        gradpool = None
+        if (colors != 'OBJECT'):
+            if (ramp):
+                palette = alchemist_materials.ramp(palette_size)
+                gradrange = values
+            else:
+                palette = alchemist_materials.hues(palette_size)
+            gradpool = alchemist_materials.MaterialPool(bpy.data.materials, 'GradMat', palette, colors == 'SHARED')
+        gradclock = None
+        if (timing == 'TIME'):
+            gradclock = playbackClock(gradlist, speed)
+        # Parsing does not touch the scene: the frame range is set once, afterwards
+        bpy.context.scene.frame_start = 1
+        bpy.context.scene.frame_end = last_frame(gradlist)
+        with profile.phase('objects'):
+            indexGradObjects(gradlist)
+        for progress in profile.timed(createFrameObjects(gradlist, 1), 'objects'):
+            yield progress
+        with profile.phase('objects'):
+            set_objects_location(gradlist, 1)
+        alchemist_layers.setLayer(bpy.app.handlers.frame_change_pre, 'grads', my_handler, profile)
+        bpy.context.scene.frame_current=1
+        alchemist_profile.end(profile, bpy.data, report)
+    return alchemist_jobs.Job('grads', prepare, build, bpy.data, saveGrads, restoreGrads)
 
 # USER INTERFACE
 
 from bpy_extras.io_utils import ImportHelper
 
-class ImportGra(bpy.types.Operator, ImportHelper):
+class ImportGra(alchemist_jobs.ModalImport, bpy.types.Operator, ImportHelper):
     """Import from Alchemist Grad file (.gra)"""
     bl_idname = "import_scene.grads"
     bl_description = 'Import from Alchemist Gradients file (.gra)'
@@ -115,14 +410,101 @@ class ImportGra(bpy.types.Operator, ImportHelper):
     filename_ext = ".gra"
     filter_glob = StringProperty(default="*.gra", options={'HIDDEN'})
     filepath = StringProperty(subtype='FILE_PATH')
+    cache = BoolProperty(
+        name="Cache",
+        description="Keep a binary copy of the parsed trace next to the file and reload it while the file does not change",
+        default=True)
+    cull = EnumProperty(
+        name="Culling",
+        items=(('NONE', "None", "Show every gradient of the frame"),
+               ('REGION', "Region", "Only show the gradients inside the region"),
+               ('CAMERA', "Camera", "Only show the gradients seen by the active camera")),
+        default='NONE')
+    region = FloatVectorProperty(
+        name="Region",
+        description="Region of interest: minimum x, minimum y, maximum x, maximum y",
+        size=4, default=(0.0, 0.0, 100.0, 100.0))
+    stride = IntProperty(
+        name="Step stride",
+        description="Import one step every this many (1: every step)",
+        default=1, min=1)
+    interval = FloatProperty(
+        name="Time interval",
+        description="Least simulation time between two imported steps (0: no resampling)",
+        default=0.0, min=0.0)
+    spacing = FloatProperty(
+        name="Point spacing",
+        description="Keep one gradient per square of this side in every step (0: every gradient)",
+        default=0.0, min=0.0)
+    timing = EnumProperty(
+        name="Timing",
+        items=(('STEPS', "Steps", "One frame for every logged step"),
+               ('TIME', "Simulation time", "Frames follow the simulation time, positions are interpolated between steps")),
+        default='STEPS')
+    speed = FloatProperty(
+        name="Speed",
+        description="Simulation time played in a second of animation, with simulation time timing",
+        default=1.0, min=0.0001)
+    report_file = StringProperty(
+        name="Report",
+        description="Write the import profile to this JSON file (empty: only print it)",
+        subtype='FILE_PATH', default="")
+    colors = EnumProperty(
+        name="Colors",
+        items=(('PALETTE', "Palette", "The gradients share the materials of a palette, chosen by the color key"),
+               ('SHARED', "Shared material", "A single material, colored by the object color"),
+               ('OBJECT', "Material per gradient", "A new material with a random color for every gradient")),
+        default='PALETTE')
+    color_key = EnumProperty(
+        name="Color key",
+        items=(('VALUE', "Value", "The palette is a ramp over the gradient values, updated every frame"),
+               ('NODE', "Node", "A palette color for every gradient name")),
+        default='VALUE')
+    palette_size = IntProperty(
+        name="Palette size",
+        description="Number of colors of the palette",
+        default=alchemist_materials.PALETTE_SIZE, min=1, max=256)
+    background = BoolProperty(
+        name="Background",
+        description="Import without blocking the interface, with a progress bar (Esc cancels and removes what was imported)",
+        default=True)
+    follow = BoolProperty(
+        name="Follow",
+        description="The simulation is still writing the file: keep reading the new steps until Esc",
+        default=False)
     def draw(self, context):
         layout = self.layout
-    def execute(self, context):
+        layout.prop(self, "cache")
+        layout.prop(self, "cull")
+        layout.prop(self, "region")
+        layout.prop(self, "stride")
+        layout.prop(self, "interval")
+        layout.prop(self, "spacing")
+        layout.prop(self, "timing")
+        layout.prop(self, "speed")
+        layout.prop(self, "colors")
+        layout.prop(self, "color_key")
+        layout.prop(self, "palette_size")
+        layout.prop(self, "report_file")
+        layout.prop(self, "background")
+        layout.prop(self, "follow")
+    # The import runs as an alchemist_jobs.Job (see alchemist_jobs.ModalImport)
+    def job(self, context):
+        return importGradsJob(self.filepath, self.cache, self.cull, self.region, self.stride, self.interval, self.spacing,
+                              self.timing, self.speed, self.report_file, self.colors, self.color_key, self.palette_size,
+                              self.follow)
+    def refresh(self, context, final=False):
         try:
-            importGrads(self.filepath)
+            return refreshGrads(final)
         except GraError:
-            print("Error when loading Gra file:\n" + theMessage)
-        return {'FINISHED'}
+            print("Error when following Gra file:\n" + theMessage)
+            return None
+    def finished(self, job):
+        pass
+    def failed(self, job):
+        if (not isinstance(job.error, GraError)):
+            raise job.error
+        print("Error when loading Gra file:\n" + theMessage)
     def invoke(self, context, event):
         context.window_manager.fileselect_add(self)
         return {'RUNNING_MODAL'}
@@ -10,52 +10,41 @@ bl_info = {
     "category": "Import-Export"}
 
 
-import bpy, random
+import bpy, random, multiprocessing
+from bisect import bisect_right
+import alchemist_trace, alchemist_surface, alchemist_profile, alchemist_jobs, alchemist_layers, alchemist_field
+import numpy as np
 from os.path import expanduser
-from bpy.props import StringProperty
-# Requires Point Cloud Skinner by Hans.P.G.
-# http://blenderartists.org/forum/showthread.php?241950-A-Script-to-Skin-a-Point-Cloud-(for-Blender-2-6x-or-Later)
-# Change the following line if you rename the .py add-on
-point_cloud = __import__("98 t25_PointCloudSkinner1_Umbrella")
-from datetime import datetime # Useful for debugging
+from bpy.props import StringProperty, BoolProperty, IntProperty, FloatProperty, EnumProperty
 
 user_home = expanduser("~")
 theMessage = ""
 RED_FACTOR = 4 # Reduction factor (too high gradients tend to go out of the rendering window)
+MAX_EDGE = 5 # Longest edge of a surface triangle between scattered gradients (0: no limit)
+FIELD_NAME = "Grad_Field" # Displaced plane of 'FIELD' mode, with its mesh, image sequence, texture and modifier
 
-# Dictionary required by Point Cloud Skinner
-point_cloud.gb["TargetObject"] = 'Grad'
-point_cloud.gb["MaxAroundDist"] = 5
-point_cloud.gb["MaxDistForAxis"] = 10
-point_cloud.gb["MaxAroundCount"] = 10
-point_cloud.gb["MinVertsAngle"] = 25
-point_cloud.gb["MaxVertsAngle"] = 135
-point_cloud.gb["GridSize"] = [3 * 5] * 3
-point_cloud.gb["PrecisionLevel"] = 2
-point_cloud.gb["TargetVertsMode"] = False
-point_cloud.gb["IgnoreErrors"] = True
-
-# Dictionary of gradients: every step is a couple (frame_number, step_dictionary) in the dict
-gradlist = {}
-
-# Read gradients from file and put in a dict structure
-# The single step is represented by a dictionary itself, which couples are (node_name, (x, y, z)), where 'z' is the gradient value
-def readGradsFromFile(filename):
-    grads = {}
-    step = 1
-    with open(filename, 'r') as csvfile:
-        for row in csvfile.readlines():
-            gradnodes = []
-            time, sep, rest = row.partition(';') # Reads the time
-            realstep, sep, nodelist = rest.partition(';') # Reads the step number
-            bpy.ops.anim.change_frame(frame=int(step))
-            for node in nodelist.split(';'):
-                if(node != '\n'):
-                    name,x,y,z = node.split(',')
-                    gradnodes.append((float(x),float(y),float(z)/RED_FACTOR)) # Inserts the node in the list
-            grads[step]=gradnodes
-            step = step+1
-    return grads
+# Parsed gradient trace, behind a bounded cache of decoded steps (an alchemist_trace.StepStore)
+gradlist = None
+# Surfaces: every run of steps is drawn by a single object, named after the first frame of the run (Grad_<frame>).
+# With a shared topology a run holds all the consecutive steps with the same nodes, otherwise a single step.
+gradruns = [] # First frame of every run
+gradobjects = [] # Surface object of every run
+shownrun = None # Run currently shown
+# Profile of the last import, which also gets the latency of the frame handler (see alchemist_profile)
+gradprofile = None
+
+# Read gradients from file into a Trace (see alchemist_trace)
+# Every step has the node ids and their (x, y, z) coordinates, where 'z' is the gradient value
+# With 'cache', the binary cache of the file is used when valid, and written otherwise
+# 'stride', 'interval' and 'spacing' decimate the steps and the gradients for a preview (see alchemist_trace.decimate)
+def readGradsFromFile(filename, cache=False, stride=1, interval=0.0, spacing=0.0):
+    global theMessage
+    try:
+        trace = alchemist_trace.readGrads(filename, 1.0/RED_FACTOR, cache=cache)
+        return alchemist_trace.decimate(trace, stride, interval, spacing)
+    except alchemist_trace.TraceError as e:
+        theMessage = e.value
+        raise GraError(e.value)
 
 # Hide an object which has not to be seen in the frame
 def make_hidden(object):
@@ -67,41 +56,222 @@ def make_visible(object):
     object.hide = False
     object.hide_render = False
 
-# Every frame change, this function is called.
-# The surfaces are drawn by the next function, so the frame handler only decides what to show for every frame.
-def my_handler(scene):
-    scene = bpy.context.scene
-    frame = scene.frame_current
-    for ob in bpy.data.objects.values():
-        if ((ob.name == 'Grad_'+str(frame)) or (ob.type == 'CAMERA') or (ob.type == 'LAMP')):
-            make_visible(ob)
-        else:
-            make_hidden(ob)
+# Move the vertices of a shared surface to the gradients of a frame of its run
+def set_surface_location(trace, frame, run):
+    ids, coords = trace.step(frame)
+    mesh = gradobjects[run].data
+    co = alchemist_surface.reorder(ids, coords, trace.ids[gradruns[run]-1])
+    mesh.vertices.foreach_set('co', co.ravel())
+    mesh.update()
+
+# Every frame change, the frame change dispatcher calls this function (the update of the 'gradsurfaces' layer,
+# see alchemist_layers).
+# The surfaces are drawn by the next function, so the frame handler only decides what to show for every frame,
+# and moves the vertices of a surface shared by several steps.
+def my_handler(scene, frame):
+    global shownrun
+    run = None
+    if (frame >= 1 and frame <= len(gradlist)):
+        run = bisect_right(gradruns, frame) - 1
+    if (run != shownrun):
+        if (shownrun != None):
+            make_hidden(gradobjects[shownrun])
+        if (run != None):
+            make_visible(gradobjects[run])
+        shownrun = run
+    if (run != None):
+        end = gradruns[run+1] if run+1 < len(gradruns) else len(gradlist)+1
+        if (end - gradruns[run] > 1):
+            set_surface_location(gradlist, frame, run)
+
+# Plane displaced by the image sequence of a field: its vertices are on the grid cells, in the [-1, 1] texture space
+# of local coordinates, and the object is scaled so that the cells fall on their region of the trace
+def fieldObject(grad_file, frames, bounds, shape, low, high):
+    columns, rows = shape
+    verts = np.zeros((rows*columns, 3))
+    verts[:, 0] = np.tile((2*np.arange(columns)+1-columns) / float(columns), rows) # Pixel centers
+    verts[:, 1] = np.repeat((2*np.arange(rows)+1-rows) / float(rows), columns)
+    grid = np.arange(rows*columns).reshape(rows, columns)
+    faces = np.stack((grid[:-1, :-1], grid[:-1, 1:], grid[1:, 1:], grid[1:, :-1]), axis=-1).reshape(-1, 4)
+    mesh = bpy.data.meshes.new(FIELD_NAME)
+    mesh.from_pydata(verts.tolist(), [], faces.tolist())
+    mesh.update(calc_edges=True)
+    obj = bpy.data.objects.get(FIELD_NAME)
+    if (obj == None):
+        obj = bpy.data.objects.new(FIELD_NAME, mesh)
+        bpy.context.scene.objects.link(obj)
+    else:
+        obj.data = mesh
+    width, height = bounds[2]-bounds[0], bounds[3]-bounds[1]
+    obj.location = (bounds[0]+width/2, bounds[1]+height/2, low)
+    obj.scale = (width*columns/(2.0*(columns-1)), height*rows/(2.0*(rows-1)), 1)
+    make_visible(obj)
+    # Image sequence, one image a step, played by the texture of a displacement modifier (no frame handler)
+    image = bpy.data.images.load(alchemist_field.fieldPath(grad_file, 1))
+    image.source = 'SEQUENCE'
+    texture = bpy.data.textures.get(FIELD_NAME)
+    if (texture == None):
+        texture = bpy.data.textures.new(FIELD_NAME, type='IMAGE')
+    texture.image = image
+    texture.extension = 'EXTEND'
+    texture.image_user.frame_start = 1
+    texture.image_user.frame_duration = frames
+    texture.image_user.frame_offset = 0
+    texture.image_user.use_auto_refresh = True
+    modifier = obj.modifiers.get(FIELD_NAME)
+    if (modifier == None):
+        modifier = obj.modifiers.new(FIELD_NAME, 'DISPLACE')
+    modifier.texture = texture
+    modifier.texture_coords = 'LOCAL'
+    modifier.direction = 'Z'
+    modifier.mid_level = 0.0 # Black is the lowest value, white the highest
+    modifier.strength = high - low
+    return obj
+
+# Draw the gradients as a field (see alchemist_field): every step is rasterized on a grid of 'resolution' cells along
+# the longer side and written to an image sequence next to the file (on another thread, if 'threaded'), then a
+# single plane plays it; yields the fraction of the steps written
+# A cancelled or failed import removes the images it wrote, as the rollback removes its data-blocks
+def drawField(grad_file, trace, resolution, threaded, profile):
+    bounds = alchemist_field.fieldBounds(trace)
+    shape = alchemist_field.fieldShape(bounds, resolution)
+    low, high = alchemist_field.fieldRange(trace)
+    written = alchemist_jobs.Background(alchemist_field.writeFields(trace, grad_file, bounds, shape, low, high), threaded)
+    frames = 0
+    done = False
+    try:
+        while (not written.done):
+            frames += len(written.ready())
+            yield float(frames) / max(len(trace), 1)
+        profile.add('rasterize', written.seconds)
+        profile.count('cells', shape[0]*shape[1])
+        if (len(trace) > 0):
+            with profile.phase('objects'):
+                fieldObject(grad_file, len(trace), bounds, shape, low, high)
+        done = True
+    finally:
+        written.close()
+        if (not done):
+            written.wait() # The worker thread may be writing an image
+            alchemist_field.removeFields(grad_file)
 
 # Draw all the gradients surfaces
-def importGrads(grad_file):
-    firstTime = datetime.time(datetime.now())
-    bpy.context.scene.frame_current=1
-    scene = bpy.context.scene
-    global gradlist
-    gradlist = readGradsFromFile(grad_file)
-    for key in gradlist:
-        print('Grad_'+str(key)+' done, actual time: '+str(datetime.time(datetime.now())))
-        mesh = bpy.data.meshes.new('Grad_'+str(key))
-        mesh.from_pydata(gradlist[key],[],[])
-        obj = bpy.data.objects.new('Grad_'+str(key),mesh)
-        scene.objects.link(obj)
-        point_cloud.gb["TargetObject"] = 'Grad_'+str(key)
-        point_cloud.SkinVerts()
-    bpy.app.handlers.frame_change_pre.append(my_handler)
-    bpy.context.scene.frame_current=1
-    print('First timestamp was: '+str(firstTime))
+# The surface of every step is a triangulation of its (x, y) points (see alchemist_surface). With 'parallel',
+# the faces are computed by a pool of 'processes' worker processes (0: one per core) and the meshes are assembled
+# here, as the results arrive. With 'incremental', a step with the same nodes as the previous one reuses its faces.
+# With 'shared', such steps also reuse the same mesh, whose vertices are moved by the frame handler.
+# Triangles between scattered gradients with an edge longer than 'max_edge' are dropped.
+# With 'cache', the parsed trace is kept in a binary cache next to the file (see alchemist_trace).
+# 'stride', 'interval' and 'spacing' skin fewer steps and gradients, for a quick preview
+# The import profile is printed, and written to the JSON file 'report' if given
+# With 'mode' set to 'FIELD', the gradients are not skinned: they are rasterized on a grid of 'resolution' cells along
+# the longer side, and a single plane is displaced by the resulting image sequence (see drawField)
+def importGrads(grad_file, parallel=True, processes=0, incremental=True, max_edge=MAX_EDGE, shared=True, cache=True,
+                stride=1, interval=0.0, spacing=0.0, report=None, mode='SKIN', resolution=alchemist_field.RESOLUTION):
+    importGradsJob(grad_file, parallel, processes, incremental, max_edge, shared, cache, stride, interval, spacing,
+                   report, mode, resolution).run()
+
+# The import of importGrads as an alchemist_jobs.Job: the file is parsed on a worker thread, the surfaces are skinned
+# on another one (feeding the worker processes) while the main thread builds the objects of the surfaces ready so far
+def importGradsJob(grad_file, parallel=True, processes=0, incremental=True, max_edge=MAX_EDGE, shared=True, cache=True,
+                   stride=1, interval=0.0, spacing=0.0, report=None, mode='SKIN', resolution=alchemist_field.RESOLUTION):
+    profile = alchemist_profile.begin('gradsurfaces', grad_file, bpy.data)
+    def prepare():
+        with profile.phase('parse'):
+            return alchemist_trace.StepStore(readGradsFromFile(grad_file, cache, stride, interval, spacing))
+    def build(job, trace):
+        global gradlist, gradruns, gradobjects, shownrun, gradprofile
+        bpy.context.scene.frame_current=1
+        scene = bpy.context.scene
+        gradprofile = profile
+        if (gradlist != None):
+            gradlist.close()
+        gradlist = trace
+        profile.count('steps', len(gradlist))
+        profile.count('gradients', len(gradlist.names))
+        # Parsing does not touch the scene: the frame range is set once, afterwards
+        scene.frame_start = 1
+        scene.frame_end = max(len(gradlist), 1)
+        workers = processes
+        if parallel:
+            if hasattr(bpy.app, 'binary_path_python'):
+                multiprocessing.set_executable(bpy.app.binary_path_python) # Spawned workers run Python, not Blender
+        else:
+            workers = 1
+        # Surfaces of an earlier import are hidden once, here
+        for ob in scene.objects:
+            if (ob.name.startswith('Grad_')):
+                make_hidden(ob)
+        if (mode == 'FIELD'): # No surfaces, and no frame handler
+            alchemist_layers.removeLayer(bpy.app.handlers.frame_change_pre, 'gradsurfaces')
+            gradruns = []
+            gradobjects = []
+            shownrun = None
+            for progress in drawField(grad_file, gradlist.trace, resolution, job.threaded, profile):
+                yield progress
+            bpy.context.scene.frame_current=1
+            alchemist_profile.end(profile, bpy.data, report)
+            return
+        if shared:
+            gradruns = alchemist_surface.topologyRuns(gradlist.ids)
+        else:
+            gradruns = list(range(1, len(gradlist)+1))
+        gradobjects = []
+        shownrun = None
+        skinned = alchemist_jobs.Background(alchemist_surface.skinSteps(gradlist.ids, gradlist.coords, workers or None,
+                                                                         incremental or shared, max_edge), job.threaded)
+        key = 0
+        try:
+            while (not skinned.done):
+                ready = skinned.ready()
+                with profile.phase('objects'):
+                    for faces in ready:
+                        key += 1
+                        if (len(gradobjects) < len(gradruns) and gradruns[len(gradobjects)] == key): # First step of a run
+                            ids, coords = gradlist.trace.step(key)
+                            mesh = bpy.data.meshes.new('Grad_'+str(key))
+                            mesh.from_pydata(coords.tolist(),[],alchemist_surface.faceList(faces))
+                            mesh.update(calc_edges=True)
+                            obj = bpy.data.objects.new('Grad_'+str(key),mesh)
+                            scene.objects.link(obj)
+                            make_hidden(obj)
+                            gradobjects.append(obj)
+                yield float(key) / max(len(gradlist), 1)
+        finally:
+            skinned.close() # Stops the worker processes, when cancelled
+        # Skinning runs alongside the building of the objects: its time is the one of the skinning thread
+        profile.add('skinning', skinned.seconds)
+        profile.count('surfaces', len(gradobjects))
+        alchemist_layers.setLayer(bpy.app.handlers.frame_change_pre, 'gradsurfaces', my_handler, profile)
+        bpy.context.scene.frame_current=1
+        my_handler(scene, 1)
+        alchemist_profile.end(profile, bpy.data, report)
+    return alchemist_jobs.Job('gradsurfaces', prepare, build, bpy.data, saveGrads, restoreGrads)
+
+# Module state of an import, replaced by the next one (see saveGrads)
+GRAD_STATE = ('gradlist', 'gradruns', 'gradobjects', 'shownrun', 'gradprofile')
+
+# State of the previous import, saved before a new one builds: module state, 'gradsurfaces' layer, surface and field
+# objects and frame range
+def saveGrads():
+    state = dict((name, globals()[name]) for name in GRAD_STATE)
+    scene = alchemist_jobs.SceneState(bpy.context.scene, ("Grad_",))
+    return state, alchemist_layers.layers.get('gradsurfaces'), scene
+
+# Put back the previous import after a cancelled one (the data-blocks of the cancelled one are removed afterwards)
+def restoreGrads(saved):
+    state, layer, scene = saved
+    if (gradlist != None and gradlist is not state['gradlist']):
+        gradlist.close()
+    globals().update(state)
+    scene.restore()
+    alchemist_layers.restoreLayer(bpy.app.handlers.frame_change_pre, 'gradsurfaces', layer)
 
 # USER INTERFACE
 
 from bpy_extras.io_utils import ImportHelper
 
-class ImportGraS(bpy.types.Operator, ImportHelper):
+class ImportGraS(alchemist_jobs.ModalImport, bpy.types.Operator, ImportHelper):
     """Import from Alchemist Grad file (.gra)"""
     bl_idname = "import_scene.gradsurf"
     bl_description = 'Import from Alchemist Gradients file (.gra) into surface'
@@ -112,14 +282,85 @@ class ImportGraS(bpy.types.Operator, ImportHelper):
     filename_ext = ".gra"
     filter_glob = StringProperty(default="*.gra", options={'HIDDEN'})
     filepath = StringProperty(subtype='FILE_PATH')
+    parallel = BoolProperty(
+        name="Parallel skinning",
+        description="Compute the surfaces in worker processes",
+        default=True)
+    processes = IntProperty(
+        name="Processes",
+        description="Worker processes for parallel skinning (0: one per core)",
+        default=0, min=0)
+    incremental = BoolProperty(
+        name="Reuse topology",
+        description="Reuse the faces of the previous step when the nodes do not change",
+        default=True)
+    shared = BoolProperty(
+        name="Shared topology",
+        description="A single mesh, with moving vertices, for consecutive steps with the same nodes",
+        default=True)
+    max_edge = FloatProperty(
+        name="Max edge",
+        description="Longest edge of a triangle between scattered gradients (0: no limit)",
+        default=MAX_EDGE, min=0.0)
+    cache = BoolProperty(
+        name="Cache",
+        description="Keep a binary copy of the parsed trace next to the file and reload it while the file does not change",
+        default=True)
+    stride = IntProperty(
+        name="Step stride",
+        description="Import one step every this many (1: every step)",
+        default=1, min=1)
+    interval = FloatProperty(
+        name="Time interval",
+        description="Least simulation time between two imported steps (0: no resampling)",
+        default=0.0, min=0.0)
+    spacing = FloatProperty(
+        name="Point spacing",
+        description="Keep one gradient per square of this side in every step (0: every gradient)",
+        default=0.0, min=0.0)
+    report_file = StringProperty(
+        name="Report",
+        description="Write the import profile to this JSON file (empty: only print it)",
+        subtype='FILE_PATH', default="")
+    mode = EnumProperty(
+        name="Mode",
+        items=(('SKIN', "Surfaces", "A triangulated surface through the gradients of every step"),
+               ('FIELD', "Field", "The gradients are rasterized into an image sequence displacing a single plane")),
+        default='SKIN')
+    resolution = IntProperty(
+        name="Resolution",
+        description="Field cells along the longer side of the region of the gradients",
+        default=alchemist_field.RESOLUTION, min=2, max=4096)
+    background = BoolProperty(
+        name="Background",
+        description="Import without blocking the interface, with a progress bar (Esc cancels and removes what was imported)",
+        default=True)
     def draw(self, context):
         layout = self.layout
-    def execute(self, context):
-        try:
-            importGrads(self.filepath)
-        except GraError:
-            print("Error when loading Gra file:\n" + theMessage)
-        return {'FINISHED'}
+        layout.prop(self, "cache")
+        layout.prop(self, "mode")
+        layout.prop(self, "resolution")
+        layout.prop(self, "parallel")
+        layout.prop(self, "processes")
+        layout.prop(self, "incremental")
+        layout.prop(self, "shared")
+        layout.prop(self, "max_edge")
+        layout.prop(self, "stride")
+        layout.prop(self, "interval")
+        layout.prop(self, "spacing")
+        layout.prop(self, "report_file")
+        layout.prop(self, "background")
+    # The import runs as an alchemist_jobs.Job (see alchemist_jobs.ModalImport)
+    def job(self, context):
+        return importGradsJob(self.filepath, self.parallel, self.processes, self.incremental, self.max_edge, self.shared,
+                              self.cache, self.stride, self.interval, self.spacing, self.report_file, self.mode,
+                              self.resolution)
+    def finished(self, job):
+        pass
+    def failed(self, job):
+        if (not isinstance(job.error, GraError)):
+            raise job.error
+        print("Error when loading Gra file:\n" + theMessage)
     def invoke(self, context, event):
         context.window_manager.fileselect_add(self)
         return {'RUNNING_MODAL'}
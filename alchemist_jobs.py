@@ -0,0 +1,317 @@
+# Background imports for the Alchemist import add-ons.
+# An import is a Job in two parts:
+#   - 'prepare', which does not touch bpy (parsing, geometry), and runs on a worker thread;
+#   - 'build', a generator which builds the scene on the main thread in small batches, yielding its progress.
+# Job.run does everything at once (scripts, background mode); ModalImport runs a job from a modal operator,
+# advancing it on a timer so that the interface stays responsive, with a progress bar and cancellation (Esc).
+# A cancelled or failed job is rolled back: the data-blocks it created are removed.
+# An operator following a file still being written keeps running after the import, refreshing it on a slower timer.
+# It does not import bpy: the operator, the context and bpy.data are the ones it is given.
+
+import time, threading, queue
+
+TIMER_STEP = 0.05 # Seconds between two timer events of a modal import
+STEP_BUDGET = 0.04 # Seconds of scene building at every timer event
+FOLLOW_STEP = 1.0 # Seconds between two refreshes of a followed file
+COLLECTIONS = ('objects', 'meshes', 'materials', 'actions', 'textures', 'images') # Data-blocks removed by a rollback
+
+# Names of the data-blocks of 'data' (bpy.data) when a job starts, so that a rollback can remove the new ones
+class Snapshot:
+    def __init__(self, data):
+        self.data = data
+        self.names = dict((c, set(getattr(data, c).keys())) for c in COLLECTIONS if hasattr(data, c))
+
+    # Remove the data-blocks created since the snapshot (the objects are unlinked from the scenes first)
+    def rollback(self):
+        removed = 0
+        for collection in self.names:
+            blocks = getattr(self.data, collection)
+            for name in list(blocks.keys()):
+                if name in self.names[collection]:
+                    continue
+                block = blocks.get(name)
+                if collection == 'objects':
+                    for scene in self.data.scenes:
+                        if scene.objects.get(name) == block:
+                            scene.objects.unlink(block)
+                blocks.remove(block)
+                removed += 1
+        return removed
+
+# What an import changes in a scene, saved before it builds so that a cancelled import can put it back (see Job):
+# the frame range and, for the objects whose names start with one of 'prefixes', visibility, location, data and action
+class SceneState:
+    def __init__(self, scene, prefixes):
+        self.scene = scene
+        self.frames = (scene.frame_start, scene.frame_end, scene.frame_current)
+        self.objects = []
+        for ob in scene.objects:
+            if ob.name.startswith(prefixes):
+                action = ob.animation_data.action if ob.animation_data != None else None
+                self.objects.append((ob, ob.hide, ob.hide_render, tuple(ob.location), ob.data, action))
+
+    def restore(self):
+        self.scene.frame_start, self.scene.frame_end, self.scene.frame_current = self.frames
+        for ob, hide, hide_render, location, data, action in self.objects:
+            ob.hide = hide
+            ob.hide_render = hide_render
+            ob.location = location
+            if ob.data != data:
+                ob.data = data
+            if ob.animation_data != None: # Unlink the actions of the cancelled import, before they are removed
+                ob.animation_data.action = action
+
+# Iterator consumed by a worker thread: the main thread takes the items ready so far, without waiting
+# Without 'threaded' (a job run at once, see Job.threaded) the iterator is consumed by ready, an item at a time
+class Background:
+    def __init__(self, iterable, threaded=True):
+        self.items = queue.Queue()
+        self.stopped = False
+        self.done = False
+        self.error = None
+        self.seconds = 0.0 # Time spent by the worker thread
+        self.iterator = None
+        if threaded:
+            self.thread = threading.Thread(target=self.work, args=(iterable,))
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self.iterator = iter(iterable)
+
+    def work(self, iterable):
+        start = time.time()
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if self.stopped:
+                    break
+                self.items.put((True, item))
+        except Exception as e:
+            self.error = e
+        finally:
+            if hasattr(iterator, 'close'): # Let a generator clean up (e.g. terminate its process pool)
+                iterator.close()
+            self.seconds = time.time() - start
+            self.items.put((False, None))
+
+    # Items ready so far, waiting at most 'timeout' seconds for the first one
+    # Raises the error of the worker thread, if any
+    def ready(self, timeout=0.01):
+        if self.iterator != None:
+            return self.next()
+        result = []
+        try:
+            more, item = self.items.get(True, timeout)
+            while True:
+                if not more:
+                    self.done = True
+                    break
+                result.append(item)
+                more, item = self.items.get_nowait()
+        except queue.Empty:
+            pass
+        if self.done and self.error != None:
+            raise self.error
+        return result
+
+    def next(self):
+        start = time.time()
+        try:
+            return [next(self.iterator)]
+        except StopIteration:
+            self.done = True
+            return []
+        finally:
+            self.seconds += time.time() - start
+
+    # Stop consuming the iterator
+    def close(self):
+        self.stopped = True
+        if self.iterator != None and hasattr(self.iterator, 'close'):
+            self.iterator.close()
+
+    # Wait for the worker thread to finish its current item, after close
+    def wait(self):
+        if self.iterator == None:
+            self.thread.join()
+
+# An import: 'prepare' runs on a worker thread and returns what 'build(job, prepared)' needs; 'build' is a generator
+# which changes the scene and yields its progress (0 to 1). 'build' can leave a value in job.result.
+# 'save', if given, is called right before the build starts and returns the module state of the previous import
+# (trace, index, frame handler layer); 'restore(saved)' puts it back when the build is cancelled, so that only the
+# partial results of this import go.
+class Job:
+    def __init__(self, name, prepare, build, data, save=None, restore=None):
+        self.name = name
+        self.prepare = prepare
+        self.build = build
+        self.save = save
+        self.restore = restore
+        self.saved = None
+        self.data = data # bpy.data, for the rollback
+        self.snapshot = None
+        self.state = 'NEW' # 'PREPARING', 'BUILDING', 'DONE', 'FAILED' or 'CANCELLED'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.prepared = None
+        self.thread = None
+        self.threaded = False # Whether 'build' may leave work to other threads (see Background)
+        self.steps = None
+
+    # Do the whole job now, on this thread; errors are raised, after the rollback
+    def run(self):
+        self.snapshot = Snapshot(self.data)
+        try:
+            self.begin(self.prepare())
+            for progress in self.steps:
+                self.progress = progress
+        except Exception as e:
+            self.error = e
+            self.state = 'FAILED'
+            self.cancel()
+            raise
+        self.state = 'DONE'
+        return self.result
+
+    # Start the build, saving the state of the previous import first
+    def begin(self, prepared):
+        if self.save != None:
+            self.saved = self.save()
+        self.steps = self.build(self, prepared)
+        self.state = 'BUILDING'
+
+    # Start preparing on a worker thread; 'step' does the rest
+    def start(self):
+        self.snapshot = Snapshot(self.data)
+        self.state = 'PREPARING'
+        self.threaded = True
+        self.thread = threading.Thread(target=self.work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def work(self):
+        try:
+            self.prepared = self.prepare()
+        except Exception as e:
+            self.error = e
+
+    # Advance the job for about 'budget' seconds; returns its state
+    def step(self, budget=STEP_BUDGET):
+        if self.state == 'PREPARING':
+            if self.thread.is_alive():
+                return self.state
+            if self.error != None:
+                self.state = 'FAILED'
+                return self.state
+            self.begin(self.prepared)
+        if self.state == 'BUILDING':
+            end = time.time() + budget
+            try:
+                while time.time() < end:
+                    self.progress = next(self.steps)
+            except StopIteration:
+                self.state = 'DONE'
+                self.progress = 1.0
+            except Exception as e:
+                self.error = e
+                self.state = 'FAILED'
+        return self.state
+
+    # Stop the job and remove what it created; returns the number of data-blocks removed
+    def cancel(self):
+        if self.state != 'FAILED':
+            self.state = 'CANCELLED'
+        if self.steps != None: # The build started: the module state is the one of this import
+            self.steps.close() # Runs the 'finally' clauses of build
+            if self.restore != None:
+                self.restore(self.saved)
+        return self.snapshot.rollback() if self.snapshot != None else 0
+
+# Mixin for import operators: with 'background' (a BoolProperty of the operator) and a window, the job returned by
+# self.job(context) runs as a modal operator; otherwise it runs at once.
+# The operator defines job(context), finished(job) (when done) and failed(job) (on errors, after the rollback).
+# With 'follow' (a BoolProperty of the operator) and a window, the operator then calls refresh(context) every
+# FOLLOW_STEP seconds, until Esc or until refresh returns None; what was imported stays. Esc ends the file: a last
+# refresh(context, True) reads its last row, even without a newline.
+class ModalImport:
+    def execute(self, context):
+        job = self.job(context)
+        if not (self.background and getattr(context, 'window', None) != None):
+            try:
+                job.run()
+            except Exception:
+                self.failed(job)
+                return {'FINISHED'}
+            self.finished(job)
+            if self.following(context):
+                context.window_manager.modal_handler_add(self)
+                return {'RUNNING_MODAL'}
+            return {'FINISHED'}
+        self.running = job
+        job.start()
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(TIMER_STEP, context.window)
+        wm.modal_handler_add(self)
+        if hasattr(wm, 'progress_begin'):
+            wm.progress_begin(0, 100)
+        return {'RUNNING_MODAL'}
+
+    # After the import: start following the file, if asked (returns whether the operator keeps running)
+    def following(self, context):
+        if not (getattr(self, 'follow', False) and getattr(context, 'window', None) != None):
+            return False
+        self.running = None
+        self.timer = context.window_manager.event_timer_add(FOLLOW_STEP, context.window)
+        return True
+
+    def modal(self, context, event):
+        job = self.running
+        if job == None: # Following the file
+            if event.type == 'ESC':
+                context.window_manager.event_timer_remove(self.timer)
+                self.refresh(context, True)
+                return {'FINISHED'}
+            if event.type != 'TIMER':
+                return {'PASS_THROUGH'}
+            added = self.refresh(context)
+            if added == None:
+                context.window_manager.event_timer_remove(self.timer)
+                return {'FINISHED'}
+            if added > 0:
+                self.report({'INFO'}, str(added)+' new steps')
+            return {'PASS_THROUGH'}
+        if event.type == 'ESC':
+            removed = job.cancel()
+            self.report({'WARNING'}, 'Import cancelled, '+str(removed)+' data-blocks removed')
+            return self.stop(context, {'CANCELLED'})
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+        state = job.step()
+        wm = context.window_manager
+        if hasattr(wm, 'progress_update'):
+            wm.progress_update(int(job.progress * 100))
+        if state == 'DONE':
+            self.finished(job)
+            self.stop(context, {'FINISHED'})
+            return {'RUNNING_MODAL'} if self.following(context) else {'FINISHED'}
+        if state == 'FAILED':
+            job.cancel()
+            self.stop(context, {'CANCELLED'}) # Before failed, which raises the errors it does not expect
+            self.failed(job)
+            return {'CANCELLED'}
+        return {'PASS_THROUGH'}
+
+    def stop(self, context, result):
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        if hasattr(wm, 'progress_end'):
+            wm.progress_end()
+        return result
+
+    def cancel(self, context): # Blender cancels the operator (e.g. the file is closed)
+        if self.running == None: # Following: the import is done, only the timer goes
+            context.window_manager.event_timer_remove(self.timer)
+            return
+        self.running.cancel()
+        self.stop(context, {'CANCELLED'})
@@ -0,0 +1,99 @@
+# Frame change dispatcher shared by the Alchemist import add-ons.
+# A single handler is registered in frame_change_pre; every import owns a named layer (nodes, gradients, surfaces)
+# whose update function moves its own objects through its own index. Importing again replaces the layer in place.
+# Frame changes to the frame already shown are skipped, and the time of every layer update is measured: it goes to
+# the profile of the layer (see alchemist_profile), and costs() sums it up.
+# It does not import bpy: the handler lists are the ones it is given (bpy.app.handlers.frame_change_pre).
+
+import time
+from collections import OrderedDict
+
+layers = OrderedDict() # Couples (name, Layer), updated in import order
+shownframe = None # Frame shown by the last dispatch (None: every layer has to be updated)
+
+# An imported layer: update(scene, frame) moves its objects to a frame
+class Layer:
+    def __init__(self, name, update, profile=None):
+        self.name = name
+        self.update = update
+        self.profile = profile # Gets the latency of every update, if given
+        self.frames = 0 # Updates done
+        self.seconds = 0.0 # Time of the updates
+        self.slowest = 0.0
+
+    def run(self, scene, frame):
+        start = time.time()
+        self.update(scene, frame)
+        seconds = time.time() - start
+        self.frames += 1
+        self.seconds += seconds
+        self.slowest = max(self.slowest, seconds)
+        if (self.profile != None):
+            self.profile.frame(seconds)
+
+# The frame change handler: updates every layer, unless the frame is the one already shown
+def dispatch(scene):
+    global shownframe
+    frame = scene.frame_current
+    if (frame == shownframe):
+        return
+    for layer in list(layers.values()):
+        layer.run(scene, frame)
+    shownframe = frame
+
+# Tell if a handler is a dispatcher (this one, or the one of an earlier load of this module)
+def isDispatcher(handler):
+    return getattr(handler, '__name__', None) == dispatch.__name__ and getattr(handler, '__module__', None) == __name__
+
+# Register the dispatcher in 'handlers' (once)
+# A missing dispatcher was dropped with the scene (a new file was loaded): the layers left are stale
+def install(handlers):
+    if (dispatch not in handlers):
+        layers.clear()
+    for handler in [h for h in handlers if isDispatcher(h) and h is not dispatch]:
+        handlers.remove(handler)
+    if (dispatch not in handlers):
+        handlers.append(dispatch)
+
+# Add a layer, or replace the layer with the same name; the next frame change updates every layer
+def setLayer(handlers, name, update, profile=None):
+    global shownframe
+    install(handlers)
+    layers[name] = Layer(name, update, profile)
+    shownframe = None
+
+# Remove a layer, and the dispatcher with the last one
+def removeLayer(handlers, name):
+    global shownframe
+    layers.pop(name, None)
+    shownframe = None
+    if (len(layers) == 0):
+        while (dispatch in handlers):
+            handlers.remove(dispatch)
+
+# Put back a layer got from 'layers' before it was replaced (None: there was no layer with that name)
+def restoreLayer(handlers, name, layer):
+    global shownframe
+    if (layer == None):
+        removeLayer(handlers, name)
+        return
+    install(handlers)
+    layers[name] = layer
+    shownframe = None
+
+# Force the update of every layer at the next frame change (e.g. after moving the camera, when culling)
+def invalidate():
+    global shownframe
+    shownframe = None
+
+# Update cost of every layer: a list of (name, updates, mean milliseconds, slowest milliseconds)
+def costs():
+    result = []
+    for layer in layers.values():
+        mean = layer.seconds / layer.frames * 1000.0 if layer.frames else 0.0
+        result.append((layer.name, layer.frames, mean, layer.slowest * 1000.0))
+    return result
+
+# Update costs as text, one layer a line
+def text():
+    return '\n'.join('%-14s %8d updates %10.3f ms mean %10.3f ms slowest' % cost for cost in costs())
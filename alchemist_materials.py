@@ -0,0 +1,73 @@
+# Material pooling for the Alchemist import add-ons.
+# Instead of a material for every entity, the entities share the materials of a fixed-size palette: every entity
+# gets a palette slot from a key (its name, its type, its quantized value...). With a shared material, a single
+# material takes the color from the object color, set per object.
+# It does not import bpy: the pool creates its materials in the collection it is given (bpy.data.materials).
+
+import colorsys, zlib
+import numpy as np
+
+PALETTE_SIZE = 16 # Default number of colors of a palette
+GOLDEN = 0.618033988749895 # Hue step between consecutive colors of a hue palette, so that neighbours differ
+
+# Distinct colors, for keys with no order (names, types)
+def hues(size):
+    return [colorsys.hsv_to_rgb((i * GOLDEN) % 1.0, 0.65, 0.95) for i in range(size)]
+
+# Colors from blue to red, for ordered keys (quantized values)
+def ramp(size):
+    if size == 1:
+        return [colorsys.hsv_to_rgb(0.33, 0.85, 0.95)]
+    return [colorsys.hsv_to_rgb(0.66 * (1.0 - i / (size - 1.0)), 0.85, 0.95) for i in range(size)]
+
+# Palette slot of a key: integers are taken modulo 'size', anything else by a hash that does not change
+# between Blender sessions (unlike hash() of a string)
+def slot(key, size):
+    if isinstance(key, int):
+        return key % size
+    return zlib.crc32(str(key).encode('utf-8')) % size
+
+# Palette slots of an array of values in [low, high], split in 'size' equal bands
+def quantize(values, low, high, size):
+    if high <= low:
+        return np.zeros(len(values), dtype=np.int32)
+    bands = np.floor((np.asarray(values, dtype=np.float64) - low) / (high - low) * size).astype(np.int32)
+    return np.clip(bands, 0, size - 1)
+
+# Materials of a palette, created once and reused by every entity (and by the next imports)
+class MaterialPool:
+    def __init__(self, materials, prefix, colors, shared=False):
+        self.materials = materials # Collection where the materials are created (bpy.data.materials)
+        self.prefix = prefix # Material names: prefix + slot, or prefix + 'Shared'
+        self.colors = colors
+        self.shared = shared
+        self.pool = {} # Couples (slot, material)
+
+    def __len__(self):
+        return len(self.colors)
+
+    # Material of a palette slot (of every slot, when shared)
+    def material(self, index):
+        if self.shared:
+            index = 'Shared'
+        mat = self.pool.get(index)
+        if mat == None:
+            name = self.prefix + str(index)
+            mat = self.materials.get(name)
+            if mat == None:
+                mat = self.materials.new(name)
+            if self.shared:
+                mat.diffuse_color = (1.0, 1.0, 1.0)
+                mat.use_object_color = True # The color is the one of the object
+            else:
+                mat.diffuse_color = self.colors[index]
+            self.pool[index] = mat
+        return mat
+
+    # Give an object the color of a palette slot
+    def apply(self, ob, index):
+        if self.shared:
+            ob.color = tuple(self.colors[index]) + (1.0,)
+        mat = self.material(index)
+        if ob.active_material != mat:
+            ob.active_material = mat
@@ -10,37 +10,94 @@ bl_info = {
     "category": "Import-Export"}
 
 
-import bpy, random
+import bpy, bmesh, random, time
+import alchemist_trace, alchemist_spatial, alchemist_profile, alchemist_materials, alchemist_jobs, alchemist_layers
+import numpy as np
 from os.path import expanduser
-from bpy.props import StringProperty
+from bpy.props import StringProperty, EnumProperty, BoolProperty, FloatVectorProperty, IntProperty, FloatProperty
 
 user_home = expanduser("~")
 theMessage = ""
+NODE_Z = 2.5 # Height of a moved node (half the cone depth)
+NODE_TYPE = "person" # Type of the nodes read from a file
+NODE_MESH = "NodeCone" # Cone mesh shared by all the node objects
+CONE_VERTICES = 32
+CONE_RADIUS = 0.3
+CONE_DEPTH = 5
+CLOUD_NAME = "NodeCloud" # Point cloud object, in 'CLOUD' mode (no "node_" prefix, so the frame handler leaves it alone)
+CULL_MARGIN = 1.0 # Margin around the camera view, when culling by camera
+BATCH = 50 # Nodes built between two progress reports of a background import
 
-# Dictionary of steps: every step is a couple (frame_number, step_dictionary) in the dict
-steplist = {}
+# Keyframe interpolation values, as accepted by keyframe_points.foreach_set
+CONSTANT = 0
+LINEAR = 1
+
+# Parsed node trace, behind a bounded cache of decoded steps (an alchemist_trace.StepStore):
+# step number 'frame' holds the nodes of that frame
+steplist = None
+# How the nodes are animated: 'HANDLER', 'BAKE' or 'CLOUD' (see importNodes)
+nodemode = 'HANDLER'
+# Index used by the frame handler, so that a frame change only touches the nodes which change
+nodeobjects = {} # Couples (node_id, object) of the node objects in the scene
+nodetransitions = [] # Nodes entering and exiting every step (see alchemist_trace.transitions)
+shownids = np.empty(0, dtype=np.int32) # Ids of the nodes currently visible
+shownframe = None # Step currently shown
+# Interpolated playback (see frame_step): None (a step every frame) or an alchemist_trace.Clock
+nodeclock = None
+# Profile of the last import, which also gets the latency of the frame handler (see alchemist_profile)
+nodeprofile = None
+# Culling (see cull_box): None, a region (xmin, ymin, xmax, ymax) or 'CAMERA'
+nodecull = None
+# Materials of the nodes: an alchemist_materials.MaterialPool (the name of a node chooses its color), or None for a
+# material for every node
+nodepool = None
+# Follow mode (see refreshNodes): None, or the alchemist_trace.Follower reading the node file as it grows
+nodefollower = None
+
+# Cone mesh of the nodes, built once (the same as primitive_cone_add with CONE_VERTICES, CONE_RADIUS and CONE_DEPTH)
+# Its material slot is linked to the objects, so that every node can have its own material
+def nodeMesh():
+    mesh = bpy.data.meshes.get(NODE_MESH)
+    if (mesh == None):
+        angles = np.arange(CONE_VERTICES) * 2 * np.pi / CONE_VERTICES
+        verts = np.zeros((CONE_VERTICES+1, 3))
+        verts[:-1, 0] = CONE_RADIUS * np.cos(angles)
+        verts[:-1, 1] = CONE_RADIUS * np.sin(angles)
+        verts[:-1, 2] = -CONE_DEPTH / 2.0
+        verts[-1, 2] = CONE_DEPTH / 2.0 # Tip
+        sides = [(i, (i+1) % CONE_VERTICES, CONE_VERTICES) for i in range(CONE_VERTICES)]
+        base = [tuple(range(CONE_VERTICES-1, -1, -1))]
+        mesh = bpy.data.meshes.new(NODE_MESH)
+        mesh.from_pydata(verts.tolist(), [], sides+base)
+        mesh.update(calc_edges=True)
+        mesh.materials.append(bpy.data.materials.new(NODE_MESH+'Mat'))
+    return mesh
 
 # Draw a single node (represented by a cone)
-def createMeshFromPrimitive(name, origin):
-    bpy.ops.mesh.primitive_cone_add(
-        vertices=32, 
-        radius=0.3, 
-        depth=5, 
-        cap_end=True, 
-        view_align=False, 
-        enter_editmode=False, 
-        location=origin, 
-        rotation=(0, 0, 0))
-    ob = bpy.context.object
-    ob.name = name
+# All the nodes are linked duplicates of the same cone mesh, created through bpy.data (no operator call)
+# During an import, the time spent on its material goes to the 'materials' phase of 'profile'
+def createMeshFromPrimitive(name, origin, profile=None):
+    ob = bpy.data.objects.new(name, nodeMesh())
+    ob.location = origin
+    bpy.context.scene.objects.link(ob)
     ob.show_name = True
-    me = ob.data
-    me.name = name+'Mesh'
-    mat = bpy.data.materials.new(name+'Mat')
-    mat.diffuse_color = (random.random(),random.random(),random.random())
-    ob.active_material = mat
+    ob.material_slots[0].link = 'OBJECT'
+    if (profile == None):
+        setNodeMaterial(ob, name)
+    else:
+        with profile.phase('materials'):
+            setNodeMaterial(ob, name)
     return ob
 
+# Give a node its material: a new one, or the one of its palette slot
+def setNodeMaterial(ob, name):
+    if (nodepool == None):
+        mat = bpy.data.materials.new(name+'Mat')
+        mat.diffuse_color = (random.random(),random.random(),random.random())
+        ob.active_material = mat
+    else:
+        nodepool.apply(ob, alchemist_materials.slot(name, len(nodepool)))
+
 # Tell if a string may represent a float
 def is_float(str):
     try:
@@ -49,26 +106,29 @@ def is_float(str):
     except ValueError:
         return False
 
-# Read nodes from file and put in a dict structure
-# The single step is represented by a dictionary itself, which couples are (node_name, (x, y))
-def readNodesFromFile(filename):
-    steps = {}
-    step = 1
-    with open(filename, 'r') as csvfile:
-        for row in csvfile.readlines():
-            nodes = {}
-            time, sep, rest = row.partition(';') # Read the time
-            realstep, sep, nodelist = rest.partition(';') # Read the step number
-            bpy.ops.anim.change_frame(frame=int(step))
-            for node in nodelist.split(';'):
-                nodename,sep,rest = node.partition(',') # Read the node name
-                x,sep,rest = rest.partition(',') # Read the x value
-                y,sep,type = rest.partition(',') # Read the y value, everything else is 'type'
-                if (type == "person"): # Only if the node qualifies as a person
-                    nodes[nodename] = (float(x),float(y)) # Insert the node in the dictionary
-            steps[step] = nodes
-            step = step+1
-    return steps
+# Read nodes from file into a Trace (see alchemist_trace)
+# Only the nodes which qualify as a person are kept, every step has their ids and (x, y) coordinates
+# With 'cache', the binary cache of the file is used when valid, and written otherwise
+# 'stride' and 'interval' decimate the steps for a preview (see alchemist_trace.decimate)
+def readNodesFromFile(filename, cache=False, stride=1, interval=0.0):
+    global theMessage
+    try:
+        return alchemist_trace.decimate(alchemist_trace.readNodes(filename, NODE_TYPE, cache=cache), stride, interval)
+    except alchemist_trace.TraceError as e:
+        theMessage = e.value
+        raise NodError(e.value)
+
+# Start following a node file still being written by a running simulation (see alchemist_trace.Follower)
+# The nodes read so far are in the trace of the follower, which grows at every poll
+def followNodesFile(filename):
+    global theMessage
+    try:
+        follower = alchemist_trace.Follower(filename, 2, NODE_TYPE)
+        follower.poll()
+        return follower
+    except (alchemist_trace.TraceError, IOError, OSError) as e:
+        theMessage = getattr(e, 'value', str(e))
+        raise NodError(theMessage)
 
 # Hide an object which has not to be seen in the frame
 def make_hidden(object):
@@ -80,45 +140,351 @@ def make_visible(object):
     object.hide = False
     object.hide_render = False
 
+# Build the index of the node objects for a new trace
+# The node objects already in the scene are hidden once here, instead of at every frame
+def indexNodeObjects(trace):
+    global nodeobjects, nodetransitions, shownids, shownframe
+    scene = bpy.context.scene
+    for key in scene.objects.keys():
+        if (key.startswith("node_")):
+            make_hidden(scene.objects.get(key))
+    nodeobjects = {}
+    for nid, name in enumerate(trace.names):
+        ob = scene.objects.get("node_"+name)
+        if (ob != None):
+            nodeobjects[nid] = ob
+    nodetransitions = alchemist_trace.transitions(trace)
+    shownids = np.empty(0, dtype=np.int32)
+    shownframe = None
+
+# Region of interest of a frame: None (everything), the region given at import or what the active camera sees
+def cull_box(scene):
+    if (nodecull == 'CAMERA'):
+        if (scene.camera == None):
+            return None
+        return alchemist_spatial.cameraBox(scene.camera, scene, 0.0, CULL_MARGIN)
+    return nodecull
+
+# Step shown on a frame and how far the frame is towards the next step (a couple (step, alpha))
+# Without a clock every frame shows a whole step; the step is None outside the trace
+def frame_step(trace, frame):
+    if (nodeclock == None):
+        if (frame >= 1 and frame <= len(trace)):
+            return frame, 0.0
+        return None, 0.0
+    return nodeclock.locate(frame)
+
+# Nodes shown on a frame: a tuple (step, box, ids, coords), where box is the culling region, if any
+def frame_nodes(trace, frame):
+    box = None
+    step, alpha = frame_step(trace, frame)
+    if (step != None):
+        ids, coords = alchemist_trace.interpolate(trace, step, alpha)
+        box = cull_box(bpy.context.scene)
+        if (box != None):
+            inside = trace.grid(step).query(box)
+            ids, coords = ids[inside], coords[inside]
+    else:
+        ids, coords = np.empty(0, dtype=np.int32), np.empty((0, 2), dtype=np.float32)
+    return step, box, ids, coords
+
 # Move the objects (called by the frame handler)
-def set_objects_location(node_dict,frame):
-    # Hide alle the existing objects
-    for key2 in bpy.context.scene.objects.keys():
-        if (key2.startswith("node_")):
-            ob = bpy.context.scene.objects.get(key2)
-            make_hidden(ob)
-    for key, (x,y) in node_dict[frame].items():
-        ob = bpy.context.scene.objects.get("node_"+key)
+# Only the nodes entering or exiting the frame change visibility; with culling, only the nodes in the region
+# of interest are created, moved and shown
+def set_objects_location(trace,frame):
+    global shownids, shownframe
+    step, box, ids, coords = frame_nodes(trace, frame)
+    if (box == None and shownframe != None and step == shownframe+1):
+        enter, exit = nodetransitions[step-1]
+    else: # Not the next step: compare with what is shown now
+        enter, exit = np.setdiff1d(ids, shownids), np.setdiff1d(shownids, ids)
+    # Hide the objects which are not in this frame anymore
+    for nid in exit.tolist():
+        make_hidden(nodeobjects[nid])
+    names = trace.names
+    for nid, (x,y) in zip(ids.tolist(), coords.tolist()):
+        ob = nodeobjects.get(nid)
         # Create the new objects for this frame, if any
         if (ob == None):
-            ob = createMeshFromPrimitive("node_"+key, (float(x),float(y),0))
-        # Make visible and move only the objects which are to be seen in this frame
+            ob = nodeobjects[nid] = createMeshFromPrimitive("node_"+names[nid], (x,y,0))
+        # Move only the objects which are to be seen in this frame
         else:
-            ob.location = (x, y, 2.5)
-        make_visible(ob)
+            ob.location = (x, y, NODE_Z)
+    # Make visible the objects which enter this frame
+    for nid in enter.tolist():
+        make_visible(nodeobjects[nid])
+    shownids = ids
+    shownframe = step
+
+# Create in batches the objects of the nodes shown on a frame, yielding the fraction created
+# (a background import builds the first frame this way, then set_objects_location only moves them)
+def createFrameObjects(trace, frame):
+    ids, coords = frame_nodes(trace, frame)[2:]
+    missing = [(nid, x, y) for nid, (x, y) in zip(ids.tolist(), coords.tolist()) if nid not in nodeobjects]
+    for i in range(0, len(missing), BATCH):
+        for nid, x, y in missing[i:i+BATCH]:
+            nodeobjects[nid] = createMeshFromPrimitive("node_"+trace.names[nid], (x, y, NODE_Z), nodeprofile)
+        yield min(float(i+BATCH) / len(missing), 1.0)
+
+# Create the point cloud: a single mesh, with a vertex for every node of the frame shown (see set_cloud_location),
+# and a cone, child of the cloud, instanced on every vertex
+def createNodeCloud(trace):
+    mesh = bpy.data.meshes.new(CLOUD_NAME+'Mesh')
+    cloud = bpy.data.objects.get(CLOUD_NAME)
+    if (cloud == None):
+        cloud = bpy.data.objects.new(CLOUD_NAME, mesh)
+        bpy.context.scene.objects.link(cloud)
+    else:
+        cloud.data = mesh
+    cloud.dupli_type = 'VERTS'
+    if (bpy.data.objects.get(CLOUD_NAME+'Cone') == None):
+        cone = createMeshFromPrimitive(CLOUD_NAME+'Cone', (0, 0, 0), nodeprofile)
+        cone.show_name = False
+        cone.parent = cloud
+    return cloud
+
+# Move the point cloud vertices to the nodes of a frame (called by the frame handler)
+# The cloud has a vertex for every node of the frame, in the order of the step: the nodes missing from the frame have
+# no vertex, so they are neither instanced nor rendered
+def set_cloud_location(trace,frame):
+    cloud = bpy.data.objects.get(CLOUD_NAME)
+    step, alpha = frame_step(trace, frame)
+    if (step != None):
+        coords = alchemist_trace.interpolate(trace, step, alpha)[1]
+    else:
+        coords = np.empty((0, 2), dtype=np.float32)
+    resize_cloud(cloud.data, len(coords))
+    co = np.empty((len(coords), 3), dtype=np.float32)
+    co[:, 0:2] = coords
+    co[:, 2] = NODE_Z
+    cloud.data.vertices.foreach_set('co', co.ravel())
+    cloud.data.update()
 
-# Every frame change, this function is called.
-def my_handler(scene):
-    global steplist
-    frame = scene.frame_current
-    set_objects_location(steplist,frame)
+# Give the point cloud mesh 'count' vertices, in place: vertices can only be added to a mesh, the surplus ones are
+# removed with bmesh (only when a frame has fewer nodes than the one before)
+def resize_cloud(mesh, count):
+    extra = len(mesh.vertices) - count
+    if (extra < 0):
+        mesh.vertices.add(-extra)
+    elif (extra > 0):
+        bm = bmesh.new()
+        bm.from_mesh(mesh)
+        bm.verts.ensure_lookup_table()
+        for v in [bm.verts[i] for i in range(count, count + extra)]:
+            bm.verts.remove(v)
+        bm.to_mesh(mesh)
+        bm.free()
+
+# Every frame change, the frame change dispatcher calls this function (the update of the 'nodes' layer,
+# see alchemist_layers)
+def my_handler(scene, frame):
+    if (nodemode == 'CLOUD'):
+        set_cloud_location(steplist,frame)
+    else:
+        set_objects_location(steplist,frame)
+
+# Read the rows appended to the followed node file and extend the import with the new steps only: the frame handler
+# index, the playback clock, the point cloud and the frame range grow, nothing is rebuilt
+# When the last frame is shown, playback jumps to the new last frame
+# With 'final' (the file is complete), a last row without its newline is read too
+# Returns the number of new steps, or None when no file is followed
+def refreshNodes(final=False):
+    global nodetransitions, theMessage
+    if (nodefollower == None or steplist == None):
+        return None
+    try:
+        with nodeprofile.phase('follow'):
+            added = nodefollower.poll(final=final)
+    except (alchemist_trace.TraceError, IOError, OSError) as e:
+        theMessage = getattr(e, 'value', str(e))
+        raise NodError(theMessage)
+    if (added == 0):
+        return 0
+    with nodeprofile.phase('follow'):
+        nodeprofile.count('steps', added)
+        if (nodeclock != None):
+            nodeclock.extend(steplist)
+        if (nodemode != 'CLOUD'): # The point cloud has the vertices of the frame shown, whatever the nodes
+            nodetransitions += alchemist_trace.transitions(steplist, len(steplist) - added)
+        scene = bpy.context.scene
+        shown = scene.frame_current
+        end = scene.frame_end
+        scene.frame_end = last_frame(steplist)
+        alchemist_layers.invalidate()
+        if (shown >= end):
+            scene.frame_set(scene.frame_end)
+    return added
+
+# Last frame of the animation of a trace
+def last_frame(trace):
+    if (nodeclock != None):
+        return nodeclock.lastFrame()
+    return max(len(trace), 1)
+
+# Module state of an import, replaced by the next one (see saveNodes)
+NODE_STATE = ('steplist', 'nodemode', 'nodeobjects', 'nodetransitions', 'shownids', 'shownframe', 'nodeclock',
+              'nodeprofile', 'nodecull', 'nodepool', 'nodefollower')
+
+# State of the previous import, saved before a new one builds: module state, 'nodes' layer, node objects and frame range
+def saveNodes():
+    state = dict((name, globals()[name]) for name in NODE_STATE)
+    scene = alchemist_jobs.SceneState(bpy.context.scene, ("node_", CLOUD_NAME))
+    return state, alchemist_layers.layers.get('nodes'), scene
+
+# Put back the previous import after a cancelled one (the data-blocks of the cancelled one are removed afterwards)
+def restoreNodes(saved):
+    state, layer, scene = saved
+    if (steplist != None and steplist is not state['steplist']):
+        steplist.close()
+    globals().update(state)
+    scene.restore()
+    alchemist_layers.restoreLayer(bpy.app.handlers.frame_change_pre, 'nodes', layer)
+
+# Write an F-curve with a keyframe for every couple (frames[i], values[i])
+def write_fcurve(action, data_path, index, frames, values, interpolation):
+    fc = action.fcurves.new(data_path, index=index)
+    count = len(frames)
+    co = np.empty((count, 2), dtype=np.float32)
+    co[:, 0] = frames
+    co[:, 1] = values
+    fc.keyframe_points.add(count)
+    fc.keyframe_points.foreach_set('co', co.ravel())
+    fc.keyframe_points.foreach_set('interpolation', [interpolation] * count)
+    fc.update()
+    return count
+
+# Bake the whole trace into keyframes: location and visibility of every node become F-curves,
+# so that playback does not need any frame handler
+# With a clock, the keyframes go on the frames of the step timestamps and locations are interpolated between them
+# Bakes BATCH nodes at a time, yielding the fraction baked; the statistics are put in 'stats'
+def bakeNodes(trace, stats):
+    busy = 0.0 # Time spent baking, without the pauses between the batches
+    start = time.time()
+    last = len(trace)
+    stepframes = None
+    if (nodeclock != None):
+        stepframes = nodeclock.stepFrames()
+    nodes = 0
+    location_keys = 0
+    visibility_keys = 0
+    for nid, frames, coords in alchemist_trace.tracks(trace):
+        name = "node_"+trace.names[nid]
+        ob = bpy.context.scene.objects.get(name)
+        if (ob == None):
+            ob = createMeshFromPrimitive(name, (float(coords[0][0]), float(coords[0][1]), NODE_Z), nodeprofile)
+        ob.animation_data_create()
+        action = bpy.data.actions.new(name+'Action')
+        ob.animation_data.action = action
+        keyframes, hidden = alchemist_trace.visibilityKeys(frames, last)
+        if (nodeclock != None):
+            frames, keyframes = stepframes[frames-1], stepframes[keyframes-1]
+        location_keys += write_fcurve(action, 'location', 0, frames, coords[:, 0], LINEAR)
+        location_keys += write_fcurve(action, 'location', 1, frames, coords[:, 1], LINEAR)
+        location_keys += write_fcurve(action, 'location', 2, frames, np.full(len(frames), NODE_Z), LINEAR)
+        visibility_keys += write_fcurve(action, 'hide', 0, keyframes, hidden, CONSTANT)
+        visibility_keys += write_fcurve(action, 'hide_render', 0, keyframes, hidden, CONSTANT)
+        nodes += 1
+        if (nodes % BATCH == 0):
+            busy += time.time() - start
+            yield float(nodes) / len(trace.names)
+            start = time.time()
+    stats['nodes'] = nodes
+    stats['location_keyframes'] = location_keys
+    stats['visibility_keyframes'] = visibility_keys
+    stats['seconds'] = busy + time.time() - start
+    print('Baked '+str(nodes)+' nodes: '+str(location_keys)+' location keyframes, '+str(visibility_keys)+' visibility keyframes in '+('%.2f' % stats['seconds'])+' s')
+
+# Clock of an interpolated playback at the scene frame rate, 'speed' units of simulation time every second
+def playbackClock(trace, speed):
+    render = bpy.context.scene.render
+    return alchemist_trace.Clock(trace, render.fps / render.fps_base / speed)
 
 # Draw all the nodes in a file
-def importNodes(node_file):
-    bpy.context.scene.frame_current=1
-    global steplist
-    steplist = readNodesFromFile(node_file)
-    for key, (x,y) in steplist[1].items() :
-        createMeshFromPrimitive("node_"+key, (float(x),float(y),0))
-    bpy.app.handlers.frame_change_pre.append(my_handler)
-    bpy.context.scene.frame_current=1
+# mode is 'HANDLER' (an object for every node, moved by a frame handler), 'BAKE' (an object for every node,
+# animated by keyframes) or 'CLOUD' (a single point cloud object, whose vertices are moved by a frame handler)
+# With 'cull' set to 'REGION' or 'CAMERA', the frame handler of 'HANDLER' mode only shows the nodes inside
+# 'region' (xmin, ymin, xmax, ymax) or seen by the active camera
+# 'stride' and 'interval' import fewer steps, for a quick preview
+# With 'timing' set to 'TIME', frames follow the simulation time ('speed' units every second of animation) and the
+# nodes move smoothly between the logged steps
+# The import profile is printed, and written to the JSON file 'report' if given
+# 'colors' is 'PALETTE' (the nodes share the materials of a palette of 'palette_size' colors, chosen by their names),
+# 'SHARED' (a single material, colored by the object color) or 'OBJECT' (a material for every node)
+# With 'follow', the file is still being written by a running simulation: it is read without cache and decimation,
+# and refreshNodes reads what was appended since (not with 'BAKE' mode, whose keyframes are written once)
+# Returns the bake statistics, if any
+def importNodes(node_file, mode='HANDLER', cache=True, cull='NONE', region=(0, 0, 100, 100), stride=1, interval=0.0,
+                timing='STEPS', speed=1.0, report=None, colors='PALETTE',
+                palette_size=alchemist_materials.PALETTE_SIZE, follow=False):
+    return importNodesJob(node_file, mode, cache, cull, region, stride, interval, timing, speed, report, colors,
+                          palette_size, follow).run()
 
+# The import of importNodes as an alchemist_jobs.Job: the file is parsed on a worker thread, then the scene is built
+# on the main thread, BATCH nodes at a time; the job result is the bake statistics, if any
+def importNodesJob(node_file, mode='HANDLER', cache=True, cull='NONE', region=(0, 0, 100, 100), stride=1, interval=0.0,
+                   timing='STEPS', speed=1.0, report=None, colors='PALETTE',
+                   palette_size=alchemist_materials.PALETTE_SIZE, follow=False):
+    profile = alchemist_profile.begin('nodes', node_file, bpy.data)
+    indexed = (cull != 'NONE')
+    following = follow and mode != 'BAKE'
+    def prepare():
+        with profile.phase('parse'):
+            if (following):
+                follower = followNodesFile(node_file)
+                return follower, alchemist_trace.StepStore(follower.trace, indexed=indexed)
+            return None, alchemist_trace.StepStore(readNodesFromFile(node_file, cache, stride, interval), indexed=indexed)
+    def build(job, prepared):
+        global steplist, nodemode, nodecull, nodeclock, nodeprofile, nodepool, nodefollower
+        follower, trace = prepared
+        bpy.context.scene.frame_current=1
+        nodeprofile = profile
+        nodemode = mode
+        nodecull = {'NONE': None, 'REGION': tuple(region), 'CAMERA': 'CAMERA'}[cull]
+        nodepool = None
+        if (colors != 'OBJECT'):
+            palette = alchemist_materials.hues(palette_size)
+            nodepool = alchemist_materials.MaterialPool(bpy.data.materials, 'NodeMat', palette, colors == 'SHARED')
+        if (steplist != None):
+            steplist.close()
+        steplist = trace
+        nodefollower = follower
+        profile.count('steps', len(steplist))
+        profile.count('nodes', len(steplist.names))
+        nodeclock = None
+        if (timing == 'TIME'):
+            nodeclock = playbackClock(steplist, speed)
+        # Parsing does not touch the scene: the frame range is set once, afterwards
+        bpy.context.scene.frame_start = 1
+        bpy.context.scene.frame_end = last_frame(steplist)
+        if (mode == 'BAKE'):
+            job.result = {}
+            for progress in profile.timed(bakeNodes(steplist, job.result), 'bake'):
+                yield progress
+            # Keyframes need no frame handler: the layer of an earlier import goes
+            alchemist_layers.removeLayer(bpy.app.handlers.frame_change_pre, 'nodes')
+        elif (mode == 'CLOUD'):
+            with profile.phase('objects'):
+                createNodeCloud(steplist)
+                if (len(steplist) > 0):
+                    set_cloud_location(steplist, 1)
+            alchemist_layers.setLayer(bpy.app.handlers.frame_change_pre, 'nodes', my_handler, profile)
+        else:
+            with profile.phase('objects'):
+                indexNodeObjects(steplist)
+            for progress in profile.timed(createFrameObjects(steplist, 1), 'objects'):
+                yield progress
+            with profile.phase('objects'):
+                set_objects_location(steplist, 1)
+            alchemist_layers.setLayer(bpy.app.handlers.frame_change_pre, 'nodes', my_handler, profile)
+        bpy.context.scene.frame_current=1
+        alchemist_profile.end(profile, bpy.data, report)
+    return alchemist_jobs.Job('nodes', prepare, build, bpy.data, saveNodes, restoreNodes)
 
 # USER INTERFACE
 
 from bpy_extras.io_utils import ImportHelper
 
-class ImportNod(bpy.types.Operator, ImportHelper):
+class ImportNod(alchemist_jobs.ModalImport, bpy.types.Operator, ImportHelper):
     """Import from Alchemist Node file (.nod)"""
     bl_idname = "import_scene.nodes"
     bl_description = 'Import from Alchemist Nodes file (.nod)'
@@ -129,14 +495,98 @@ class ImportNod(bpy.types.Operator, ImportHelper):
     filename_ext = ".nod"
     filter_glob = StringProperty(default="*.nod", options={'HIDDEN'})
     filepath = StringProperty(subtype='FILE_PATH')
+    mode = EnumProperty(
+        name="Animation",
+        items=(('HANDLER', "Frame handler", "Move the nodes from a Python frame change handler"),
+               ('BAKE', "Bake keyframes", "Write location and visibility keyframes, playback runs no Python"),
+               ('CLOUD', "Point cloud", "A single mesh with a vertex for every node and an instanced cone, for huge populations")),
+        default='HANDLER')
+    cache = BoolProperty(
+        name="Cache",
+        description="Keep a binary copy of the parsed trace next to the file and reload it while the file does not change",
+        default=True)
+    cull = EnumProperty(
+        name="Culling",
+        items=(('NONE', "None", "Show every node of the frame"),
+               ('REGION', "Region", "Only show the nodes inside the region"),
+               ('CAMERA', "Camera", "Only show the nodes seen by the active camera")),
+        default='NONE')
+    region = FloatVectorProperty(
+        name="Region",
+        description="Region of interest: minimum x, minimum y, maximum x, maximum y",
+        size=4, default=(0.0, 0.0, 100.0, 100.0))
+    stride = IntProperty(
+        name="Step stride",
+        description="Import one step every this many (1: every step)",
+        default=1, min=1)
+    interval = FloatProperty(
+        name="Time interval",
+        description="Least simulation time between two imported steps (0: no resampling)",
+        default=0.0, min=0.0)
+    timing = EnumProperty(
+        name="Timing",
+        items=(('STEPS', "Steps", "One frame for every logged step"),
+               ('TIME', "Simulation time", "Frames follow the simulation time, positions are interpolated between steps")),
+        default='STEPS')
+    speed = FloatProperty(
+        name="Speed",
+        description="Simulation time played in a second of animation, with simulation time timing",
+        default=1.0, min=0.0001)
+    report_file = StringProperty(
+        name="Report",
+        description="Write the import profile to this JSON file (empty: only print it)",
+        subtype='FILE_PATH', default="")
+    colors = EnumProperty(
+        name="Colors",
+        items=(('PALETTE', "Palette", "The nodes share the materials of a palette, a color for every node name"),
+               ('SHARED', "Shared material", "A single material, colored by the object color"),
+               ('OBJECT', "Material per node", "A new material with a random color for every node")),
+        default='PALETTE')
+    palette_size = IntProperty(
+        name="Palette size",
+        description="Number of colors of the palette",
+        default=alchemist_materials.PALETTE_SIZE, min=1, max=256)
+    background = BoolProperty(
+        name="Background",
+        description="Import without blocking the interface, with a progress bar (Esc cancels and removes what was imported)",
+        default=True)
+    follow = BoolProperty(
+        name="Follow",
+        description="The simulation is still writing the file: keep reading the new steps until Esc (not with bake keyframes)",
+        default=False)
     def draw(self, context):
         layout = self.layout
-    def execute(self, context):
+        layout.prop(self, "mode")
+        layout.prop(self, "cache")
+        layout.prop(self, "cull")
+        layout.prop(self, "region")
+        layout.prop(self, "stride")
+        layout.prop(self, "interval")
+        layout.prop(self, "timing")
+        layout.prop(self, "speed")
+        layout.prop(self, "colors")
+        layout.prop(self, "palette_size")
+        layout.prop(self, "report_file")
+        layout.prop(self, "background")
+        layout.prop(self, "follow")
+    # The import runs as an alchemist_jobs.Job (see alchemist_jobs.ModalImport)
+    def job(self, context):
+        return importNodesJob(self.filepath, self.mode, self.cache, self.cull, self.region, self.stride, self.interval,
+                              self.timing, self.speed, self.report_file, self.colors, self.palette_size, self.follow)
+    def refresh(self, context, final=False):
         try:
-            importNodes(self.filepath)
+            return refreshNodes(final)
         except NodError:
-            print("Error when loading Nod file:\n" + theMessage)
-        return {'FINISHED'}
+            print("Error when following Nod file:\n" + theMessage)
+            return None
+    def finished(self, job):
+        stats = job.result
+        if (stats != None):
+            self.report({'INFO'}, 'Baked '+str(stats['nodes'])+' nodes: '+str(stats['location_keyframes'])+' location and '+str(stats['visibility_keyframes'])+' visibility keyframes in '+('%.2f' % stats['seconds'])+' s')
+    def failed(self, job):
+        if (not isinstance(job.error, NodError)):
+            raise job.error
+        print("Error when loading Nod file:\n" + theMessage)
     def invoke(self, context, event):
         context.window_manager.fileselect_add(self)
         return {'RUNNING_MODAL'}
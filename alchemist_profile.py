@@ -0,0 +1,182 @@
+# Instrumentation shared by the Alchemist import add-ons.
+# It does not import bpy: the importers report into a Profile, which keeps
+#   - the time spent in every phase of the import (parse, objects, materials, skinning...),
+#   - counts of what was created (objects, meshes and materials, from snapshots of bpy.data),
+#   - the peak memory of the process,
+#   - a histogram of the frame handler latency, updated during playback.
+# The last profile of every importer is kept in 'profiles', and can be printed or written as JSON.
+
+import sys, json, time
+from collections import OrderedDict
+try:
+    import resource
+except ImportError: # Not on Windows
+    resource = None
+
+# Upper bounds (milliseconds) of the handler latency histogram buckets; the last bucket has no bound
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+PRINT_EVERY = 250 # Frames between two printed histograms during playback (0: never)
+
+profiles = OrderedDict() # Couples (importer, Profile) of the last import of every importer
+
+# Peak resident memory of the process, in MB (None if unknown)
+def peakMemory():
+    if resource == None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': # Bytes on macOS, kilobytes elsewhere
+        return peak / 1048576.0
+    return peak / 1024.0
+
+# Sizes of the collections of 'data' (bpy.data) counted by a profile
+def dataCounts(data):
+    return {'objects': len(data.objects), 'meshes': len(data.meshes), 'materials': len(data.materials)}
+
+# Timings and counts of an import, and latency of its frame handler
+class Profile:
+    def __init__(self, importer, filename, data=None):
+        self.importer = importer
+        self.filename = filename
+        self.phases = OrderedDict() # Couples (phase, seconds)
+        self.current = None # Innermost Phase being timed
+        self.counts = OrderedDict() # Couples (name, count)
+        self.started = time.time()
+        self.seconds = None # Total import time, once finished
+        self.peak = None
+        self.before = dataCounts(data) if data != None else None
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.frames = 0
+        self.frameseconds = 0.0
+        self.slowest = 0.0
+
+    # Add 'seconds' to a phase
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    # Context manager timing a phase:  with profile.phase('parse'): ...
+    def phase(self, name):
+        return Phase(self, name)
+
+    # Yield the items of 'iterable', adding the time spent waiting for each one to 'phase'
+    def timed(self, iterable, phase):
+        iterator = iter(iterable)
+        while True:
+            with self.phase(phase):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    # Add 'n' to a count
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    # End of the import: total time, peak memory and what was created in 'data' (bpy.data)
+    def finish(self, data=None):
+        self.seconds = time.time() - self.started
+        self.peak = peakMemory()
+        if data != None and self.before != None:
+            after = dataCounts(data)
+            for name in after:
+                self.counts[name + '_created'] = after[name] - self.before[name]
+
+    # Record the latency of a frame handler call
+    def frame(self, seconds):
+        ms = seconds * 1000.0
+        i = 0
+        while i < len(LATENCY_BUCKETS) and ms > LATENCY_BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.frames += 1
+        self.frameseconds += seconds
+        self.slowest = max(self.slowest, seconds)
+        if PRINT_EVERY and self.frames % PRINT_EVERY == 0:
+            print(self.histogram())
+
+    # Handler latency as a dictionary
+    def latency(self):
+        labels = ['<=' + str(b) + 'ms' for b in LATENCY_BUCKETS] + ['>' + str(LATENCY_BUCKETS[-1]) + 'ms']
+        return {
+            'frames': self.frames,
+            'mean_ms': self.frameseconds * 1000.0 / self.frames if self.frames else 0.0,
+            'max_ms': self.slowest * 1000.0,
+            'histogram': OrderedDict(zip(labels, self.buckets))}
+
+    # Structured report
+    def report(self):
+        return OrderedDict((
+            ('importer', self.importer),
+            ('file', self.filename),
+            ('seconds', self.seconds),
+            ('phases', self.phases),
+            ('counts', self.counts),
+            ('peak_memory_mb', self.peak),
+            ('handler', self.latency())))
+
+    # One line histogram of the handler latency
+    def histogram(self):
+        latency = self.latency()
+        bars = ' '.join(label + ':' + str(n) for label, n in latency['histogram'].items() if n)
+        return (self.importer + ' handler: ' + str(self.frames) + ' frames, mean ' + ('%.2f' % latency['mean_ms'])
+                + ' ms, max ' + ('%.2f' % latency['max_ms']) + ' ms [' + bars + ']')
+
+    # Report as readable text
+    def text(self):
+        lines = [self.importer + ' import of ' + str(self.filename) + ': ' + ('%.2f' % (self.seconds or 0.0)) + ' s']
+        for name, seconds in self.phases.items():
+            lines.append('  %-12s %8.3f s' % (name, seconds))
+        for name, n in self.counts.items():
+            lines.append('  %-20s %8d' % (name, n))
+        if self.peak != None:
+            lines.append('  peak memory %10.1f MB' % self.peak)
+        if self.frames:
+            lines.append('  ' + self.histogram())
+        return '\n'.join(lines)
+
+    # Write the report to a JSON file
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+# Timing of a phase (see Profile.phase)
+# A phase may be nested in another one (materials while building objects): its time only counts for the inner one
+class Phase:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+    def __enter__(self):
+        self.outer = self.profile.current
+        self.profile.current = self
+        self.start = time.time()
+        return self
+    def __exit__(self, kind, value, traceback):
+        seconds = time.time() - self.start
+        self.profile.current = self.outer
+        self.profile.add(self.name, seconds)
+        if self.outer != None:
+            self.outer.start += seconds
+        return False
+
+# Start the profile of a new import of 'importer', replacing the last one
+def begin(importer, filename, data=None):
+    profile = Profile(importer, filename, data)
+    profiles[importer] = profile
+    return profile
+
+# Finish the profile of an import: print it, and write it as JSON to 'report' if given
+def end(profile, data=None, report=None):
+    profile.finish(data)
+    print(profile.text())
+    if report:
+        profile.write(report)
+    return profile
+
+# Reports of the last import of every importer
+def reportAll():
+    return OrderedDict((importer, profile.report()) for importer, profile in profiles.items())
+
+# Write the reports of every importer to a JSON file
+def writeAll(filename):
+    with open(filename, 'w') as f:
+        json.dump(reportAll(), f, indent=2)
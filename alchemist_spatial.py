@@ -0,0 +1,80 @@
+# Spatial index for the Alchemist import add-ons: a uniform grid over the (x, y) coordinates of a step,
+# so that the frame handlers only touch the entities inside a region of interest.
+# It does not import bpy (cameraBox only expects Blender-like camera objects).
+
+import math
+import numpy as np
+
+CELL_POINTS = 16 # Average number of points in a cell of a GridIndex
+
+# Uniform grid over the (x, y) coordinates of a step
+# Points are sorted by cell, and every cell is a slice of that order (like a CSR matrix)
+class GridIndex:
+    def __init__(self, coords, cell=None):
+        xy = np.asarray(coords)[:, 0:2].astype(np.float64)
+        self.count = len(xy)
+        if self.count == 0:
+            self.low = np.zeros(2)
+            self.cell = 1.0
+            self.shape = (1, 1)
+            self.order = np.empty(0, dtype=np.int64)
+            self.starts = np.zeros(2, dtype=np.int64)
+            self.xy = xy
+            return
+        self.low = xy.min(axis=0)
+        span = xy.max(axis=0) - self.low
+        if cell is None:
+            # CELL_POINTS points a cell over the area, but no smaller than CELL_POINTS points a cell along the longer
+            # side, so that points on a line (a single row or column) do not get a grid of millions of empty cells
+            area = float(span[0]) * float(span[1])
+            cell = max(math.sqrt(area * CELL_POINTS / self.count), float(span.max()) * CELL_POINTS / self.count) or 1.0
+        self.cell = cell
+        cells = np.floor((xy - self.low) / cell).astype(np.int64)
+        self.shape = (int(cells[:, 0].max()) + 1, int(cells[:, 1].max()) + 1)
+        keys = cells[:, 1] * self.shape[0] + cells[:, 0]
+        self.order = np.argsort(keys, kind='mergesort')
+        self.starts = np.searchsorted(keys[self.order], np.arange(self.shape[0] * self.shape[1] + 1))
+        self.xy = xy
+
+    # Indexes of the points inside 'box' (xmin, ymin, xmax, ymax)
+    def query(self, box):
+        xmin, ymin, xmax, ymax = box
+        if self.count == 0 or xmax < xmin or ymax < ymin:
+            return np.empty(0, dtype=np.int64)
+        nx, ny = self.shape
+        x0 = max(int(math.floor((xmin - self.low[0]) / self.cell)), 0)
+        x1 = min(int(math.floor((xmax - self.low[0]) / self.cell)), nx - 1)
+        y0 = max(int(math.floor((ymin - self.low[1]) / self.cell)), 0)
+        y1 = min(int(math.floor((ymax - self.low[1]) / self.cell)), ny - 1)
+        if x0 > x1 or y0 > y1:
+            return np.empty(0, dtype=np.int64)
+        # Cells of a row are contiguous in the order: one slice per row
+        rows = [self.order[self.starts[y*nx+x0]:self.starts[y*nx+x1+1]] for y in range(y0, y1+1)]
+        candidates = np.concatenate(rows)
+        xy = self.xy[candidates]
+        inside = (xy[:, 0] >= xmin) & (xy[:, 0] <= xmax) & (xy[:, 1] >= ymin) & (xy[:, 1] <= ymax)
+        return np.sort(candidates[inside])
+
+# Box (xmin, ymin, xmax, ymax) of the ground plane z = 'ground' seen by a camera
+# The rays through the corners of the camera frame are intersected with the plane; a ray which does not
+# reach it (looking above the horizon) is cut at the camera clip end. 'margin' enlarges the box.
+def cameraBox(camera, scene, ground=0.0, margin=0.0):
+    matrix = camera.matrix_world
+    origin = matrix.to_translation()
+    far = camera.data.clip_end
+    points = []
+    for corner in camera.data.view_frame(scene):
+        world = matrix * corner
+        direction = world - origin
+        direction.normalize()
+        if direction.z < -1e-6:
+            distance = min((ground - origin.z) / direction.z, far)
+        else:
+            distance = far
+        if distance < 0: # Camera under the ground, looking down
+            distance = 0
+        points.append(origin + direction * distance)
+    points.append(origin)
+    xs = [p.x for p in points]
+    ys = [p.y for p in points]
+    return (min(xs) - margin, min(ys) - margin, max(xs) + margin, max(ys) + margin)
@@ -0,0 +1,318 @@
+# Surface reconstruction for the Alchemist gradient add-ons.
+# It does not import bpy: faces are computed from the NumPy coordinates of a step, so the work can run
+# in worker processes and the meshes are then built on the main thread with from_pydata.
+#
+# Gradient samples are (x, y, value) height fields, so the surface is a 2D triangulation over (x, y):
+# points on a lattice are gridded directly, scattered points get a Delaunay triangulation.
+
+import multiprocessing
+from functools import partial
+import numpy as np
+
+DECIMALS = 4 # Coordinates are rounded to this many decimals to find the lattice rows and columns
+MAX_FILL = 4 # A step is a lattice if its grid has at most MAX_FILL cells per point
+HILBERT_SIDE = 1 << 16 # Cells along a side of the Hilbert curve ordering the points of a Delaunay triangulation
+FLAT = 1e-6 # A triangle is flat if its area is below FLAT times the magnitude of the terms of its cross product
+MARGIN = 1e-6 # Circle tests closer than MARGIN times the squared radius are done in exact arithmetic
+
+# Faces of a step whose (x, y) points lie on a lattice (a grid, possibly with holes)
+# Every grid cell with 4 points becomes a quad and every cell with 3 points a triangle; every point must be in a cell.
+# Returns a tuple of int32 arrays of vertex indexes, one (faces, 4) for the quads and one (faces, 3) for the triangles,
+# or None if the points are not on a lattice.
+def latticeFaces(coords):
+    count = len(coords)
+    ux, xi = np.unique(np.round(coords[:, 0], DECIMALS), return_inverse=True)
+    uy, yi = np.unique(np.round(coords[:, 1], DECIMALS), return_inverse=True)
+    if len(ux) * len(uy) > MAX_FILL * count:
+        return None
+    grid = np.full((len(uy), len(ux)), -1, dtype=np.int32)
+    grid[yi, xi] = np.arange(count)
+    # Corners of every cell, counterclockwise
+    corners = np.stack((grid[:-1, :-1], grid[:-1, 1:], grid[1:, 1:], grid[1:, :-1]), axis=-1).reshape(-1, 4)
+    present = (corners >= 0).sum(axis=1)
+    quads = corners[present == 4]
+    three = corners[present == 3]
+    tris = three[three >= 0].reshape(-1, 3)
+    used = np.zeros(count, dtype=bool)
+    used[quads] = True
+    used[tris] = True
+    if not used.all(): # Some points are not in any cell: scattered points, not a lattice
+        return None
+    return (quads, tris)
+
+# Order of insertion of the points of a Delaunay triangulation (biased randomized insertion order): the points are
+# shuffled into rounds of doubling size, and every round is sorted along a Hilbert curve, so that consecutive points
+# are close (the walk of locate stays short) while the rounds keep the triangulation balanced
+def insertionOrder(points, seed=0):
+    count = len(points)
+    order = np.random.RandomState(seed).permutation(count)
+    cells = np.minimum((points[order] * HILBERT_SIDE).astype(np.int64), HILBERT_SIDE - 1)
+    keys = hilbert(cells[:, 0], cells[:, 1])
+    bounds = [count] # The last round holds half of the points, the one before a quarter...
+    while bounds[-1] > 1:
+        bounds.append(bounds[-1] // 2)
+    bounds.append(0)
+    bounds.reverse()
+    result = []
+    for begin, end in zip(bounds, bounds[1:]):
+        result.append(order[begin:end][np.argsort(keys[begin:end], kind='mergesort')])
+    return np.concatenate(result)
+
+# Distance along a Hilbert curve of the cells (x, y) of a HILBERT_SIDE x HILBERT_SIDE grid
+def hilbert(x, y):
+    x, y = x.copy(), y.copy()
+    d = np.zeros(len(x), dtype=np.int64)
+    s = HILBERT_SIDE // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant
+        flip = ~ry & rx
+        x[flip], y[flip] = s - 1 - x[flip], s - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap]
+        s //= 2
+    return d
+
+# Circumcircle of a counterclockwise triangle, for a quick test of the points near it (see inCircle): center x,
+# center y, squared radius and the margin under which the test is done again exactly. The center of a flat triangle
+# is too imprecise: its circle only has exact tests.
+def circle(xs, ys, a, b, c):
+    ax, ay = xs[a], ys[a]
+    bx, by, cx, cy = xs[b] - ax, ys[b] - ay, xs[c] - ax, ys[c] - ay
+    d = 2 * (bx * cy - by * cx)
+    if d <= FLAT * 2 * (abs(bx * cy) + abs(by * cx)):
+        return (0.0, 0.0, 0.0, float('inf'))
+    b2, c2 = bx * bx + by * by, cx * cx + cy * cy
+    ux, uy = (cy * b2 - by * c2) / d, (bx * c2 - cx * b2) / d
+    r = ux * ux + uy * uy
+    return (ax + ux, ay + uy, r, MARGIN * r)
+
+# Whether the point p is in the circumcircle of the counterclockwise triangle (a, b, c), in exact integer arithmetic
+def exactInCircle(xs, ys, a, b, c, p):
+    px, py = xs[p], ys[p]
+    adx, ady, bdx, bdy, cdx, cdy = xs[a] - px, ys[a] - py, xs[b] - px, ys[b] - py, xs[c] - px, ys[c] - py
+    return ((adx * adx + ady * ady) * (bdx * cdy - cdx * bdy) + (bdx * bdx + bdy * bdy) * (cdx * ady - adx * cdy)
+            + (cdx * cdx + cdy * cdy) * (adx * bdy - bdx * ady)) > 0
+
+# Twice the signed area of the triangle (a, b, p): positive if counterclockwise
+def orient(xs, ys, a, b, p):
+    return (xs[b] - xs[a]) * (ys[p] - ys[a]) - (ys[b] - ys[a]) * (xs[p] - xs[a])
+
+# Whether the point p is in the circumcircle of a ghost triangle, one with the vertex at infinity 'ghost': its circle
+# is the open half-plane beyond its hull edge, plus the inside of the edge itself
+def beyond(xs, ys, v, ghost, p):
+    k = v.index(ghost)
+    a, b = v[(k+1) % 3], v[(k+2) % 3]
+    side = orient(xs, ys, a, b, p)
+    if side != 0:
+        return side > 0
+    return (xs[a] - xs[p]) * (xs[b] - xs[p]) + (ys[a] - ys[p]) * (ys[b] - ys[p]) < 0
+
+# Whether the point p is in the circumcircle of triangle t: the quick test of its circle (with the float coordinates
+# 'fx' and 'fy'), unless it is too close to call
+def inCircle(xs, ys, fx, fy, verts, circles, ghost, t, p):
+    c = circles[t]
+    if c == None:
+        return beyond(xs, ys, verts[t], ghost, p)
+    m = c[2] - (c[0] - fx[p]) ** 2 - (c[1] - fy[p]) ** 2
+    if abs(m) > c[3]:
+        return m > 0
+    a, b, d = verts[t]
+    return exactInCircle(xs, ys, a, b, d, p)
+
+# Delaunay triangulation of the (x, y) points of a step (Bowyer-Watson)
+# The triangulation starts from a triangle of the first points, and every edge of its convex hull borders a ghost
+# triangle to a vertex at infinity, so that the points outside the hull are inserted like the others and no hull
+# triangle is lost (as it can be with a finite super triangle). Every insertion walks from the last triangle made to
+# the one containing the new point, collects the cavity of the triangles whose circumcircle contains it by crossing
+# their edges, and fills the cavity with triangles to the point.
+# The coordinates are rounded to DECIMALS, so the points are on an integer grid: orientations are exact, and so are
+# the circle tests too close to call in floating point, which keeps the cavities consistent on collinear and
+# cocircular points. The triangles know their neighbors, and the points are inserted in insertionOrder, so an
+# insertion only touches a few triangles: the cost grows about linearly with the points.
+# Triangles with an edge longer than 'max_edge' are dropped. Returns a tuple with an int32 array (faces, 3) of vertex
+# indexes.
+def delaunayFaces(coords, max_edge=None):
+    empty = (np.empty((0, 3), dtype=np.int32),)
+    # Duplicated points are triangulated once
+    points, first = np.unique(np.round(coords[:, 0:2].astype(np.float64), DECIMALS), axis=0, return_index=True)
+    count = len(points)
+    if count < 3:
+        return empty
+    low = points.min(axis=0)
+    grid = np.rint((points - low) * 10 ** DECIMALS).astype(np.int64)
+    xs, ys = grid[:, 0].tolist(), grid[:, 1].tolist()
+    fx, fy = grid[:, 0].astype(np.float64).tolist(), grid[:, 1].astype(np.float64).tolist()
+    ghost = count # The vertex at infinity
+    order = insertionOrder((points - low) / ((points.max(axis=0) - low).max() or 1.0)).tolist()
+    # First triangle: the first two points and the next one not on their line
+    a, b = order[0], order[1]
+    for i in range(2, count):
+        c = order[i]
+        side = orient(xs, ys, a, b, c)
+        if side != 0:
+            break
+    else: # All the points are on a line
+        return empty
+    if side < 0:
+        a, b = b, a
+    order = order[2:i] + order[i+1:]
+    # Triangles, counterclockwise: vertices, neighbor across the edge opposite every vertex, circle (None for the
+    # ghost triangles)
+    verts = [(a, b, c), (b, a, ghost), (c, b, ghost), (a, c, ghost)]
+    near = [[2, 3, 1], [3, 2, 0], [1, 3, 0], [2, 1, 0]]
+    circles = [circle(fx, fy, a, b, c), None, None, None]
+    alive = [True] * 4
+    last = 0
+    for p in order:
+        px, py = fx[p], fy[p]
+        t = locate(xs, ys, fx, fy, verts, near, circles, alive, ghost, last, p)
+        # Cavity: the triangles whose circumcircle contains the point, connected to the one containing it
+        cavity = set([t])
+        stack = [t]
+        while stack:
+            for n in near[stack.pop()]:
+                if n in cavity:
+                    continue
+                c = circles[n]
+                if c != None:
+                    m = c[2] - (c[0] - px) ** 2 - (c[1] - py) ** 2
+                    inside = (m > 0) if abs(m) > c[3] else exactInCircle(xs, ys, verts[n][0], verts[n][1], verts[n][2], p)
+                else:
+                    inside = beyond(xs, ys, verts[n], ghost, p)
+                if inside:
+                    cavity.add(n)
+                    stack.append(n)
+        # Fill it with a triangle from every boundary edge to the point
+        starts, ends = {}, {}
+        for u in cavity:
+            alive[u] = False
+            v = verts[u]
+            for k in range(3):
+                n = near[u][k]
+                if n in cavity:
+                    continue
+                a, b = v[(k+1) % 3], v[(k+2) % 3]
+                j = len(verts)
+                verts.append((a, b, p))
+                near.append([-1, -1, n])
+                circles.append(circle(fx, fy, a, b, p) if ghost != a and ghost != b else None)
+                alive.append(True)
+                near[n][near[n].index(u)] = j # The outer neighbor now borders the new triangle
+                starts[a] = j
+                ends[b] = j
+        for a, j in starts.items():
+            b = verts[j][1]
+            near[j][0] = starts[b] # Across (b, p)
+            near[j][1] = ends[a] # Across (p, a)
+        last = len(verts) - 1
+    tris = np.array([v for v, live in zip(verts, alive) if live], dtype=np.int64).reshape(-1, 3)
+    tris = tris[(tris < ghost).all(axis=1)] # Drop the ghost triangles
+    if max_edge:
+        longest = np.maximum(np.maximum(
+            ((points[tris[:, 0]] - points[tris[:, 1]]) ** 2).sum(axis=1),
+            ((points[tris[:, 1]] - points[tris[:, 2]]) ** 2).sum(axis=1)),
+            ((points[tris[:, 2]] - points[tris[:, 0]]) ** 2).sum(axis=1))
+        tris = tris[longest <= max_edge * max_edge]
+    return (first[tris].astype(np.int32),)
+
+# Triangle containing the point p, walking from triangle 'start' across the edges the point is beyond
+# The walk stops at a ghost triangle whose circle contains the point (the point is outside the hull, beyond its edge).
+# The edge tested first changes at every step, so that the walk cannot cycle; if it takes too long, any triangle
+# whose circumcircle contains the point is as good a start for the cavity
+def locate(xs, ys, fx, fy, verts, near, circles, alive, ghost, start, p):
+    px, py = xs[p], ys[p]
+    t = start
+    for step in range(len(verts)):
+        v = verts[t]
+        if circles[t] == None: # Ghost triangle: done if the point is beyond its edge, or back inside the hull
+            if beyond(xs, ys, v, ghost, p):
+                return t
+            t = near[t][v.index(ghost)]
+            continue
+        for m in range(3):
+            k = (step + m) % 3
+            a, b = v[(k+1) % 3], v[(k+2) % 3]
+            if (xs[b] - xs[a]) * (py - ys[a]) - (ys[b] - ys[a]) * (px - xs[a]) < 0:
+                t = near[t][k]
+                break
+        else:
+            return t
+    for t in range(len(verts)):
+        if alive[t] and inCircle(xs, ys, fx, fy, verts, circles, ghost, t, p):
+            return t
+    return start
+
+# Faces of a step: lattice cells if its points are on a lattice, otherwise Delaunay triangles
+def triangulate(coords, max_edge=None):
+    if len(coords) < 3:
+        return (np.empty((0, 3), dtype=np.int32),)
+    faces = latticeFaces(coords)
+    if faces == None:
+        faces = delaunayFaces(coords, max_edge)
+    return faces
+
+# Faces returned by triangulate, as a list for from_pydata
+def faceList(faces):
+    result = []
+    for f in faces:
+        result.extend(f.tolist())
+    return result
+
+# Tell if two steps have the same nodes (in any order)
+def sameNodes(ids, previous):
+    return len(ids) == len(previous) and np.array_equal(np.sort(ids), np.sort(previous))
+
+# Faces of a step with the same nodes as 'previous', reusing the faces computed for it
+def remapFaces(faces, previous, ids):
+    if np.array_equal(ids, previous):
+        return faces
+    order = np.argsort(ids)
+    position = order[np.searchsorted(ids, previous, sorter=order)] # Index in 'ids' of every vertex of 'previous'
+    return tuple(position[f].astype(np.int32) for f in faces)
+
+# Coordinates of a step in the vertex order of 'base', a step with the same nodes
+def reorder(ids, coords, base):
+    if np.array_equal(ids, base):
+        return coords
+    order = np.argsort(ids)
+    return coords[order[np.searchsorted(ids, base, sorter=order)]]
+
+# Runs of consecutive steps with the same nodes: the first frame (starting from 1) of every run
+def topologyRuns(ids):
+    starts = []
+    for i in range(len(ids)):
+        if i == 0 or not sameNodes(ids[i], ids[i-1]):
+            starts.append(i+1)
+    return starts
+
+# Steps to triangulate: with 'incremental', the steps with the same nodes as the previous one are skipped
+def newTopologies(ids, coords, incremental):
+    for i in range(len(coords)):
+        if not (incremental and i > 0 and sameNodes(ids[i], ids[i-1])):
+            yield coords[i]
+
+# Faces of every step, computed by a pool of 'processes' workers (all the cores if None)
+# 'ids' and 'coords' are the node ids and coordinates of every step; the faces are yielded in the same order,
+# as soon as they are ready. With 'incremental', a step with the same nodes as the previous one reuses its faces.
+def skinSteps(ids, coords, processes=None, incremental=True, max_edge=None, chunksize=1):
+    work = partial(triangulate, max_edge=max_edge)
+    pool = None
+    if processes == 1:
+        computed = (work(c) for c in newTopologies(ids, coords, incremental))
+    else:
+        pool = multiprocessing.Pool(processes)
+        computed = pool.imap(work, newTopologies(ids, coords, incremental), chunksize)
+    try:
+        faces = None
+        for i in range(len(coords)):
+            if incremental and i > 0 and sameNodes(ids[i], ids[i-1]):
+                faces = remapFaces(faces, ids[i-1], ids[i])
+            else:
+                faces = next(computed)
+            yield faces
+    finally:
+        if pool != None:
+            pool.terminate()
@@ -0,0 +1,571 @@
+# Alchemist trace reader, shared by the Alchemist import add-ons.
+# It does not import bpy, so it can be used (and tested) outside Blender.
+#
+# A .nod/.gra trace has one row per step:
+#   time;step;name,x,y,type;name,x,y,type;...   (nodes)
+#   time;step;name,x,y,value;name,x,y,value;... (gradients)
+# The file is streamed in chunks and every step is stored column-wise: an int32 array of node ids
+# (indexes in the interned table of node names) and a float32 array of coordinates.
+#
+# A parsed trace can be saved in a binary cache next to the trace file (see writeCache), so that the next
+# import memory-maps it instead of parsing the text again.
+
+import os, json, threading, queue
+from collections import OrderedDict
+import numpy as np
+import alchemist_spatial
+
+CHUNK_SIZE = 1 << 22 # Bytes read from the file at a time
+CACHE_EXT = ".alccache" # Extension of the binary cache of a trace
+CACHE_MAGIC = b"ALCCACHE"
+CACHE_VERSION = 2
+CACHE_ALIGN = 64 # Blocks in the cache start at multiples of CACHE_ALIGN bytes
+STORE_CAPACITY = 64 # Decoded steps kept by a StepStore
+STORE_AHEAD = 8 # Steps after the current one decoded in background by a StepStore
+
+# Parsed trace
+class Trace:
+    def __init__(self, width):
+        self.width = width # Coordinates per node: 2 for nodes (x, y), 3 for gradients (x, y, value)
+        self.names = [] # Interned node names, the position in the list is the node id
+        self.index = {} # Couples (node_name, node_id)
+        self.times = [] # Simulation time of every step
+        self.realsteps = [] # Step number written by Alchemist
+        self.ids = [] # int32 array of node ids for every step
+        self.coords = [] # float32 array (nodes, width) for every step
+
+    # Number of steps
+    def __len__(self):
+        return len(self.ids)
+
+    # Ids of a list of node names, interning the new ones
+    def intern(self, names):
+        index = self.index
+        table = self.names
+        ids = np.empty(len(names), dtype=np.int32)
+        for i, name in enumerate(names):
+            nid = index.get(name)
+            if nid is None:
+                nid = index[name] = len(table)
+                table.append(name)
+            ids[i] = nid
+        return ids
+
+    # Node ids and coordinates of a step (frames start from 1)
+    def step(self, frame):
+        if frame < 1 or frame > len(self.ids):
+            raise IndexError("Step " + str(frame) + " is not in the trace")
+        return self.ids[frame-1], self.coords[frame-1]
+
+    # Couples (node_name, coordinates) of a step
+    def items(self, frame):
+        ids, coords = self.step(frame)
+        names = self.names
+        return zip([names[i] for i in ids], [tuple(c) for c in coords.tolist()])
+
+# Bounded cache of decoded steps in front of a trace, for the frame handlers
+# At most 'capacity' steps are kept (least recently used first out); after every miss a background thread
+# decodes the next 'ahead' steps, so that playback finds them ready. Together with a memory-mapped trace
+# (see loadCache) memory stays bounded whatever the length of the trace.
+# With 'indexed', every decoded step also gets a spatial index (see alchemist_spatial.GridIndex).
+# Everything else (names, ids, len...) is read from the trace itself.
+class StepStore:
+    def __init__(self, trace, capacity=STORE_CAPACITY, ahead=STORE_AHEAD, indexed=False):
+        self.trace = trace
+        self.capacity = max(capacity, ahead + 1)
+        self.ahead = ahead
+        self.indexed = indexed
+        self.cache = OrderedDict() # Couples (frame, (ids, coords, grid))
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.requests = queue.Queue()
+        self.worker = None
+
+    def __len__(self):
+        return len(self.trace)
+
+    def __getattr__(self, name):
+        if name == 'trace':
+            raise AttributeError(name)
+        return getattr(self.trace, name)
+
+    # Node ids and coordinates of a step (frames start from 1), from the cache if possible
+    def step(self, frame):
+        ids, coords, grid = self.lookup(frame)
+        return ids, coords
+
+    # Spatial index of a step
+    def grid(self, frame):
+        ids, coords, grid = self.lookup(frame)
+        if grid is None:
+            grid = alchemist_spatial.GridIndex(coords)
+            self.keep(frame, (ids, coords, grid))
+        return grid
+
+    # Node ids, coordinates and spatial index (if any) of a step
+    def lookup(self, frame):
+        with self.lock:
+            decoded = self.cache.get(frame)
+            if decoded is not None:
+                self.cache.move_to_end(frame)
+                self.hits += 1
+        if decoded is None:
+            self.misses += 1
+            decoded = self.decode(frame)
+            self.keep(frame, decoded)
+        self.prefetch(frame)
+        return decoded
+
+    # Couples (node_name, coordinates) of a step
+    def items(self, frame):
+        ids, coords = self.step(frame)
+        names = self.trace.names
+        return zip([names[i] for i in ids], [tuple(c) for c in coords.tolist()])
+
+    # Read a step from the trace, detaching it from the memory map
+    def decode(self, frame):
+        ids, coords = self.trace.step(frame)
+        ids, coords = np.array(ids), np.array(coords)
+        grid = alchemist_spatial.GridIndex(coords) if self.indexed else None
+        return ids, coords, grid
+
+    def keep(self, frame, decoded):
+        with self.lock:
+            self.cache[frame] = decoded
+            self.cache.move_to_end(frame)
+            while len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+
+    # Ask the background thread for the steps after 'frame' which are not decoded yet
+    def prefetch(self, frame):
+        if self.ahead <= 0:
+            return
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.work)
+            self.worker.daemon = True
+            self.worker.start()
+        with self.lock:
+            missing = [f for f in range(frame+1, min(frame+self.ahead, len(self.trace))+1) if f not in self.cache]
+        for f in missing:
+            self.requests.put(f)
+
+    # Background thread: decode the requested steps
+    def work(self):
+        while True:
+            frame = self.requests.get()
+            if frame is None:
+                return
+            with self.lock:
+                present = frame in self.cache
+            if not present:
+                self.keep(frame, self.decode(frame))
+                self.prefetched += 1
+
+    # Cache statistics
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / total if total else 0.0,
+            'prefetched': self.prefetched,
+            'cached': len(self.cache),
+            'capacity': self.capacity}
+
+    # Stop the background thread
+    def close(self):
+        if self.worker is not None:
+            self.requests.put(None)
+            self.worker = None
+
+# Mapping between animation frames and simulation time, for interpolated playback
+# The first step of the trace is on frame 1 and 'rate' frames go by for every unit of simulation time,
+# so the frames of the logged steps follow their timestamps, not their order in the file.
+class Clock:
+    def __init__(self, trace, rate):
+        self.times = np.asarray(trace.times, dtype=np.float64)
+        self.rate = float(rate)
+
+    # Add the steps appended to a growing trace (see Follower)
+    def extend(self, trace):
+        added = np.asarray(trace.times[len(self.times):], dtype=np.float64)
+        self.times = np.concatenate((self.times, added))
+
+    # Frame (possibly fractional) of every step
+    def stepFrames(self):
+        if len(self.times) == 0:
+            return self.times
+        return 1.0 + (self.times - self.times[0]) * self.rate
+
+    # Last frame of the animation: the last one at or before the last step, so that locate finds a step on it
+    def lastFrame(self):
+        if len(self.times) == 0:
+            return 1
+        return max(int(np.floor(self.stepFrames()[-1] + 1e-9)), 1)
+
+    # Step shown on a frame and how far the frame is towards the next step: a couple (step, alpha), with the
+    # step starting from 1 and 0 <= alpha < 1, or (None, 0.0) if the frame is outside the trace
+    def locate(self, frame):
+        count = len(self.times)
+        if count == 0 or frame < 1:
+            return None, 0.0
+        time = self.times[0] + (frame - 1) / self.rate
+        i = int(np.searchsorted(self.times, time, side='right')) # Steps logged at or before 'time'
+        if i >= count:
+            if time > self.times[-1] + 1e-9:
+                return None, 0.0
+            return count, 0.0
+        span = self.times[i] - self.times[i-1]
+        alpha = (time - self.times[i-1]) / span if span > 0 else 0.0
+        return i, float(alpha)
+
+# Node ids and coordinates 'alpha' of the way from step 'step' to the next one (steps start from 1)
+# The nodes of 'step' are kept; those also in the next step are moved linearly towards it, all at once.
+def interpolate(trace, step, alpha):
+    ids, coords = trace.step(step)
+    if alpha <= 0 or step >= len(trace):
+        return ids, coords
+    nextids, nextcoords = trace.step(step+1)
+    if len(nextids) == 0:
+        return ids, coords
+    order = np.argsort(nextids)
+    there = order[np.minimum(np.searchsorted(nextids, ids, sorter=order), len(order)-1)] # Index in 'nextids' of every node, if there
+    here = np.flatnonzero(nextids[there] == ids)
+    there = there[here]
+    coords = np.array(coords, dtype=np.float32)
+    coords[here] += alpha * (nextcoords[there] - coords[here])
+    return ids, coords
+
+# Track of every node along the trace: triples (node_id, frames, coords), where 'frames' are the
+# sorted frames the node appears in and 'coords' its coordinates in those frames
+def tracks(trace):
+    if len(trace) == 0:
+        return
+    counts = [len(ids) for ids in trace.ids]
+    frames = np.repeat(np.arange(1, len(trace)+1, dtype=np.int32), counts)
+    ids = np.concatenate(trace.ids)
+    coords = np.concatenate(trace.coords)
+    order = np.argsort(ids, kind='mergesort') # Stable, so frames stay sorted for every node
+    ids, frames, coords = ids[order], frames[order], coords[order]
+    bounds = np.flatnonzero(np.diff(ids)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(ids)]))
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        yield int(ids[start]), frames[start:end], coords[start:end]
+
+# Nodes entering and exiting every step, relative to the previous one: a couple (enter, exit) of id arrays for every step
+# With 'first', only the steps from index 'first' on (to extend the transitions of a growing trace)
+def transitions(trace, first=0):
+    result = []
+    previous = trace.ids[first-1] if first > 0 else np.empty(0, dtype=np.int32)
+    for i in range(first, len(trace)):
+        ids = trace.ids[i]
+        result.append((np.setdiff1d(ids, previous), np.setdiff1d(previous, ids)))
+        previous = ids
+    return result
+
+# Visibility changes of a node which appears in the sorted 'frames' of a trace with 'last' frames
+# Returns the frames where visibility changes and the 'hidden' flag from each of those frames on
+def visibilityKeys(frames, last):
+    if len(frames) == 0:
+        return np.array([1], dtype=np.int32), np.array([True])
+    gap = np.diff(frames) > 1
+    shown = frames[np.concatenate(([True], gap))] # First frame of every appearance
+    hidden = frames[np.concatenate((gap, [frames[-1] < last]))] + 1 # Frame after every appearance
+    keyframes = np.concatenate((shown, hidden))
+    flags = np.concatenate((np.zeros(len(shown), dtype=bool), np.ones(len(hidden), dtype=bool)))
+    if frames[0] > 1: # Hidden until it first appears
+        keyframes = np.concatenate(([1], keyframes))
+        flags = np.concatenate(([True], flags))
+    order = np.argsort(keyframes, kind='mergesort')
+    return keyframes[order].astype(np.int32), flags[order]
+
+# Complete rows of a file, read CHUNK_SIZE bytes at a time
+def iterRows(csvfile, chunk_size=CHUNK_SIZE):
+    tail = b''
+    while True:
+        chunk = csvfile.read(chunk_size)
+        if not chunk:
+            break
+        rows = (tail + chunk).split(b'\n')
+        tail = rows.pop() # The last row may continue in the next chunk
+        for row in rows:
+            yield row
+    if tail:
+        yield tail
+
+# Parse a single row and append it to the trace as a new step
+# If 'nodetype' is given, every node has a type field and only the nodes of that type are kept.
+# The type is everything after the coordinates, commas included.
+# The last coordinate is multiplied by 'scale'.
+def parseRow(trace, row, nodetype=None, scale=1.0):
+    row = row.decode('utf-8').strip()
+    if not row:
+        return False
+    time, sep, rest = row.partition(';') # Read the time
+    realstep, sep, nodelist = rest.partition(';') # Read the step number
+    width = trace.width
+    fields = width + (2 if nodetype is not None else 1)
+    nodelist = nodelist.strip(';')
+    values = nodelist.replace(';', ',').split(',') if nodelist else []
+    if nodetype is not None and len(values) != (nodelist.count(';') + 1) * fields:
+        # Some type has commas: split the nodes one by one
+        values = []
+        for node in nodelist.split(';'):
+            node = node.split(',', fields - 1)
+            if len(node) != fields:
+                raise TraceError("Malformed row for step " + realstep + ": node with " + str(len(node)) + " fields instead of " + str(fields))
+            values.extend(node)
+    if len(values) % fields != 0:
+        raise TraceError("Malformed row for step " + realstep + ": " + str(len(values)) + " fields are not a multiple of " + str(fields))
+    names = values[0::fields]
+    try:
+        coords = np.empty((len(names), width), dtype=np.float32)
+        for c in range(width):
+            coords[:, c] = np.array(values[c+1::fields], dtype=np.float32)
+        if nodetype is not None:
+            keep = np.array(values[width+1::fields]) == nodetype
+            if not keep.all():
+                coords = coords[keep]
+                names = [name for name, k in zip(names, keep) if k]
+        time, realstep = float(time), int(realstep)
+    except ValueError as e:
+        raise TraceError("Malformed row for step " + realstep + ": " + str(e))
+    if scale != 1.0:
+        coords[:, width-1] *= scale
+    trace.times.append(time) # The step is added once the whole row parsed
+    trace.realsteps.append(realstep)
+    trace.ids.append(trace.intern(names))
+    trace.coords.append(coords)
+    return True
+
+# Steps of a cached trace: step i is the slice offsets[i]:offsets[i+1] of a memory-mapped array,
+# which is only read from disk when the step is used
+class Blocks:
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        return self.data[self.offsets[i]:self.offsets[i+1]]
+
+# Path of the binary cache of a trace file
+def cachePath(filename):
+    return filename + CACHE_EXT
+
+# Key of a trace file in its cache: the cache is valid only for the same file, size, modification time
+# and parsing options
+def cacheKey(filename, width, nodetype, scale):
+    stat = os.stat(filename)
+    return {
+        'source': os.path.abspath(filename),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'width': width,
+        'nodetype': nodetype,
+        'scale': scale}
+
+# Write the binary cache of a trace
+# Layout: CACHE_MAGIC, the header length (uint64), a JSON header (key, names and position of every block),
+# then the blocks: times (float64), realsteps (int64), step offsets (int64), ids (int32), coords (float32)
+# Block positions are relative to the start of the data, the first multiple of CACHE_ALIGN after the header, so
+# that the header does not depend on its own length
+def writeCache(trace, filename, key):
+    counts = [len(ids) for ids in trace.ids]
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    arrays = [
+        ('times', np.asarray(trace.times, dtype=np.float64)),
+        ('realsteps', np.asarray(trace.realsteps, dtype=np.int64)),
+        ('offsets', offsets),
+        ('ids', np.concatenate(list(trace.ids) + [np.empty(0, dtype=np.int32)]).astype(np.int32)),
+        ('coords', np.concatenate(list(trace.coords) + [np.empty((0, trace.width), dtype=np.float32)]).astype(np.float32))]
+    header = dict(key)
+    header['version'] = CACHE_VERSION
+    header['names'] = trace.names
+    header['blocks'] = {}
+    position = 0
+    for name, array in arrays:
+        header['blocks'][name] = [position, array.dtype.str, list(array.shape)]
+        position += (array.nbytes + CACHE_ALIGN - 1) // CACHE_ALIGN * CACHE_ALIGN
+    encoded = json.dumps(header).encode('utf-8')
+    start = dataStart(len(encoded))
+    assert start >= len(CACHE_MAGIC) + 8 + len(encoded)
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as out:
+        out.write(CACHE_MAGIC)
+        out.write(np.array([len(encoded)], dtype='<u8').tobytes())
+        out.write(encoded)
+        for name, array in arrays:
+            out.seek(start + header['blocks'][name][0])
+            out.write(array.tobytes())
+    os.replace(temp, filename) # Atomic: a reader sees the old cache or the new one
+
+# Position of the first block of a cache whose JSON header is 'length' bytes long
+def dataStart(length):
+    start = len(CACHE_MAGIC) + 8 + length
+    return (start + CACHE_ALIGN - 1) // CACHE_ALIGN * CACHE_ALIGN
+
+# Load the binary cache of a trace, if it matches 'key'; the steps are memory-mapped, not read
+# Returns None if there is no valid cache (missing, stale, of another version, truncated or corrupted)
+def loadCache(filename, key):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as cache:
+        if cache.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            return None
+        try:
+            length = int(np.frombuffer(cache.read(8), dtype='<u8')[0])
+            header = json.loads(cache.read(length).decode('utf-8'))
+        except (ValueError, IndexError): # Truncated header
+            return None
+    if header.get('version') != CACHE_VERSION:
+        return None
+    for field, value in key.items():
+        if header.get(field) != value:
+            return None
+    blocks = {}
+    for name, (offset, dtype, shape) in header['blocks'].items():
+        if 0 in shape:
+            blocks[name] = np.empty(shape, dtype=dtype)
+        else:
+            offset += dataStart(length)
+            try:
+                blocks[name] = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
+            except ValueError: # Truncated blocks
+                return None
+    trace = Trace(header['width'])
+    trace.names = header['names']
+    trace.index = dict((name, i) for i, name in enumerate(trace.names))
+    trace.times = blocks['times'].tolist()
+    trace.realsteps = blocks['realsteps'].tolist()
+    offsets = np.array(blocks['offsets'])
+    trace.ids = Blocks(blocks['ids'], offsets)
+    trace.coords = Blocks(blocks['coords'], offsets)
+    return trace
+
+# Read a whole trace file
+# With 'cache', a valid binary cache of the file is loaded instead, and a new one is written after parsing
+def readTrace(filename, width, nodetype=None, scale=1.0, chunk_size=CHUNK_SIZE, cache=False):
+    if cache:
+        key = cacheKey(filename, width, nodetype, scale)
+        trace = loadCache(cachePath(filename), key)
+        if trace is not None:
+            return trace
+    trace = Trace(width)
+    with open(filename, 'rb') as csvfile:
+        for row in iterRows(csvfile, chunk_size):
+            parseRow(trace, row, nodetype, scale)
+    if cache:
+        try:
+            writeCache(trace, cachePath(filename), key)
+        except (IOError, OSError): # No cache if the directory is not writable
+            return trace
+        # Drop the parsed steps: from now on they are read from the memory-mapped cache
+        trace = loadCache(cachePath(filename), key) or trace
+    return trace
+
+# Reader of a trace file still being written by a running simulation, for a live view
+# Every poll reads only the bytes appended since the last one and parses the complete rows among them: a partial
+# last row (its newline not written yet) is read again by a later poll, once complete, or by a final one. The trace
+# grows in place, so a StepStore in front of it sees the new steps. There is no cache and no decimation.
+class Follower:
+    def __init__(self, filename, width, nodetype=None, scale=1.0):
+        self.filename = filename
+        self.nodetype = nodetype
+        self.scale = scale
+        self.trace = Trace(width)
+        self.offset = 0 # Bytes of the rows parsed so far
+
+    # Parse the rows appended since the last poll; returns the number of new steps
+    # Only the bytes present when the poll starts are read, so that a poll ends even if the file keeps growing.
+    # The offset only moves past the rows parsed: after a TraceError, the trace has the rows before the malformed
+    # one, and the next poll starts from it. With 'final' (the file is complete), a last row without its newline
+    # is parsed too.
+    def poll(self, chunk_size=CHUNK_SIZE, final=False):
+        size = os.path.getsize(self.filename)
+        if size < self.offset:
+            raise TraceError("The file " + self.filename + " was truncated since the last read: import it again")
+        added = 0
+        with open(self.filename, 'rb') as csvfile:
+            csvfile.seek(self.offset)
+            position = self.offset
+            tail = b''
+            while position < size:
+                chunk = csvfile.read(min(chunk_size, size - position))
+                if not chunk:
+                    break
+                position += len(chunk)
+                rows = (tail + chunk).split(b'\n')
+                tail = rows.pop() # Not complete yet
+                for row in rows:
+                    if parseRow(self.trace, row, self.nodetype, self.scale):
+                        added += 1
+                    self.offset += len(row) + 1
+            if final and tail:
+                if parseRow(self.trace, tail, self.nodetype, self.scale):
+                    added += 1
+                self.offset += len(tail)
+        return added
+
+# Read a node file (.nod): only the nodes of type 'nodetype' are kept, coordinates are (x, y)
+def readNodes(filename, nodetype="person", chunk_size=CHUNK_SIZE, cache=False):
+    return readTrace(filename, 2, nodetype, 1.0, chunk_size, cache)
+
+# Read a gradient file (.gra): coordinates are (x, y, value * scale)
+def readGrads(filename, scale=1.0, chunk_size=CHUNK_SIZE, cache=False):
+    return readTrace(filename, 3, None, scale, chunk_size, cache)
+
+# Points of a step kept by a spatial decimation: the first one in every square cell of side 'spacing'
+def thinStep(coords, spacing):
+    if len(coords) == 0:
+        return np.arange(0)
+    cells = np.floor(np.asarray(coords)[:, 0:2] / spacing).astype(np.int64)
+    unique, first = np.unique(cells, axis=0, return_index=True)
+    return np.sort(first)
+
+# Level of detail of a trace, for quick previews: a new Trace with a subset of the steps (and points)
+# 'stride' keeps one step every 'stride'; with 'interval' > 0 a step is kept only if at least 'interval' of simulation
+# time passed since the last kept one; with 'spacing' > 0 every step keeps one point per square cell of side 'spacing'.
+# The node names and ids are shared with 'trace', which is not changed (a cached trace keeps serving every level).
+def decimate(trace, stride=1, interval=0.0, spacing=0.0):
+    if stride <= 1 and interval <= 0 and spacing <= 0:
+        return trace
+    times = np.asarray(trace.times, dtype=np.float64)
+    keep = []
+    last = None
+    for i in range(0, len(trace), max(stride, 1)):
+        if interval > 0 and last is not None and times[i] - last < interval:
+            continue
+        keep.append(i)
+        last = times[i]
+    lod = Trace(trace.width)
+    lod.names = trace.names
+    lod.index = trace.index
+    realsteps = np.asarray(trace.realsteps)
+    lod.times = times[keep].tolist()
+    lod.realsteps = realsteps[keep].tolist()
+    for i in keep:
+        ids, coords = trace.ids[i], trace.coords[i]
+        if spacing > 0:
+            kept = thinStep(coords, spacing)
+            ids, coords = ids[kept], coords[kept]
+        lod.ids.append(ids)
+        lod.coords.append(coords)
+    return lod
+
+# ERROR HANDLER
+
+class TraceError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
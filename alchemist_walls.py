@@ -4,18 +4,29 @@ bl_info = {
     "description": "Add walls from Alchemist simulation.",
     "author": "Luca Nenni",
     "version": (1, 0, 1),
-    "blender": (2, 62, 0),
+    "blender": (2, 63, 0),
     "location": "File > Import",
     "warning": "", # used for warning icon and text in addons panel
     "category": "Import-Export"}
 
 
 import bpy, random
+import numpy as np
+import alchemist_profile, alchemist_jobs
 from os.path import expanduser
-from bpy.props import StringProperty
+from bpy.props import StringProperty, BoolProperty, FloatProperty
 
 user_home = expanduser("~")
 theMessage = ""
+WALL_HEIGHT = 3
+SNAP_TOLERANCE = 0.01 # Wall endpoints are snapped to a grid of this size before merging
+ANGLE_TOLERANCE = 1e-3 # Walls whose directions differ less than this (radians) may be merged
+BATCH = 50 # Wall objects built between two progress reports of a background import
+
+# Vertices of a wall relative to its first point, as multipliers of (dx, dy, height)
+WALL_VERTS = np.array([(0,0,0),(1,0,0),(1,1,0),(0,1,0),(0,0,1),(1,0,1),(1,1,1),(0,1,1)], dtype=np.float64)
+# Faces of a wall (vertices must be in correct order!)
+WALL_FACES = np.array([(0,1,2,3),(4,7,6,5),(1,5,6,2),(2,6,7,3),(4,0,3,7),(0,1,5,4)], dtype=np.int32)
 
 # List of walls
 walls = []
@@ -44,36 +55,181 @@ def drawWall(pt1, pt2, name, material) :
 # Format: x1,y1,x2,y2;x1_1,y1_1,x2_1,y2_1;...
 def readWalls(filename):
     global walls
+    walls = [] # The walls of an earlier import are not kept
     with open(filename, 'r') as file:
         for row in file.readlines():
             for coords in row.split(';'):
+                coords = coords.strip()
                 if (coords != ""):
                     (val1, val2, val3, val4) = coords.split(',')
                     walls.append((((float)(val1), (float)(val2)), ((float)(val3), (float)(val4))))
     return walls
 
+# Geometry of many walls at once: 'segments' is an array (walls, 4) of x1,y1,x2,y2
+# Returns the vertices (walls*8, 3) and the quad faces (walls*6, 4), the same as drawWall but in absolute coordinates
+def wallGeometry(segments):
+    count = len(segments)
+    size = np.empty((count, 3))
+    size[:, 0] = segments[:, 2] - segments[:, 0]
+    size[:, 1] = segments[:, 3] - segments[:, 1]
+    size[:, 2] = WALL_HEIGHT
+    origin = np.zeros((count, 3))
+    origin[:, 0:2] = segments[:, 0:2]
+    verts = origin[:, None, :] + WALL_VERTS[None, :, :] * size[:, None, :]
+    faces = WALL_FACES[None, :, :] + 8 * np.arange(count, dtype=np.int32)[:, None, None]
+    return verts.reshape(-1, 3), faces.reshape(-1, 4)
+
+# Clean up the walls before drawing them: 'segments' is an array (walls, 4) of x1,y1,x2,y2
+# Endpoints are snapped to a grid of size 'tolerance', then walls are grouped by the line they lie on (a hash of
+# their direction and distance from the origin): on every line, overlapping, duplicated and adjacent walls are
+# merged into a single one. Zero-length walls are dropped.
+# A wall is drawn as the box spanned by its endpoints (see wallGeometry), so only the walls along the x or y axis
+# are merged: the box of two merged diagonal walls would be larger than theirs. Diagonal duplicates are removed.
+# Returns the merged segments and a report of what was removed.
+def mergeWalls(segments, tolerance=SNAP_TOLERANCE):
+    report = {'walls': len(segments), 'length': 0.0}
+    segments = np.round(np.asarray(segments, dtype=np.float64).reshape(-1, 4) / tolerance) * tolerance
+    p1, p2 = segments[:, 0:2], segments[:, 2:4]
+    length = np.hypot(p2[:, 0] - p1[:, 0], p2[:, 1] - p1[:, 1])
+    report['length'] = float(length.sum())
+    keep = length > 0
+    report['degenerate'] = int((~keep).sum())
+    p1, p2, length = p1[keep], p2[keep], length[keep]
+    axial = (p1[:, 0] == p2[:, 0]) | (p1[:, 1] == p2[:, 1])
+    # Diagonal walls: only the duplicates go, whatever the order of their endpoints
+    swap = (p1[~axial, 0] > p2[~axial, 0])[:, None]
+    diagonal = np.hstack((np.where(swap, p2[~axial], p1[~axial]), np.where(swap, p1[~axial], p2[~axial])))
+    diagonal = np.unique(diagonal, axis=0) if len(diagonal) else diagonal.reshape(0, 4)
+    p1, p2, length = p1[axial], p2[axial], length[axial]
+    # Canonical direction, in [0, pi)
+    direction = (p2 - p1) / length[:, None]
+    flip = (direction[:, 1] < 0) | ((direction[:, 1] == 0) & (direction[:, 0] < 0))
+    direction[flip] = -direction[flip]
+    angle = np.arctan2(direction[:, 1], direction[:, 0])
+    offset = p1[:, 0] * -direction[:, 1] + p1[:, 1] * direction[:, 0] # Signed distance of the line from the origin
+    keys = np.column_stack((np.round(angle / ANGLE_TOLERANCE), np.round(offset / tolerance))).astype(np.int64)
+    unique, line = np.unique(keys, axis=0, return_inverse=True)
+    line = line.ravel()
+    # Every line is described by its first wall: position of the endpoints along it
+    first = np.zeros(len(unique), dtype=np.int64)
+    first[line[::-1]] = np.arange(len(line))[::-1]
+    d = direction[first][line]
+    t1 = (p1 * d).sum(axis=1)
+    t2 = (p2 * d).sum(axis=1)
+    start, end = np.minimum(t1, t2), np.maximum(t1, t2)
+    # Sort by line and start, then a wall begins a new chain if it starts after the end of all the previous ones
+    order = np.lexsort((start, line))
+    line, start, end = line[order], start[order], end[order]
+    shift = (end.max() - start.min() + 2 * tolerance + 1) * line if len(line) else line
+    reach = np.maximum.accumulate(end + shift) - shift
+    newchain = np.ones(len(line), dtype=bool)
+    newchain[1:] = (line[1:] != line[:-1]) | (start[1:] > reach[:-1] + tolerance / 2)
+    chains = np.flatnonzero(newchain)
+    chainline = line[chains]
+    chainstart = start[chains]
+    chainend = np.maximum.reduceat(end, chains) if len(chains) else end
+    # Back to endpoints: the point of the line of the first wall at distance 'start'/'end' along it
+    d = direction[first][chainline]
+    base = p1[first][chainline]
+    along = (base * d).sum(axis=1)
+    merged = np.empty((len(chains), 4))
+    merged[:, 0:2] = base + d * (chainstart - along)[:, None]
+    merged[:, 2:4] = base + d * (chainend - along)[:, None]
+    merged = np.vstack((np.round(merged / tolerance) * tolerance, diagonal))
+    report['merged'] = len(merged)
+    report['removed'] = report['walls'] - len(merged)
+    report['merged_length'] = float(np.hypot(merged[:, 2] - merged[:, 0], merged[:, 3] - merged[:, 1]).sum())
+    return merged, report
+
+# Draw many walls as a single mesh, filled with foreach_set
+def drawWallMesh(segments, name, material):
+    verts, faces = wallGeometry(segments)
+    return drawGeometry(verts, faces, name, material)
+
+# Draw a mesh of quads from the arrays of wallGeometry
+def drawGeometry(verts, faces, name, material):
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set('co', verts.astype(np.float32).ravel())
+    mesh.loops.add(faces.size)
+    mesh.loops.foreach_set('vertex_index', faces.ravel())
+    mesh.polygons.add(len(faces))
+    mesh.polygons.foreach_set('loop_start', np.arange(0, faces.size, 4, dtype=np.int32))
+    mesh.polygons.foreach_set('loop_total', np.full(len(faces), 4, dtype=np.int32))
+    mesh.update(calc_edges=True)
+    obj = bpy.data.objects.new(name,mesh)
+    obj.active_material = material
+    bpy.data.scenes[0].objects.link(obj)
+    return obj
+
+# Split the walls in square chunks of side 'size', by their middle point
+# Returns a list of arrays of segments
+def chunkWalls(segments, size):
+    if size <= 0 or len(segments) == 0:
+        return [segments]
+    middle = (segments[:, 0:2] + segments[:, 2:4]) / 2
+    cells = np.floor(middle / size).astype(np.int64)
+    unique, chunk = np.unique(cells, axis=0, return_inverse=True)
+    chunk = chunk.ravel()
+    return [segments[chunk == i] for i in range(len(unique))]
+
 # Draw all the walls contained in a file
-def drawWalls(filename):
-    global walls
-    walls = readWalls(filename)
-    # Material definition
-    mat = bpy.data.materials.new('WallMaterial')
-    mat.diffuse_color = (1,0.965,0.560)
-    mat.alpha = 0.1
-    mat.transparency_method = 'Z_TRANSPARENCY'
-    # Draw the walls
-    i = 0
-    for wall in walls:
-        wallname = 'wall'+str(i)
-        wl = drawWall(wall[0],wall[1],wallname,mat)
-        i = i+1
+# With 'batched', the walls are drawn as a single mesh, or as one mesh for every square chunk of side 'chunk_size'
+# if it is not 0; otherwise every wall is an object
+# With 'merge', duplicated, overlapping and collinear adjacent walls are merged first (see mergeWalls)
+# The import profile is printed, and written to the JSON file 'report' if given
+def drawWalls(filename, batched=True, chunk_size=0, merge=True, tolerance=SNAP_TOLERANCE, report=None):
+    drawWallsJob(filename, batched, chunk_size, merge, tolerance, report).run()
 
+# The import of drawWalls as an alchemist_jobs.Job: parsing, merging and the mesh geometry run on a worker thread,
+# then the main thread builds the meshes (or BATCH wall objects at a time)
+def drawWallsJob(filename, batched=True, chunk_size=0, merge=True, tolerance=SNAP_TOLERANCE, report=None):
+    profile = alchemist_profile.begin('walls', filename, bpy.data)
+    def prepare():
+        with profile.phase('parse'):
+            read = readWalls(filename)
+            segments = np.array(read, dtype=np.float64).reshape(-1, 4)
+        profile.count('walls', len(read))
+        if merge:
+            with profile.phase('merge'):
+                segments, merged = mergeWalls(segments, tolerance)
+                read = [((s[0], s[1]), (s[2], s[3])) for s in segments.tolist()]
+            profile.count('merged_walls', merged['merged'])
+            print('Walls: '+str(merged['walls'])+' read, '+str(merged['merged'])+' after merging ('+str(merged['removed'])+' removed, '+str(merged['degenerate'])+' of zero length), total length '+('%.2f' % merged['length'])+' -> '+('%.2f' % merged['merged_length']))
+        geometry = []
+        if batched:
+            with profile.phase('geometry'):
+                geometry = [wallGeometry(chunk) for chunk in chunkWalls(segments, chunk_size)]
+        return read, geometry
+    def build(job, prepared):
+        global walls
+        walls, geometry = prepared
+        # Material definition
+        with profile.phase('materials'):
+            mat = bpy.data.materials.new('WallMaterial')
+            mat.diffuse_color = (1,0.965,0.560)
+            mat.alpha = 0.1
+            mat.transparency_method = 'Z_TRANSPARENCY'
+        # Draw the walls
+        if batched:
+            for i, (verts, faces) in enumerate(geometry):
+                with profile.phase('objects'):
+                    drawGeometry(verts, faces, 'walls'+str(i), mat)
+                yield float(i+1) / len(geometry)
+        else:
+            for start in range(0, len(walls), BATCH):
+                with profile.phase('objects'):
+                    for i, wall in enumerate(walls[start:start+BATCH], start):
+                        drawWall(wall[0],wall[1],'wall'+str(i),mat)
+                yield min(float(start+BATCH) / len(walls), 1.0)
+        alchemist_profile.end(profile, bpy.data, report)
+    return alchemist_jobs.Job('walls', prepare, build, bpy.data)
 
 # USER INTERFACE
 
 from bpy_extras.io_utils import ImportHelper
 
-class ImportWal(bpy.types.Operator, ImportHelper):
+class ImportWal(alchemist_jobs.ModalImport, bpy.types.Operator, ImportHelper):
     """Import from Alchemist Wall file (.wal)"""
     bl_idname = "import_scene.walls"
     bl_description = 'Import from Alchemist Wall file (.wal)'
@@ -84,14 +240,47 @@ class ImportWal(bpy.types.Operator, ImportHelper):
     filename_ext = ".wal"
     filter_glob = StringProperty(default="*.wal", options={'HIDDEN'})
     filepath = StringProperty(subtype='FILE_PATH')
+    batched = BoolProperty(
+        name="Single mesh",
+        description="Draw all the walls as one mesh (or one mesh for every chunk) instead of an object for every wall",
+        default=True)
+    chunk_size = FloatProperty(
+        name="Chunk size",
+        description="Side of the square chunks the walls are split in (0: a single mesh)",
+        default=0.0, min=0.0)
+    merge = BoolProperty(
+        name="Merge walls",
+        description="Remove duplicated walls and merge overlapping or adjacent ones along the x and y axes",
+        default=True)
+    tolerance = FloatProperty(
+        name="Tolerance",
+        description="Wall endpoints closer than this are considered the same point",
+        default=SNAP_TOLERANCE, min=0.0001)
+    report_file = StringProperty(
+        name="Report",
+        description="Write the import profile to this JSON file (empty: only print it)",
+        subtype='FILE_PATH', default="")
+    background = BoolProperty(
+        name="Background",
+        description="Import without blocking the interface, with a progress bar (Esc cancels and removes what was imported)",
+        default=True)
     def draw(self, context):
         layout = self.layout
-    def execute(self, context):
-        try:
-            drawWalls(self.filepath)
-        except WalError:
-            print("Error when loading Wal file:\n" + theMessage)
-        return {'FINISHED'}
+        layout.prop(self, "batched")
+        layout.prop(self, "chunk_size")
+        layout.prop(self, "merge")
+        layout.prop(self, "tolerance")
+        layout.prop(self, "report_file")
+        layout.prop(self, "background")
+    # The import runs as an alchemist_jobs.Job (see alchemist_jobs.ModalImport)
+    def job(self, context):
+        return drawWallsJob(self.filepath, self.batched, self.chunk_size, self.merge, self.tolerance, self.report_file)
+    def finished(self, job):
+        pass
+    def failed(self, job):
+        if (not isinstance(job.error, WalError)):
+            raise job.error
+        print("Error when loading Wal file:\n" + theMessage)
     def invoke(self, context, event):
         context.window_manager.fileselect_add(self)
         return {'RUNNING_MODAL'}
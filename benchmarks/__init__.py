@@ -0,0 +1 @@
+# Benchmarks of the Alchemist import add-ons (see bench_import.py and bench_scaling.py)
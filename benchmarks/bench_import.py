@@ -0,0 +1,258 @@
+# Reproducible benchmarks of the Alchemist importers, with regression checks against a stored baseline.
+# Synthetic .nod, .gra and .wal files (see synthetic.py) are written to a temporary directory, then every case
+# is timed (best of --repeat runs) and its peak memory recorded:
+#   parse_*       readNodesFromFile, readGradsFromFile (MB/s), readWalls (walls/s), cache loading (MB/s)
+#   import_*      scene construction of the importers (nodes, gradients, surfaces, fields or walls per second)
+#   handler_*     playback through the frame handlers (frames/s)
+#   follow_nodes  refresh of a followed node file after its last steps were appended (steps/s)
+#
+# Outside Blender the add-ons run against the minimal bpy stand-in in benchmarks/fakebpy:
+#   python benchmarks/bench_import.py [--scale small|medium|large] [--save results.json] [--baseline results.json]
+# Inside Blender the real bpy is used:
+#   blender --background --python benchmarks/bench_import.py -- [options]
+# With --baseline, a case slower than the baseline by more than --tolerance is a regression, and the exit status is 1.
+#
+# benchmarks/baseline_small.json holds reference results of the small scale with fakebpy. Check against it with
+#   python benchmarks/bench_import.py --repeat 5 --baseline benchmarks/baseline_small.json --tolerance 1.0
+# Timings are absolute and vary between runs by up to about 1.5x, hence the tolerance: a case twice as slow fails.
+# After an intended change in speed, or on another machine, refresh it with
+#   python benchmarks/bench_import.py --repeat 5 --save benchmarks/baseline_small.json
+
+import os, sys, io, json, time, shutil, tempfile, argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+try:
+    import bpy
+except ImportError:
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks', 'fakebpy'))
+    import bpy
+try:
+    import tracemalloc
+except ImportError: # Before Python 3.4
+    tracemalloc = None
+
+import alchemist_profile, alchemist_nodes, alchemist_grads, alchemist_gradsurfaces, alchemist_walls
+from benchmarks import synthetic
+
+alchemist_profile.PRINT_EVERY = 0
+
+# Sizes of the synthetic files
+SCALES = {
+    'small': {'nodes': 500, 'steps': 50, 'points': 900, 'grad_steps': 20, 'segments': 500, 'frames': 50},
+    'medium': {'nodes': 2000, 'steps': 200, 'points': 2500, 'grad_steps': 50, 'segments': 5000, 'frames': 200},
+    'large': {'nodes': 10000, 'steps': 500, 'points': 10000, 'grad_steps': 100, 'segments': 50000, 'frames': 500}}
+
+# Size of a file in MB
+def megabytes(filename):
+    return os.path.getsize(filename) / 1e6
+
+# Empty the scene between two runs
+def resetScene():
+    if hasattr(bpy, 'reset'): # bpy stand-in
+        bpy.reset()
+    else:
+        bpy.ops.wm.read_homefile()
+        del bpy.app.handlers.frame_change_pre[:]
+
+# Play frames 1..'frames' through the frame handlers
+def playFrames(frames):
+    scene = bpy.context.scene
+    for frame in range(1, frames + 1):
+        scene.frame_set(frame)
+
+# Every case prepares the scene and returns a couple (run, amount): 'run' is the timed function and 'amount' what
+# it processes, in the unit of the case
+def parseNodes(files, scale):
+    return (lambda: alchemist_nodes.readNodesFromFile(files['nod'])), megabytes(files['nod'])
+
+def parseGrads(files, scale):
+    return (lambda: alchemist_grads.readGradsFromFile(files['gra'])), megabytes(files['gra'])
+
+def parseWalls(files, scale):
+    return (lambda: alchemist_walls.readWalls(files['wal'])), len(alchemist_walls.readWalls(files['wal']))
+
+def loadCache(files, scale):
+    alchemist_nodes.readNodesFromFile(files['nod'], True) # Writes the cache
+    return (lambda: alchemist_nodes.readNodesFromFile(files['nod'], True)), megabytes(files['nod'])
+
+def importNodes(files, scale, mode='HANDLER'):
+    return (lambda: alchemist_nodes.importNodes(files['nod'], mode, False)), scale['nodes']
+
+def importNodesBake(files, scale):
+    return importNodes(files, scale, 'BAKE')
+
+def importNodesCloud(files, scale):
+    return importNodes(files, scale, 'CLOUD')
+
+def importGrads(files, scale):
+    return (lambda: alchemist_grads.importGrads(files['gra'], False)), scale['points']
+
+def importSurfaces(files, scale):
+    return (lambda: alchemist_gradsurfaces.importGrads(files['gra'], False, cache=False)), scale['grad_steps']
+
+# Scattered gradients, triangulated at every step (no reused topology): the cost of the Delaunay triangulation
+def importSurfacesScattered(files, scale):
+    return (lambda: alchemist_gradsurfaces.importGrads(files['grs'], False, incremental=False, shared=False,
+                                                       cache=False)), scale['grad_steps']
+
+def importField(files, scale):
+    return (lambda: alchemist_gradsurfaces.importGrads(files['gra'], False, cache=False, mode='FIELD')), scale['grad_steps']
+
+def importWalls(files, scale):
+    return (lambda: alchemist_walls.drawWalls(files['wal'])), scale['segments']
+
+def handlerNodes(files, scale, mode='HANDLER'):
+    alchemist_nodes.importNodes(files['nod'], mode, False)
+    return (lambda: playFrames(scale['frames'])), scale['frames']
+
+def handlerCloud(files, scale):
+    return handlerNodes(files, scale, 'CLOUD')
+
+def handlerGrads(files, scale):
+    alchemist_grads.importGrads(files['gra'], False)
+    return (lambda: playFrames(scale['frames'])), scale['frames']
+
+def handlerSurfaces(files, scale):
+    alchemist_gradsurfaces.importGrads(files['gra'], False, cache=False)
+    return (lambda: playFrames(scale['frames'])), scale['frames']
+
+# The whole node file but its last FOLLOW_STEPS steps is imported in follow mode, then they are appended:
+# the refresh reads only them, whatever the length of the file
+FOLLOW_STEPS = 10
+
+def followNodes(files, scale):
+    with open(files['nod'], 'rb') as f:
+        rows = f.read().splitlines(True)
+    live = files['nod'] + '.live'
+    with open(live, 'wb') as f:
+        f.writelines(rows[:-FOLLOW_STEPS])
+    alchemist_nodes.importNodes(live, 'HANDLER', False, follow=True)
+    with open(live, 'ab') as f:
+        f.writelines(rows[-FOLLOW_STEPS:])
+    return alchemist_nodes.refreshNodes, FOLLOW_STEPS
+
+# Triples (name, case, unit)
+CASES = [
+    ('parse_nodes', parseNodes, 'MB/s'),
+    ('parse_grads', parseGrads, 'MB/s'),
+    ('parse_walls', parseWalls, 'walls/s'),
+    ('load_cache', loadCache, 'MB/s'),
+    ('import_nodes', importNodes, 'nodes/s'),
+    ('import_nodes_bake', importNodesBake, 'nodes/s'),
+    ('import_nodes_cloud', importNodesCloud, 'nodes/s'),
+    ('import_grads', importGrads, 'gradients/s'),
+    ('import_surfaces', importSurfaces, 'steps/s'),
+    ('import_scattered', importSurfacesScattered, 'steps/s'),
+    ('import_field', importField, 'steps/s'),
+    ('import_walls', importWalls, 'walls/s'),
+    ('handler_nodes', handlerNodes, 'frames/s'),
+    ('handler_cloud', handlerCloud, 'frames/s'),
+    ('handler_grads', handlerGrads, 'frames/s'),
+    ('handler_surfaces', handlerSurfaces, 'frames/s'),
+    ('follow_nodes', followNodes, 'steps/s')]
+
+# Write the synthetic files of a scale into 'directory'
+def writeFiles(directory, scale):
+    files = {
+        'nod': os.path.join(directory, 'bench.nod'),
+        'gra': os.path.join(directory, 'bench.gra'),
+        'grs': os.path.join(directory, 'scattered.gra'),
+        'wal': os.path.join(directory, 'bench.wal')}
+    synthetic.writeNodes(files['nod'], scale['nodes'], scale['steps'], churn=0.01)
+    synthetic.writeGrads(files['gra'], scale['points'], scale['grad_steps'])
+    synthetic.writeGrads(files['grs'], scale['points'], scale['grad_steps'], lattice=False)
+    synthetic.writeWalls(files['wal'], scale['segments'])
+    return files
+
+# Run a case once: seconds of the timed function, the amount it processed and, with 'traced', the peak memory
+# it allocated (Python allocations, in MB)
+def runCase(case, files, scale, traced=False):
+    resetScene()
+    stdout = sys.stdout
+    sys.stdout = io.StringIO() # The importers print their profiles
+    try:
+        run, amount = case(files, scale)
+        if traced:
+            tracemalloc.start()
+        start = time.time()
+        run()
+        seconds = time.time() - start
+        peak = None
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1] / 1048576.0
+            tracemalloc.stop()
+    finally:
+        sys.stdout = stdout
+    return seconds, amount, peak
+
+# Time a case: best of 'repeat' runs; memory is traced in one more run, since tracing slows everything down
+def timeCase(case, files, scale, repeat):
+    best = None
+    for i in range(repeat):
+        seconds, amount, peak = runCase(case, files, scale)
+        best = seconds if best == None else min(best, seconds)
+    if tracemalloc != None:
+        peak = runCase(case, files, scale, True)[2]
+    return {'seconds': best, 'rate': amount / best if best > 0 else 0.0, 'peak_mb': peak}
+
+# Compare results with a baseline: list of (name, ratio, regression), where 'ratio' is current/baseline time
+def compare(results, baseline, tolerance):
+    rows = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old == None or not old['seconds']:
+            continue
+        ratio = result['seconds'] / old['seconds']
+        rows.append((name, ratio, ratio > 1.0 + tolerance))
+    return rows
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(prog='bench_import.py', description='Benchmark the Alchemist importers')
+    parser.add_argument('--scale', default='small', choices=sorted(SCALES))
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of every case (the best one counts)')
+    parser.add_argument('--cases', help='Comma separated cases to run (default: all)')
+    parser.add_argument('--save', help='Write the results to this JSON file (a new baseline)')
+    parser.add_argument('--baseline', help='Compare with the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Slowdown allowed before a regression')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArgs(argv)
+    scale = SCALES[args.scale]
+    selected = args.cases.split(',') if args.cases else [name for name, case, unit in CASES]
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        files = writeFiles(directory, scale)
+        print('Scale ' + args.scale + ': ' + ', '.join(k + '=' + str(v) for k, v in sorted(scale.items())))
+        print('%-20s %10s %22s %10s' % ('case', 'seconds', 'rate', 'peak MB'))
+        for name, case, unit in CASES:
+            if name not in selected:
+                continue
+            result = timeCase(case, files, scale, args.repeat)
+            result['unit'] = unit
+            results[name] = result
+            peak = '%10.1f' % result['peak_mb'] if result['peak_mb'] != None else '%10s' % '-'
+            print('%-20s %10.4f %22s %s' % (name, result['seconds'], ('%.1f ' % result['rate']) + unit, peak))
+    finally:
+        shutil.rmtree(directory)
+    report = {'scale': args.scale, 'sizes': scale, 'fake_bpy': hasattr(bpy, 'reset'), 'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    regressions = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != args.scale or baseline.get('fake_bpy') != report['fake_bpy']:
+            print('Warning: the baseline was measured with a different scale or bpy')
+        print('%-20s %10s' % ('case', 'vs baseline'))
+        for name, ratio, regression in compare(results, baseline['results'], args.tolerance):
+            print('%-20s %9.2fx%s' % (name, ratio, '  REGRESSION' if regression else ''))
+            regressions += regression
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
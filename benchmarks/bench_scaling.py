@@ -0,0 +1,73 @@
+# Import time against file size for the Alchemist trace readers.
+# Synthetic .nod and .gra files of growing size are written to a temporary directory and read back;
+# the time per MB should stay flat (linear scaling).
+#
+# Outside Blender only the parser is measured:
+#   python benchmarks/bench_scaling.py [nodes_per_step] [max_steps]
+# Inside Blender the add-on readers and the frame range setup are measured too:
+#   blender --background --python benchmarks/bench_scaling.py -- [nodes_per_step] [max_steps]
+
+import os, sys, shutil, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import alchemist_trace
+from benchmarks import synthetic
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+# Write a synthetic trace: 'steps' rows of 'nodes' random walkers (or a lattice of 'nodes' gradients)
+def writeTrace(filename, nodes, steps, gradients=False):
+    if gradients:
+        synthetic.writeGrads(filename, nodes, steps)
+    else:
+        synthetic.writeNodes(filename, nodes, steps)
+
+# Time a single import of 'filename'
+def timeImport(filename, gradients):
+    start = time.time()
+    if bpy is None:
+        if gradients:
+            trace = alchemist_trace.readGrads(filename)
+        else:
+            trace = alchemist_trace.readNodes(filename)
+    else:
+        if gradients:
+            import alchemist_grads
+            trace = alchemist_grads.readGradsFromFile(filename)
+        else:
+            import alchemist_nodes
+            trace = alchemist_nodes.readNodesFromFile(filename)
+        bpy.context.scene.frame_start = 1
+        bpy.context.scene.frame_end = max(len(trace), 1)
+    return time.time() - start
+
+def main(args):
+    nodes = int(args[0]) if len(args) > 0 else 2000
+    max_steps = int(args[1]) if len(args) > 1 else 400
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for gradients, ext in ((False, '.nod'), (True, '.gra')):
+            print(ext + ' (' + str(nodes) + ' nodes per step)')
+            print('%8s %10s %10s %10s' % ('steps', 'MB', 'seconds', 's/MB'))
+            rates = []
+            steps = max(max_steps // 8, 1)
+            while steps <= max_steps:
+                filename = os.path.join(tmpdir, 'trace' + str(steps) + ext)
+                writeTrace(filename, nodes, steps, gradients)
+                mb = os.path.getsize(filename) / 1e6
+                seconds = timeImport(filename, gradients)
+                rates.append(seconds / mb)
+                print('%8d %10.1f %10.3f %10.4f' % (steps, mb, seconds, seconds / mb))
+                os.remove(filename)
+                steps *= 2
+            # Linear scaling means the time per MB does not grow with the file size
+            print('s/MB largest/smallest: %.2f' % (rates[-1] / rates[0]))
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    main(argv)
@@ -0,0 +1,46 @@
+# Stand-in for bmesh (see benchmarks/fakebpy/bpy): only the vertices of a mesh, enough to remove some of them
+
+import numpy as np
+
+class BMVert(object):
+    def __init__(self, index):
+        self.index = index
+
+# Vertices of a BMesh, made on access
+class BMVertSeq(object):
+    def __init__(self):
+        self.count = 0
+        self.removed = set()
+
+    def ensure_lookup_table(self):
+        pass
+
+    def __getitem__(self, index):
+        return BMVert(index)
+
+    def __len__(self):
+        return self.count - len(self.removed)
+
+    def remove(self, vert):
+        self.removed.add(vert.index)
+
+class BMesh(object):
+    def __init__(self):
+        self.verts = BMVertSeq()
+        self.co = np.zeros(0)
+
+    def from_mesh(self, mesh):
+        self.verts.count = len(mesh.vertices)
+        self.co = mesh.vertices.buffer('co').copy()
+
+    def to_mesh(self, mesh):
+        keep = np.ones(self.verts.count, dtype=bool)
+        keep[list(self.verts.removed)] = False
+        mesh.vertices.count = int(keep.sum())
+        mesh.vertices.buffers = {'co': self.co.reshape(-1, 3)[keep].ravel()}
+
+    def free(self):
+        pass
+
+def new():
+    return BMesh()
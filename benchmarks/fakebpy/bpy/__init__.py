@@ -0,0 +1,318 @@
+# Minimal stand-in for the Blender Python API, so that the benchmarks can run the add-ons outside Blender.
+# It models only what the Alchemist add-ons use: data-blocks kept in collections by name, meshes whose element
+# arrays are NumPy buffers (so foreach_set/foreach_get cost about what they cost in Blender), a scene with a
+# frame handler list, the cone and sphere primitives, and image textures for displacement modifiers. Nothing is drawn: timings measure the add-on code.
+# reset() empties everything, between two benchmarks.
+
+import os, sys
+import numpy as np
+from . import props, types
+
+# Collection of data-blocks, looked up by name (like bpy.data.objects)
+class Collection(object):
+    def __init__(self, factory=None):
+        self.factory = factory
+        self.byname = {}
+
+    def unique(self, name):
+        if name not in self.byname:
+            return name
+        i = 1
+        while '%s.%03d' % (name, i) in self.byname:
+            i += 1
+        return '%s.%03d' % (name, i)
+
+    def new(self, name, *args, **options):
+        block = self.factory(self.unique(name), *args, **options)
+        self.add(block)
+        return block
+
+    def add(self, block):
+        block.owners.append(self)
+        self.byname[block.name] = block
+
+    def remove(self, block, **options):
+        if self.byname.get(block.name) is block:
+            del self.byname[block.name]
+            block.owners.remove(self)
+
+    def rename(self, block, old, new):
+        if self.byname.get(old) is block:
+            del self.byname[old]
+            self.byname[new] = block
+
+    def get(self, name, default=None):
+        return self.byname.get(name, default)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.byname.values())[key]
+        return self.byname[key]
+
+    def __contains__(self, name):
+        return name in self.byname
+
+    def __len__(self):
+        return len(self.byname)
+
+    def __iter__(self):
+        return iter(list(self.byname.values()))
+
+    def keys(self):
+        return list(self.byname.keys())
+
+    def values(self):
+        return list(self.byname.values())
+
+    def items(self):
+        return list(self.byname.items())
+
+# Data-block with a name, which stays unique in the collections holding it
+class ID(object):
+    def __init__(self, name):
+        self.owners = []
+        self._name = name
+
+    def getName(self):
+        return self._name
+
+    def setName(self, name):
+        for owner in self.owners:
+            name = owner.unique(name) if owner.get(name) is not self else name
+        old = self._name
+        self._name = name
+        for owner in self.owners:
+            owner.rename(self, old, name)
+
+    name = property(getName, setName)
+
+# Array of mesh elements (vertices, loops, polygons, keyframe points): every attribute is a NumPy buffer
+class Elements(object):
+    def __init__(self, sizes):
+        self.sizes = sizes # Couples (attribute, values per element)
+        self.count = 0
+        self.buffers = {}
+
+    def add(self, count):
+        self.count += count
+        for name in list(self.buffers):
+            self.buffers[name] = np.resize(self.buffers[name], self.count * self.sizes[name])
+
+    def buffer(self, name):
+        if name not in self.buffers:
+            self.buffers[name] = np.zeros(self.count * self.sizes[name])
+        return self.buffers[name]
+
+    def foreach_set(self, name, values):
+        self.buffer(name)[:] = np.asarray(values, dtype=np.float64).ravel()
+
+    def foreach_get(self, name, values):
+        values[:] = self.buffer(name)
+
+    def __len__(self):
+        return self.count
+
+class Mesh(ID):
+    def __init__(self, name):
+        ID.__init__(self, name)
+        self.vertices = Elements({'co': 3})
+        self.loops = Elements({'vertex_index': 1})
+        self.polygons = Elements({'loop_start': 1, 'loop_total': 1})
+        self.materials = []
+
+    def from_pydata(self, vertices, edges, faces):
+        self.vertices.add(len(vertices))
+        if len(vertices):
+            self.vertices.foreach_set('co', vertices)
+        self.polygons.add(len(faces))
+        self.loops.add(sum(len(f) for f in faces))
+
+    def update(self, calc_edges=False):
+        pass
+
+class Object(ID):
+    def __init__(self, name, data=None):
+        ID.__init__(self, name)
+        self.data = data
+        self.location = (0.0, 0.0, 0.0)
+        self.scale = (1.0, 1.0, 1.0)
+        self.hide = False
+        self.hide_render = False
+        self.show_name = False
+        self.parent = None
+        self.dupli_type = 'NONE'
+        self.active_material = None
+        self.animation_data = None
+        self.material_slots = [MaterialSlot() for m in getattr(data, 'materials', [])]
+        self.modifiers = Modifiers()
+
+    def animation_data_create(self):
+        self.animation_data = AnimData()
+        return self.animation_data
+
+class Modifier(object):
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+        self.texture = None
+
+class Modifiers(list):
+    def new(self, name, type):
+        modifier = Modifier(name, type)
+        self.append(modifier)
+        return modifier
+
+    def get(self, name, default=None):
+        for modifier in self:
+            if modifier.name == name:
+                return modifier
+        return default
+
+class MaterialSlot(object):
+    def __init__(self):
+        self.link = 'DATA'
+        self.material = None
+
+class AnimData(object):
+    def __init__(self):
+        self.action = None
+
+class Material(ID):
+    def __init__(self, name):
+        ID.__init__(self, name)
+        self.diffuse_color = (0.8, 0.8, 0.8)
+        self.alpha = 1.0
+        self.transparency_method = 'MASK'
+
+class Image(ID):
+    def __init__(self, name, filepath=''):
+        ID.__init__(self, name)
+        self.filepath = filepath
+        self.source = 'FILE'
+
+class Images(Collection):
+    def load(self, filepath):
+        with open(filepath, 'rb'):
+            pass
+        return self.new(os.path.basename(filepath), filepath)
+
+class ImageUser(object):
+    def __init__(self):
+        self.frame_start = 1
+        self.frame_duration = 1
+        self.frame_offset = 0
+        self.use_auto_refresh = False
+
+class Texture(ID):
+    def __init__(self, name, type='NONE'):
+        ID.__init__(self, name)
+        self.type = type
+        self.image = None
+        self.extension = 'REPEAT'
+        self.image_user = ImageUser()
+
+class FCurve(object):
+    def __init__(self, data_path, index=0):
+        self.data_path = data_path
+        self.array_index = index
+        self.keyframe_points = Elements({'co': 2, 'interpolation': 1})
+
+    def update(self):
+        pass
+
+class FCurves(list):
+    def new(self, data_path, index=0, action_group=''):
+        curve = FCurve(data_path, index)
+        self.append(curve)
+        return curve
+
+class Action(ID):
+    def __init__(self, name):
+        ID.__init__(self, name)
+        self.fcurves = FCurves()
+
+class SceneObjects(Collection):
+    def link(self, ob):
+        self.add(ob)
+
+    def unlink(self, ob):
+        self.remove(ob)
+
+class Render(object):
+    def __init__(self):
+        self.fps = 24
+        self.fps_base = 1.0
+        self.filepath = ''
+
+class Scene(ID):
+    def __init__(self, name):
+        ID.__init__(self, name)
+        self.objects = SceneObjects()
+        self.render = Render()
+        self.camera = None
+        self.frame_start = 1
+        self.frame_end = 250
+        self.frame_current = 1
+
+    def frame_set(self, frame):
+        self.frame_current = frame
+        for handler in list(app.handlers.frame_change_pre):
+            handler(self)
+
+class Namespace(object):
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+app = Namespace(
+    handlers=Namespace(frame_change_pre=[], frame_change_post=[]),
+    binary_path='blender', binary_path_python=sys.executable, background=True, version=(2, 63, 0))
+data = Namespace()
+context = Namespace()
+
+# Empty the data and the scene, and drop the frame handlers
+def reset():
+    data.objects = Collection(Object)
+    data.meshes = Collection(Mesh)
+    data.materials = Collection(Material)
+    data.actions = Collection(Action)
+    data.images = Images(Image)
+    data.textures = Collection(Texture)
+    data.scenes = Collection(Scene)
+    data.filepath = ''
+    context.scene = data.scenes.new('Scene')
+    context.object = None
+    del app.handlers.frame_change_pre[:]
+    del app.handlers.frame_change_post[:]
+
+reset()
+
+# Primitive mesh added to the scene as the active object (vertices only, faces are not needed)
+def addPrimitive(name, vertices, location):
+    mesh = data.meshes.new(name)
+    mesh.from_pydata(np.zeros((vertices, 3)), [], [])
+    ob = data.objects.new(name, mesh)
+    ob.location = tuple(location)
+    context.scene.objects.link(ob)
+    context.object = ob
+    return {'FINISHED'}
+
+def primitive_cone_add(vertices=32, location=(0.0, 0.0, 0.0), **options):
+    return addPrimitive('Cone', vertices + 1, location)
+
+def primitive_uv_sphere_add(segments=32, ring_count=16, location=(0.0, 0.0, 0.0), **options):
+    return addPrimitive('Sphere', segments * (ring_count - 1) + 2, location)
+
+# Rendering an animation plays its frames
+def render(animation=False, write_still=False):
+    scene = context.scene
+    frames = range(scene.frame_start, scene.frame_end + 1) if animation else [scene.frame_current]
+    for frame in frames:
+        scene.frame_set(frame)
+    return {'FINISHED'}
+
+ops = Namespace(
+    mesh=Namespace(primitive_cone_add=primitive_cone_add, primitive_uv_sphere_add=primitive_uv_sphere_add),
+    render=Namespace(render=render),
+    wm=Namespace(save_as_mainfile=lambda filepath='': {'FINISHED'}))
+
+utils = Namespace(register_module=lambda module: None, unregister_module=lambda module: None)
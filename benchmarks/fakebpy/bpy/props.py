@@ -0,0 +1,11 @@
+# Stand-in for bpy.props (see benchmarks/fakebpy/bpy): a property is just its default value
+
+def _property(**options):
+    return options.get('default')
+
+StringProperty = _property
+BoolProperty = _property
+IntProperty = _property
+FloatProperty = _property
+EnumProperty = _property
+FloatVectorProperty = _property
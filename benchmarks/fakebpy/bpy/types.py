@@ -0,0 +1,15 @@
+# Stand-in for bpy.types (see benchmarks/fakebpy/bpy)
+
+class Operator(object):
+    def report(self, level, message):
+        print(' '.join(sorted(level)) + ': ' + message)
+
+class Menu(object):
+    def __init__(self):
+        self.functions = []
+    def append(self, function):
+        self.functions.append(function)
+    def remove(self, function):
+        self.functions.remove(function)
+
+INFO_MT_file_import = Menu()
@@ -0,0 +1 @@
+# Stand-in for bpy_extras (see benchmarks/fakebpy/bpy)
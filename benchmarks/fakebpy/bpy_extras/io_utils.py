@@ -0,0 +1,4 @@
+# Stand-in for bpy_extras.io_utils (see benchmarks/fakebpy/bpy)
+
+class ImportHelper(object):
+    pass
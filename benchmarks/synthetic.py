@@ -0,0 +1,59 @@
+# Synthetic Alchemist files for the benchmarks, reproducible from a seed.
+#   .nod: 'nodes' random walkers for 'steps' steps; with 'churn', that fraction of the nodes is replaced every step
+#   .gra: a lattice of 'points' gradients (or scattered points) whose values change every step
+#   .wal: 'segments' walls, a share of them duplicated, overlapping or collinear, like exported floor plans
+
+import math, random
+
+# Write a node trace
+def writeNodes(filename, nodes, steps, churn=0.0, seed=42):
+    rnd = random.Random(seed)
+    pos = dict((i, (rnd.uniform(0, 100), rnd.uniform(0, 100))) for i in range(nodes))
+    serial = nodes
+    with open(filename, 'w') as f:
+        for step in range(steps):
+            row = [str(step * 0.1), str(step)]
+            for i in sorted(pos):
+                x, y = pos[i]
+                row.append('%d,%.4f,%.4f,person' % (i, x, y))
+            f.write(';'.join(row) + ';\n')
+            pos = dict((i, (pos[i][0] + rnd.uniform(-1, 1), pos[i][1] + rnd.uniform(-1, 1))) for i in sorted(pos))
+            for i in rnd.sample(sorted(pos), int(len(pos) * churn)):
+                del pos[i]
+                pos[serial] = (rnd.uniform(0, 100), rnd.uniform(0, 100))
+                serial += 1
+
+# Write a gradient trace: the gradients are on a square lattice, or scattered with 'lattice' False
+def writeGrads(filename, points, steps, lattice=True, seed=42):
+    rnd = random.Random(seed)
+    side = max(int(math.sqrt(points)), 1)
+    if lattice:
+        xy = [(float(i % side), float(i // side)) for i in range(points)]
+    else:
+        xy = [(rnd.uniform(0, side), rnd.uniform(0, side)) for i in range(points)]
+    with open(filename, 'w') as f:
+        for step in range(steps):
+            row = [str(step * 0.1), str(step)]
+            for i, (x, y) in enumerate(xy):
+                value = 5 + 5 * math.sin(x * 0.3 + step * 0.2) * math.cos(y * 0.3)
+                row.append('%d,%.4f,%.4f,%.4f' % (i, x, y, value))
+            f.write(';'.join(row) + ';\n')
+
+# Write a wall file: a grid of rooms split into segments, with 'duplicates' of them repeated
+def writeWalls(filename, segments, duplicates=0.1, seed=42):
+    rnd = random.Random(seed)
+    rooms = max(int(math.sqrt(segments / 4.0)), 1)
+    walls = []
+    for i in range(rooms + 1):
+        for j in range(rooms):
+            walls.append((i * 10.0, j * 10.0, i * 10.0, j * 10.0 + 10.0)) # Vertical
+            walls.append((j * 10.0, i * 10.0, j * 10.0 + 10.0, i * 10.0)) # Horizontal
+    while len(walls) < segments: # Split walls in collinear halves
+        x1, y1, x2, y2 = walls.pop(rnd.randrange(len(walls)))
+        mx, my = (x1 + x2) / 2, (y1 + y2) / 2
+        walls += [(x1, y1, mx, my), (mx, my, x2, y2)]
+    walls = walls[:segments]
+    walls += [walls[rnd.randrange(len(walls))] for i in range(int(len(walls) * duplicates))]
+    rnd.shuffle(walls)
+    with open(filename, 'w') as f:
+        f.write(';'.join('%.3f,%.3f,%.3f,%.3f' % w for w in walls) + ';\n')
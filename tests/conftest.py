@@ -0,0 +1,12 @@
+# Unit tests of the Alchemist add-on modules that can run outside Blender.
+# The modules which import bpy (alchemist_walls) run against the bpy stand-in of the benchmarks:
+#   python -m pytest tests
+
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+try:
+    import bpy
+except ImportError:
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks', 'fakebpy'))
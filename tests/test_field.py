@@ -0,0 +1,72 @@
+# Tests of the gradient fields (alchemist_field)
+
+import os, struct, zlib
+import numpy as np
+import pytest
+import alchemist_field
+from alchemist_trace import Trace
+
+def test_fill_of_a_lone_sample():
+    sums, weights = alchemist_field.splat(np.array([[0.3, 0.6, 5.0]]), (0.0, 0.0, 1.0, 1.0), (8, 6))
+    field = alchemist_field.fill(sums, weights)
+    assert field.shape == (6, 8)
+    assert np.allclose(field, 5.0)
+
+@pytest.mark.parametrize('shape', [(1, 1), (1, 3), (5, 1), (7, 3)])
+def test_fill_of_thin_grids(shape):
+    weights = np.zeros(shape)
+    weights[0, 0] = 0.4
+    field = alchemist_field.fill(weights * 2.0, weights)
+    assert np.allclose(field, 2.0)
+
+def test_fill_without_samples():
+    assert (alchemist_field.fill(np.zeros((4, 4)), np.zeros((4, 4))) == 0).all()
+
+def test_rasterize_keeps_the_samples_on_the_nodes():
+    bounds = (0.0, 0.0, 3.0, 3.0)
+    coords = np.array([(x, y, x + 10 * y) for y in range(4) for x in range(4)], dtype=np.float32)
+    field = alchemist_field.rasterize(coords, bounds, (4, 4))
+    assert np.allclose(field, np.arange(4)[None, :] + 10 * np.arange(4)[:, None])
+
+def test_bounds_range_and_shape():
+    trace = Trace(3)
+    trace.coords = [np.array([(1, 2, 5), (3, 8, -1)], dtype=np.float32), np.empty((0, 3), dtype=np.float32)]
+    bounds = alchemist_field.fieldBounds(trace)
+    assert bounds == (1.0, 2.0, 3.0, 8.0)
+    assert alchemist_field.fieldRange(trace) == (-1.0, 5.0)
+    assert alchemist_field.fieldShape(bounds, 60) == (20, 60)
+    assert alchemist_field.fieldBounds(Trace(3)) == (0.0, 0.0, 1.0, 1.0)
+
+def test_write_png(tmpdir):
+    path = str(tmpdir.join('f.png'))
+    alchemist_field.writePNG(path, np.array([[0.0, 1.0, 2.0], [2.0, 2.0, 2.0]]), 0.0, 2.0)
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+    assert struct.unpack('>IIBB', data[16:26]) == (3, 2, 16, 0)
+    length = struct.unpack('>I', data[33:37])[0]
+    raw = np.frombuffer(zlib.decompress(data[41:41 + length]), dtype=np.uint8).reshape(2, 7)
+    pixels = raw[:, 1:].copy().view('>u2')
+    assert pixels.tolist() == [[65535, 65535, 65535], [0, 32768, 65535]] # Row 0 at the bottom
+
+def test_write_and_remove_fields(tmpdir):
+    filename = str(tmpdir.join('grads.gra'))
+    trace = Trace(3)
+    for value in (1.0, 2.0):
+        trace.ids.append(np.array([0], dtype=np.int32))
+        trace.coords.append(np.array([(0.5, 0.5, value)], dtype=np.float32))
+    bounds = (0.0, 0.0, 1.0, 1.0)
+    assert list(alchemist_field.writeFields(trace, filename, bounds, (4, 4), 1.0, 2.0)) == [1, 2]
+    assert sorted(os.listdir(alchemist_field.fieldPath(filename))) == ['field_0001.png', 'field_0002.png']
+    alchemist_field.removeFields(filename)
+    assert not os.path.exists(alchemist_field.fieldPath(filename))
+    alchemist_field.removeFields(filename) # Nothing to remove
+
+def test_remove_fields_keeps_other_files(tmpdir):
+    filename = str(tmpdir.join('grads.gra'))
+    directory = alchemist_field.fieldPath(filename)
+    os.makedirs(directory)
+    for name in ('field_0001.png', 'notes.txt'):
+        open(os.path.join(directory, name), 'w').close()
+    alchemist_field.removeFields(filename)
+    assert os.listdir(directory) == ['notes.txt']
@@ -0,0 +1,85 @@
+# Tests of the frame change dispatcher (alchemist_layers)
+
+import pytest
+import alchemist_layers
+from alchemist_profile import Profile
+
+class Scene:
+    def __init__(self, frame):
+        self.frame_current = frame
+
+@pytest.fixture
+def handlers():
+    alchemist_layers.layers.clear()
+    alchemist_layers.shownframe = None
+    yield []
+    alchemist_layers.layers.clear()
+
+# Update function recording the frames it is called on
+def recorder(frames, name):
+    return lambda scene, frame: frames.append((name, frame))
+
+def test_dispatch_updates_every_layer_once_per_frame(handlers):
+    frames = []
+    alchemist_layers.setLayer(handlers, 'nodes', recorder(frames, 'nodes'))
+    alchemist_layers.setLayer(handlers, 'grads', recorder(frames, 'grads'))
+    assert handlers == [alchemist_layers.dispatch]
+    for frame in (1, 1, 2):
+        alchemist_layers.dispatch(Scene(frame))
+    assert frames == [('nodes', 1), ('grads', 1), ('nodes', 2), ('grads', 2)]
+    alchemist_layers.invalidate()
+    alchemist_layers.dispatch(Scene(2))
+    assert len(frames) == 6
+
+def test_set_layer_replaces_in_place(handlers):
+    frames = []
+    alchemist_layers.setLayer(handlers, 'nodes', recorder(frames, 'old'))
+    alchemist_layers.setLayer(handlers, 'grads', recorder(frames, 'grads'))
+    alchemist_layers.dispatch(Scene(1))
+    alchemist_layers.setLayer(handlers, 'nodes', recorder(frames, 'new'))
+    alchemist_layers.dispatch(Scene(1)) # Same frame, but the new layer was never shown
+    assert frames[2:] == [('new', 1), ('grads', 1)]
+    assert list(alchemist_layers.layers) == ['nodes', 'grads']
+    assert handlers == [alchemist_layers.dispatch]
+
+def test_remove_the_last_layer_removes_the_dispatcher(handlers):
+    alchemist_layers.setLayer(handlers, 'nodes', recorder([], 'nodes'))
+    alchemist_layers.setLayer(handlers, 'grads', recorder([], 'grads'))
+    alchemist_layers.removeLayer(handlers, 'nodes')
+    assert handlers == [alchemist_layers.dispatch]
+    alchemist_layers.removeLayer(handlers, 'grads')
+    assert handlers == []
+
+def test_restore_layer(handlers):
+    alchemist_layers.setLayer(handlers, 'nodes', recorder([], 'old'))
+    old = alchemist_layers.layers['nodes']
+    alchemist_layers.setLayer(handlers, 'nodes', recorder([], 'new'))
+    alchemist_layers.restoreLayer(handlers, 'nodes', old)
+    assert alchemist_layers.layers['nodes'] is old
+    alchemist_layers.restoreLayer(handlers, 'nodes', None)
+    assert handlers == [] and len(alchemist_layers.layers) == 0
+
+def test_install_drops_the_layers_of_a_lost_dispatcher(handlers):
+    alchemist_layers.setLayer(handlers, 'nodes', recorder([], 'nodes'))
+    del handlers[:] # A new file was loaded
+    alchemist_layers.setLayer(handlers, 'grads', recorder([], 'grads'))
+    assert list(alchemist_layers.layers) == ['grads']
+
+def test_install_replaces_the_dispatcher_of_an_earlier_load(handlers):
+    def dispatch(scene):
+        pass
+    dispatch.__module__ = alchemist_layers.__name__
+    handlers.append(dispatch)
+    alchemist_layers.install(handlers)
+    assert handlers == [alchemist_layers.dispatch]
+
+def test_costs(handlers):
+    profile = Profile('nodes', 'trace.nod')
+    alchemist_layers.setLayer(handlers, 'nodes', recorder([], 'nodes'), profile)
+    for frame in (1, 2, 3):
+        alchemist_layers.dispatch(Scene(frame))
+    name, updates, mean, slowest = alchemist_layers.costs()[0]
+    assert (name, updates) == ('nodes', 3)
+    assert profile.frames == 3
+    assert 0 <= mean <= slowest
+    assert alchemist_layers.text().startswith('nodes')
@@ -0,0 +1,57 @@
+# Tests of the material pools (alchemist_materials)
+
+import numpy as np
+import pytest
+import bpy
+import alchemist_materials
+from alchemist_materials import MaterialPool
+
+@pytest.fixture
+def materials():
+    bpy.reset()
+    return bpy.data.materials
+
+def test_slot_is_stable_and_in_range():
+    assert alchemist_materials.slot(21, 16) == 5
+    assert alchemist_materials.slot('node_7', 16) == alchemist_materials.slot('node_7', 16)
+    assert all(0 <= alchemist_materials.slot('node_%d' % i, 16) < 16 for i in range(100))
+    assert len(set(alchemist_materials.slot('node_%d' % i, 16) for i in range(100))) > 8
+
+def test_quantize():
+    bands = alchemist_materials.quantize([0.0, 0.24, 0.25, 0.99, 1.0, 2.0, -1.0], 0.0, 1.0, 4)
+    assert bands.tolist() == [0, 0, 1, 3, 3, 3, 0]
+    assert alchemist_materials.quantize([3.0, 4.0], 1.0, 1.0, 4).tolist() == [0, 0]
+
+def test_palettes():
+    assert len(alchemist_materials.hues(16)) == 16
+    assert len(set(alchemist_materials.hues(16))) == 16
+    ramp = alchemist_materials.ramp(5)
+    assert ramp[0][2] > ramp[0][0] and ramp[-1][0] > ramp[-1][2] # Blue to red
+    assert len(alchemist_materials.ramp(1)) == 1
+
+def test_pool_creates_a_material_per_slot_used(materials):
+    colors = alchemist_materials.hues(4)
+    pool = MaterialPool(materials, 'NodeMat', colors)
+    obs = [bpy.data.objects.new('node_%d' % i, None) for i in range(10)]
+    for i, ob in enumerate(obs):
+        pool.apply(ob, i % 2)
+    assert len(pool) == 4
+    assert sorted(m.name for m in materials.byname.values()) == ['NodeMat0', 'NodeMat1']
+    assert obs[0].active_material is obs[2].active_material
+    assert obs[1].active_material.diffuse_color == colors[1]
+
+def test_pool_reuses_the_materials_of_an_earlier_import(materials):
+    colors = alchemist_materials.hues(4)
+    first = MaterialPool(materials, 'NodeMat', colors).material(3)
+    assert MaterialPool(materials, 'NodeMat', colors).material(3) is first
+    assert len(materials.byname) == 1
+
+def test_shared_pool_colors_the_objects(materials):
+    colors = alchemist_materials.ramp(3)
+    pool = MaterialPool(materials, 'GradMat', colors, shared=True)
+    obs = [bpy.data.objects.new('grad_%d' % i, None) for i in range(3)]
+    for i, ob in enumerate(obs):
+        pool.apply(ob, i)
+    assert list(materials.byname) == ['GradMatShared']
+    assert obs[0].active_material.use_object_color
+    assert [ob.color for ob in obs] == [tuple(c) + (1.0,) for c in colors]
@@ -0,0 +1,107 @@
+# Tests of the surface reconstruction (alchemist_surface)
+
+import numpy as np
+import pytest
+import alchemist_surface
+
+# Twice the signed area of every triangle of 'faces' (positive when counterclockwise)
+def areas(points, faces):
+    a, b, c = points[faces[:, 0]], points[faces[:, 1]], points[faces[:, 2]]
+    return (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+
+# Vertices of the convex hull, without the points in the middle of its edges
+def hull(points):
+    pts = sorted(set(map(tuple, points.tolist())))
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+    chains = []
+    for sequence in (pts, pts[::-1]):
+        chain = []
+        for p in sequence:
+            while len(chain) >= 2 and cross(chain[-2], chain[-1], p) <= 0:
+                chain.pop()
+            chain.append(p)
+        chains.append(chain[:-1])
+    return chains[0] + chains[1]
+
+def polygonArea(polygon):
+    return abs(sum(polygon[i][0] * polygon[i-1][1] - polygon[i-1][0] * polygon[i][1] for i in range(len(polygon)))) / 2
+
+def scattered(count, seed):
+    return np.random.RandomState(seed).rand(count, 3) * 100
+
+@pytest.mark.parametrize('seed', range(5))
+def test_delaunay_covers_the_hull(seed):
+    coords = scattered(200, seed)
+    faces = alchemist_surface.delaunayFaces(coords)[0]
+    points = coords[:, 0:2]
+    assert (areas(points, faces) > 0).all() # Counterclockwise, none flat
+    assert abs(areas(points, faces).sum() / 2 - polygonArea(hull(points))) < 1e-6 * polygonArea(hull(points))
+    # Every triangle of a triangulation of n points, h of them on the hull: 2n - 2 - h
+    assert len(faces) == 2 * len(points) - 2 - len(hull(points))
+
+@pytest.mark.parametrize('seed', range(3))
+def test_delaunay_circles_are_empty(seed):
+    points = np.round(scattered(100, seed)[:, 0:2], alchemist_surface.DECIMALS)
+    faces = alchemist_surface.delaunayFaces(points)[0]
+    for face in faces:
+        a, b, c = (points[face[k]] - points for k in range(3))
+        det = ((a ** 2).sum(axis=1) * (b[:, 0] * c[:, 1] - c[:, 0] * b[:, 1])
+               - (b ** 2).sum(axis=1) * (a[:, 0] * c[:, 1] - c[:, 0] * a[:, 1])
+               + (c ** 2).sum(axis=1) * (a[:, 0] * b[:, 1] - b[:, 0] * a[:, 1]))
+        assert (det < 1e-6).all()
+
+def test_delaunay_of_a_square_with_a_center():
+    coords = np.array([(0, 0), (1, 0), (1, 1), (0, 1), (0.5, 0.5)], dtype=np.float64)
+    faces = alchemist_surface.delaunayFaces(coords)[0]
+    assert len(faces) == 4
+    assert (faces == 4).any(axis=1).all()
+
+def test_delaunay_of_duplicated_and_collinear_points():
+    line = np.array([(i, 2 * i) for i in range(10)], dtype=np.float64)
+    assert len(alchemist_surface.delaunayFaces(line)[0]) == 0
+    triangle = np.array([(0, 0), (1, 0), (0, 1), (1, 0), (0, 0)], dtype=np.float64)
+    faces = alchemist_surface.delaunayFaces(triangle)[0]
+    assert len(faces) == 1 and len(set(faces[0].tolist())) == 3
+    # A line and a single point off it: a fan of triangles
+    fan = np.vstack((line, [(5, 0)]))
+    assert len(alchemist_surface.delaunayFaces(fan)[0]) == 9
+
+def test_delaunay_max_edge():
+    coords = np.array([(0, 0), (1, 0), (0, 1), (50, 50)], dtype=np.float64)
+    assert len(alchemist_surface.delaunayFaces(coords)[0]) == 2
+    assert alchemist_surface.delaunayFaces(coords, max_edge=2)[0].tolist() == [[0, 1, 2]]
+
+def test_lattice_faces():
+    grid = np.array([(x, y, 0) for y in range(3) for x in range(4)], dtype=np.float64)
+    quads, tris = alchemist_surface.latticeFaces(grid)
+    assert len(quads) == 6 and len(tris) == 0
+    holed = np.delete(grid, 5, axis=0) # (1, 1) is missing
+    quads, tris = alchemist_surface.latticeFaces(holed)
+    assert len(quads) == 2 and len(tris) == 4
+    assert alchemist_surface.latticeFaces(scattered(50, 0)) is None
+
+def test_triangulate_picks_lattice_or_delaunay():
+    grid = np.array([(x, y, 0) for y in range(3) for x in range(3)], dtype=np.float64)
+    assert len(alchemist_surface.triangulate(grid)) == 2
+    assert len(alchemist_surface.triangulate(scattered(50, 0))) == 1
+    assert len(alchemist_surface.triangulate(grid[:2])[0]) == 0
+
+def test_remap_faces_and_reorder():
+    previous = np.array([3, 1, 2], dtype=np.int32)
+    ids = np.array([2, 3, 1], dtype=np.int32)
+    faces = (np.array([[0, 1, 2]], dtype=np.int32),)
+    assert alchemist_surface.remapFaces(faces, previous, ids)[0].tolist() == [[1, 2, 0]]
+    coords = np.array([[20], [30], [10]])
+    assert alchemist_surface.reorder(ids, coords, previous).tolist() == [[30], [10], [20]]
+
+def test_skin_steps_reuses_the_faces_of_the_same_nodes():
+    grid = np.array([(x, y, 0) for y in range(3) for x in range(3)], dtype=np.float64)
+    ids = [np.arange(9, dtype=np.int32), np.arange(9, dtype=np.int32)[::-1].copy(), np.arange(1, 10, dtype=np.int32)]
+    coords = [grid, grid[::-1].copy(), scattered(9, 1)]
+    steps = list(alchemist_surface.skinSteps(ids, coords, processes=1))
+    assert len(steps) == 3
+    assert alchemist_surface.topologyRuns(ids) == [1, 3]
+    # The remapped faces of step 2 are the faces of step 1 on the same nodes
+    for first, second in zip(steps[0], steps[1]):
+        assert (ids[1][second] == ids[0][first]).all()
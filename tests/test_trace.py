@@ -0,0 +1,186 @@
+# Tests of the trace reader (alchemist_trace)
+
+import os
+import numpy as np
+import pytest
+import alchemist_trace
+from alchemist_trace import Trace, TraceError
+
+NODES = (b"0.0;1;a,1,2,person;b,3,4,car;c,5,6,person\n"
+         b"0.5;2;a,2,3,person;c,6,7,person\n"
+         b"1.0;3;c,7,8,person;d,9,9,person\n")
+
+# Write 'data' to a file of the temporary directory and return its path
+def write(tmpdir, data, name='trace.nod'):
+    path = str(tmpdir.join(name))
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def names(trace, frame):
+    return [name for name, coords in trace.items(frame)]
+
+def test_parse_row_keeps_the_nodes_of_the_type():
+    trace = Trace(2)
+    assert alchemist_trace.parseRow(trace, b"0.1;7;a,1,2,person;b,3,4,car;c,5,6,person;\n", 'person')
+    assert names(trace, 1) == ['a', 'c']
+    assert trace.coords[0].tolist() == [[1, 2], [5, 6]]
+    assert trace.times == [0.1] and trace.realsteps == [7]
+
+def test_parse_row_type_is_everything_after_the_coordinates():
+    trace = Trace(2)
+    alchemist_trace.parseRow(trace, b"0;1;a,1,2,per,son;b,3,4,person;c,5,6,per,son\n", 'per,son')
+    assert names(trace, 1) == ['a', 'c']
+    assert trace.coords[0].tolist() == [[1, 2], [5, 6]]
+
+def test_parse_row_skips_blank_rows():
+    trace = Trace(2)
+    assert not alchemist_trace.parseRow(trace, b"  \r\n", 'person')
+    assert len(trace) == 0
+
+def test_parse_row_scales_the_last_coordinate():
+    trace = Trace(3)
+    alchemist_trace.parseRow(trace, b"0;1;a,1,2,3;b,4,5,6\n", None, 10.0)
+    assert trace.coords[0].tolist() == [[1, 2, 30], [4, 5, 60]]
+
+@pytest.mark.parametrize('row', [b"0;1;a,1,2,person;b,3\n", b"0;1;a,1,x,person\n", b"x;1;a,1,2,person\n"])
+def test_malformed_row_adds_no_step(row):
+    trace = Trace(2)
+    with pytest.raises(TraceError):
+        alchemist_trace.parseRow(trace, row, 'person')
+    assert len(trace) == 0 and trace.times == [] and trace.realsteps == []
+
+def test_read_trace_does_not_depend_on_the_chunk_size(tmpdir):
+    path = write(tmpdir, NODES)
+    whole = alchemist_trace.readNodes(path)
+    for chunk_size in (1, 7, 64):
+        trace = alchemist_trace.readNodes(path, chunk_size=chunk_size)
+        assert trace.names == whole.names
+        for frame in range(1, len(whole) + 1):
+            assert list(trace.items(frame)) == list(whole.items(frame))
+    assert [names(whole, frame) for frame in (1, 2, 3)] == [['a', 'c'], ['a', 'c'], ['c', 'd']]
+
+def test_read_trace_without_final_newline(tmpdir):
+    trace = alchemist_trace.readNodes(write(tmpdir, NODES.rstrip(b"\n")))
+    assert len(trace) == 3 and names(trace, 3) == ['c', 'd']
+
+def test_cache_round_trip(tmpdir):
+    path = write(tmpdir, NODES)
+    parsed = alchemist_trace.readNodes(path)
+    cached = alchemist_trace.readNodes(path, cache=True)
+    assert os.path.exists(alchemist_trace.cachePath(path))
+    loaded = alchemist_trace.readNodes(path, cache=True)
+    for trace in (cached, loaded):
+        assert isinstance(trace.ids, alchemist_trace.Blocks)
+        assert trace.names == parsed.names and trace.times == parsed.times and trace.realsteps == parsed.realsteps
+        for frame in range(1, len(parsed) + 1):
+            assert list(trace.items(frame)) == list(parsed.items(frame))
+
+def test_cache_of_other_options_is_stale(tmpdir):
+    path = write(tmpdir, NODES)
+    alchemist_trace.readNodes(path, cache=True)
+    key = alchemist_trace.cacheKey(path, 2, 'car', 1.0)
+    assert alchemist_trace.loadCache(alchemist_trace.cachePath(path), key) is None
+
+def test_truncated_cache_is_stale(tmpdir):
+    path = write(tmpdir, NODES)
+    alchemist_trace.readNodes(path, cache=True)
+    cache = alchemist_trace.cachePath(path)
+    with open(cache, 'rb') as f:
+        data = f.read()
+    key = alchemist_trace.cacheKey(path, 2, 'person', 1.0)
+    for length in (len(alchemist_trace.CACHE_MAGIC), len(alchemist_trace.CACHE_MAGIC) + 4, 40, len(data) - 1):
+        with open(cache, 'wb') as f:
+            f.write(data[:length])
+        assert alchemist_trace.loadCache(cache, key) is None
+    assert len(alchemist_trace.readNodes(path, cache=True)) == 3 # Parsed again
+
+def test_follower_reads_complete_rows_only(tmpdir):
+    rows = NODES.split(b"\n")
+    path = write(tmpdir, rows[0] + b"\n" + rows[1][:10])
+    follower = alchemist_trace.Follower(path, 2, 'person')
+    assert follower.poll(chunk_size=4) == 1
+    assert follower.poll() == 0 # The second row is not complete yet
+    with open(path, 'ab') as f:
+        f.write(rows[1][10:] + b"\n" + rows[2])
+    assert follower.poll() == 1
+    assert follower.poll(final=True) == 1 # The last row has no newline
+    assert [names(follower.trace, frame) for frame in (1, 2, 3)] == [['a', 'c'], ['a', 'c'], ['c', 'd']]
+    assert follower.offset == os.path.getsize(path)
+
+def test_follower_resumes_from_a_malformed_row(tmpdir):
+    path = write(tmpdir, b"0;1;a,1,2,person\n0;2;a,1\n")
+    follower = alchemist_trace.Follower(path, 2, 'person')
+    with pytest.raises(TraceError):
+        follower.poll()
+    assert len(follower.trace) == 1
+    with pytest.raises(TraceError): # Still there
+        follower.poll()
+    assert len(follower.trace) == 1
+
+def test_follower_detects_a_truncated_file(tmpdir):
+    path = write(tmpdir, NODES)
+    follower = alchemist_trace.Follower(path, 2, 'person')
+    follower.poll()
+    write(tmpdir, NODES[:5])
+    with pytest.raises(TraceError):
+        follower.poll()
+
+# A trace with the given steps: lists of (name, x, y)
+def makeTrace(*steps):
+    trace = Trace(2)
+    for i, step in enumerate(steps):
+        trace.times.append(float(i))
+        trace.realsteps.append(i)
+        trace.ids.append(trace.intern([name for name, x, y in step]))
+        trace.coords.append(np.array([(x, y) for name, x, y in step], dtype=np.float32).reshape(-1, 2))
+    return trace
+
+def test_interpolate_moves_the_nodes_in_both_steps():
+    trace = makeTrace([('a', 0, 0), ('b', 10, 10), ('c', 4, 4)], [('c', 8, 0), ('d', 1, 1), ('a', 2, 4)])
+    ids, coords = alchemist_trace.interpolate(trace, 1, 0.5)
+    assert ids.tolist() == trace.ids[0].tolist()
+    assert coords.tolist() == [[1, 2], [10, 10], [6, 2]]
+    assert trace.coords[0].tolist() == [[0, 0], [10, 10], [4, 4]] # Not changed in place
+
+def test_interpolate_at_the_last_step_or_towards_an_empty_one():
+    trace = makeTrace([('a', 0, 0)], [])
+    assert alchemist_trace.interpolate(trace, 1, 0.5)[1].tolist() == [[0, 0]]
+    assert alchemist_trace.interpolate(trace, 2, 0.5)[1].tolist() == []
+
+def test_transitions_and_tracks():
+    trace = makeTrace([('a', 0, 0), ('b', 1, 1)], [('b', 2, 2)], [('a', 3, 3), ('b', 4, 4)])
+    a, b = trace.index['a'], trace.index['b']
+    moves = alchemist_trace.transitions(trace)
+    assert [(enter.tolist(), exit.tolist()) for enter, exit in moves] == [([a, b], []), ([], [a]), ([a], [])]
+    tracks = dict((nid, (frames.tolist(), coords.tolist())) for nid, frames, coords in alchemist_trace.tracks(trace))
+    assert tracks[a] == ([1, 3], [[0, 0], [3, 3]])
+    assert tracks[b] == ([1, 2, 3], [[1, 1], [2, 2], [4, 4]])
+
+def test_visibility_keys():
+    keyframes, hidden = alchemist_trace.visibilityKeys(np.array([2, 3, 6]), 10)
+    assert keyframes.tolist() == [1, 2, 4, 6, 7]
+    assert hidden.tolist() == [True, False, True, False, True]
+    keyframes, hidden = alchemist_trace.visibilityKeys(np.array([1, 2]), 2)
+    assert keyframes.tolist() == [1] and hidden.tolist() == [False]
+
+def test_clock_locate():
+    trace = makeTrace([], [], [])
+    trace.times = [0.0, 1.0, 3.0]
+    clock = alchemist_trace.Clock(trace, 2)
+    assert clock.lastFrame() == 7
+    assert clock.locate(1) == (1, 0.0)
+    assert clock.locate(2) == (1, 0.5)
+    assert clock.locate(4) == (2, 0.25)
+    assert clock.locate(7) == (3, 0.0)
+    assert clock.locate(8) == (None, 0.0)
+    assert clock.locate(0) == (None, 0.0)
+
+def test_decimate():
+    trace = makeTrace(*[[('a', i, 0), ('b', i + 0.1, 0), ('c', i + 5, 0)] for i in range(6)])
+    assert alchemist_trace.decimate(trace) is trace
+    lod = alchemist_trace.decimate(trace, stride=2, spacing=1.0)
+    assert lod.realsteps == [0, 2, 4]
+    assert [names(lod, frame) for frame in (1, 2, 3)] == [['a', 'c']] * 3
+    assert len(trace.ids[0]) == 3 # Not changed
+    assert alchemist_trace.decimate(trace, interval=2.5).realsteps == [0, 3]
@@ -0,0 +1,46 @@
+# Tests of the merging of walls (alchemist_walls.mergeWalls)
+
+import numpy as np
+import alchemist_walls
+
+# Merged segments as a sorted list of rounded tuples
+def merge(segments, tolerance=alchemist_walls.SNAP_TOLERANCE):
+    merged, report = alchemist_walls.mergeWalls(np.array(segments, dtype=np.float64), tolerance)
+    return sorted(tuple(round(v, 6) for v in s) for s in merged.tolist()), report
+
+def test_overlapping_and_adjacent_walls_are_merged():
+    merged, report = merge([(0, 0, 2, 0), (1, 0, 3, 0), (3, 0, 5, 0), (5, 0, 4, 0)])
+    assert merged == [(0, 0, 5, 0)]
+    assert report['walls'] == 4 and report['merged'] == 1 and report['removed'] == 3
+
+def test_walls_with_a_gap_are_kept_apart():
+    merged, report = merge([(0, 1, 0, 2), (0, 3, 0, 4), (0, 2.5, 0, 2.8)])
+    assert merged == [(0, 1, 0, 2), (0, 2.5, 0, 2.8), (0, 3, 0, 4)]
+
+def test_parallel_walls_are_kept_apart():
+    merged, report = merge([(0, 0, 4, 0), (0, 1, 4, 1), (0, 0, 0, 4), (1, 0, 1, 4)])
+    assert len(merged) == 4
+
+def test_endpoints_are_snapped():
+    merged, report = merge([(0, 0, 2, 0.004), (2.003, 0, 3, 0)], tolerance=0.01)
+    assert merged == [(0, 0, 3, 0)]
+
+def test_diagonal_walls_only_lose_their_duplicates():
+    merged, report = merge([(0, 0, 1, 1), (1, 1, 0, 0), (1, 1, 2, 2), (0, 0, 1, 1)])
+    assert merged == [(0, 0, 1, 1), (1, 1, 2, 2)]
+
+def test_zero_length_walls_are_dropped():
+    merged, report = merge([(1, 1, 1, 1), (0, 0, 1, 0)])
+    assert merged == [(0, 0, 1, 0)]
+    assert report['degenerate'] == 1
+    assert report['length'] == 1.0 and report['merged_length'] == 1.0
+
+def test_no_walls():
+    merged, report = alchemist_walls.mergeWalls(np.empty((0, 4)))
+    assert merged.shape == (0, 4) and report['removed'] == 0
+
+def test_wall_geometry():
+    verts, faces = alchemist_walls.wallGeometry(np.array([(1, 2, 4, 2), (0, 0, 0, 1)], dtype=np.float64))
+    assert verts.shape == (16, 3) and faces.shape == (12, 4)
+    assert verts[0].tolist() == [1, 2, 0] and verts[6].tolist() == [4, 2, alchemist_walls.WALL_HEIGHT]
+    assert faces.min() == 0 and faces[6:].min() == 8